@@ -0,0 +1,93 @@
+"""
+Recall vs. latency of the IVF index against exact search.
+
+    python benchmarks/ann_recall.py --n 100000 --lists 256 --probes 1 2 4 8 16 32
+
+Uses synthetic clustered unit vectors, so absolute recall differs from the real
+archive; run it on an exported vectors.npy (--vectors) for representative numbers.
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from ann_index import IVFIndex  # noqa: E402
+
+
+def synthetic_vectors(n: int, dimension: int, n_clusters: int, rng: np.random.Generator) -> np.ndarray:
+    centers = rng.standard_normal((n_clusters, dimension)).astype(np.float32)
+    vectors = centers[rng.integers(0, n_clusters, n)] + 0.6 * rng.standard_normal((n, dimension)).astype(np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def exact_top_k(vectors: np.ndarray, query: np.ndarray, k: int) -> np.ndarray:
+    scores = vectors @ query
+    top = np.argpartition(-scores, k - 1)[:k]
+    return top[np.argsort(-scores[top])]
+
+
+def ivf_top_k(index: IVFIndex, vectors: np.ndarray, query: np.ndarray, k: int, n_probe: int) -> np.ndarray:
+    rows = index.candidates(query, n_probe)
+    scores = vectors[rows] @ query
+    k = min(k, len(rows))
+    top = np.argpartition(-scores, k - 1)[:k]
+    return rows[top[np.argsort(-scores[top])]]
+
+
+def percentile_ms(samples, q) -> float:
+    return float(np.percentile(samples, q) * 1000)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--vectors", help="Existing .npy matrix (e.g. data/local_index/vectors.npy)")
+    parser.add_argument("--n", type=int, default=50_000)
+    parser.add_argument("--dimension", type=int, default=1536)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--lists", type=int, default=256)
+    parser.add_argument("--probes", type=int, nargs="+", default=[1, 2, 4, 8, 16, 32, 64])
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    if args.vectors:
+        vectors = np.load(args.vectors, mmap_mode="r")
+        vectors = np.asarray(vectors[np.linalg.norm(vectors, axis=1) > 0], dtype=np.float32)
+    else:
+        vectors = synthetic_vectors(args.n, args.dimension, n_clusters=args.lists * 2, rng=rng)
+    queries = vectors[rng.choice(len(vectors), args.queries, replace=False)]
+    queries = queries + 0.05 * rng.standard_normal(queries.shape).astype(np.float32)
+    queries /= np.linalg.norm(queries, axis=1, keepdims=True)
+
+    start = time.perf_counter()
+    index = IVFIndex(vectors.shape[1], n_lists=args.lists)
+    index.train(vectors)
+    index.add(np.arange(len(vectors)), vectors)
+    print(f"{len(vectors)} x {vectors.shape[1]} vectors, build {time.perf_counter() - start:.1f}s")
+
+    truth, exact_times = [], []
+    for query in queries:
+        start = time.perf_counter()
+        truth.append(set(exact_top_k(vectors, query, args.k).tolist()))
+        exact_times.append(time.perf_counter() - start)
+    print(f"{'exact':>10}  recall@{args.k} 1.000  p50 {percentile_ms(exact_times, 50):7.2f}ms  "
+          f"p95 {percentile_ms(exact_times, 95):7.2f}ms")
+
+    for n_probe in args.probes:
+        recalls, times = [], []
+        for query, expected in zip(queries, truth):
+            start = time.perf_counter()
+            found = ivf_top_k(index, vectors, query, args.k, n_probe)
+            times.append(time.perf_counter() - start)
+            recalls.append(len(expected & set(found.tolist())) / args.k)
+        print(f"{'n_probe=' + str(n_probe):>10}  recall@{args.k} {np.mean(recalls):.3f}  "
+              f"p50 {percentile_ms(times, 50):7.2f}ms  p95 {percentile_ms(times, 95):7.2f}ms")
+
+
+if __name__ == "__main__":
+    main()
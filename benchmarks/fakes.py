@@ -0,0 +1,243 @@
+"""
+Deterministic local stand-ins for OpenAI and Pinecone, used by the offline benchmarks.
+
+The fake clients return the real openai response types (ChatCompletion, Stream of
+ChatCompletionChunk, CreateEmbeddingResponse), so haystack's OpenAIGenerator and
+OpenAI embedders run unmodified. Latency and streaming speed are configurable.
+"""
+import asyncio
+import hashlib
+import re
+import time
+from dataclasses import dataclass
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional
+
+import numpy as np
+from openai import Stream
+from openai.types import CompletionUsage, CreateEmbeddingResponse, Embedding
+from openai.types.chat import ChatCompletion, ChatCompletionChunk, ChatCompletionMessage
+from openai.types.chat.chat_completion import Choice
+from openai.types.chat.chat_completion_chunk import Choice as ChunkChoice, ChoiceDelta
+from openai.types.create_embedding_response import Usage
+
+from keyword_index import analyze
+from local_store import LocalDocumentStore
+
+FILLER_WORDS = (
+    "het kasteel werd in de zeventiende eeuw herbouwd na de verwoesting door de franse troepen "
+    "en bleef daarna eeuwenlang in bezit van de familie van reede die het archief zorgvuldig bewaarde"
+).split()
+REPHRASE_QUERY_RE = re.compile(r"Gebruikersvraag:\s*(.*?)\s*Herschreven vraag:", re.S)
+
+
+def estimate_tokens(text: str) -> int:
+    return max(1, len(text) // 4)
+
+
+@dataclass
+class FakeLatency:
+    embed_seconds: float = 0.05  # per request
+    embed_seconds_per_input: float = 0.0005  # extra per tekst in een batch
+    ttft_seconds: float = 0.4
+    tokens_per_second: float = 60.0
+    reply_tokens: int = 120
+    rephrase_tokens: int = 15
+
+
+class FakeBackend:
+    """Shared behaviour of the sync and async fake clients."""
+
+    def __init__(self, latency: Optional[FakeLatency] = None, dimension: int = 1536):
+        self.latency = latency or FakeLatency()
+        self.dimension = dimension
+        self.calls = {"embeddings": 0, "chat": 0}
+
+    def embed(self, text: str) -> List[float]:
+        # Feature hashing over de BM25-termen: teksten met dezelfde woorden liggen dicht bij elkaar
+        vector = np.zeros(self.dimension, dtype=np.float32)
+        for term in analyze(text) or [text]:
+            digest = hashlib.blake2b(term.encode("utf-8"), digest_size=8).digest()
+            bucket = int.from_bytes(digest[:4], "little") % self.dimension
+            vector[bucket] += 1.0 if digest[4] & 1 else -1.0
+        seed = int.from_bytes(hashlib.blake2b(text.encode("utf-8"), digest_size=4).digest(), "little")
+        vector += 0.05 * np.random.default_rng(seed).standard_normal(self.dimension).astype(np.float32)
+        return (vector / np.linalg.norm(vector)).tolist()
+
+    def embedding_response(self, model: str, inputs: Any, dimensions: Optional[int] = None) -> CreateEmbeddingResponse:
+        texts = [inputs] if isinstance(inputs, str) else list(inputs)
+        self.calls["embeddings"] += 1
+        tokens = sum(estimate_tokens(t) for t in texts)
+        embeddings = [self.embed(t) for t in texts]
+        if dimensions:
+            # Zoals de API: afkappen en opnieuw normaliseren
+            embeddings = [(v[:dimensions] / np.linalg.norm(v[:dimensions])).tolist() for v in np.asarray(embeddings)]
+        return CreateEmbeddingResponse(
+            data=[Embedding(embedding=e, index=i, object="embedding") for i, e in enumerate(embeddings)],
+            model=model,
+            object="list",
+            usage=Usage(prompt_tokens=tokens, total_tokens=tokens),
+        )
+
+    def embed_delay(self, inputs: Any) -> float:
+        n = 1 if isinstance(inputs, str) else len(inputs)
+        return self.latency.embed_seconds + n * self.latency.embed_seconds_per_input
+
+    def reply_words(self, messages: List[Dict[str, Any]]) -> List[str]:
+        prompt = str(messages[-1]["content"])
+        match = REPHRASE_QUERY_RE.search(prompt)
+        if match:
+            # Rephrase prompt: geef de vraag terug, zodat retrieval betekenisvol blijft
+            return (match.group(1) or "vraag").split()
+        seed = int.from_bytes(hashlib.blake2b(prompt.encode("utf-8"), digest_size=4).digest(), "little")
+        rng = np.random.default_rng(seed)
+        return [FILLER_WORDS[i] for i in rng.integers(0, len(FILLER_WORDS), self.latency.reply_tokens)]
+
+    def completion(self, model: str, messages: List[Dict[str, Any]]) -> ChatCompletion:
+        self.calls["chat"] += 1
+        words = self.reply_words(messages)
+        return ChatCompletion(
+            id="fake",
+            choices=[
+                Choice(
+                    finish_reason="stop",
+                    index=0,
+                    message=ChatCompletionMessage(role="assistant", content=" ".join(words)),
+                )
+            ],
+            created=int(time.time()),
+            model=model,
+            object="chat.completion",
+            usage=self.usage(messages, len(words)),
+        )
+
+    def completion_delay(self, n_tokens: int) -> float:
+        return self.latency.ttft_seconds + n_tokens / self.latency.tokens_per_second
+
+    def chunks(self, model: str, messages: List[Dict[str, Any]], include_usage: bool) -> Iterator[ChatCompletionChunk]:
+        self.calls["chat"] += 1
+        words = self.reply_words(messages)
+        for i, word in enumerate(words):
+            last = i == len(words) - 1
+            yield ChatCompletionChunk(
+                id="fake",
+                choices=[
+                    ChunkChoice(
+                        delta=ChoiceDelta(content=word if i == 0 else " " + word),
+                        finish_reason="stop" if last else None,
+                        index=0,
+                    )
+                ],
+                created=int(time.time()),
+                model=model,
+                object="chat.completion.chunk",
+            )
+        if include_usage:
+            yield ChatCompletionChunk(
+                id="fake",
+                choices=[],
+                created=int(time.time()),
+                model=model,
+                object="chat.completion.chunk",
+                usage=self.usage(messages, len(words)),
+            )
+
+    @staticmethod
+    def usage(messages: List[Dict[str, Any]], completion_tokens: int) -> CompletionUsage:
+        prompt_tokens = sum(estimate_tokens(str(m.get("content") or "")) for m in messages)
+        return CompletionUsage(
+            prompt_tokens=prompt_tokens,
+            completion_tokens=completion_tokens,
+            total_tokens=prompt_tokens + completion_tokens,
+        )
+
+
+class FakeStream(Stream):
+    """openai.Stream over pre-built chunks; haystack checks isinstance(completion, Stream)."""
+
+    def __init__(self, chunks: Iterator[ChatCompletionChunk], latency: FakeLatency):
+        self._iterator = self._paced(chunks, latency)
+
+    @staticmethod
+    def _paced(chunks: Iterator[ChatCompletionChunk], latency: FakeLatency) -> Iterator[ChatCompletionChunk]:
+        time.sleep(latency.ttft_seconds)
+        for i, chunk in enumerate(chunks):
+            if i:
+                time.sleep(1 / latency.tokens_per_second)
+            yield chunk
+
+    def close(self) -> None:
+        self._iterator.close()
+
+
+class _Namespace:
+    def __init__(self, **attributes):
+        self.__dict__.update(attributes)
+
+
+class FakeOpenAI:
+    """Drop-in for openai.OpenAI as used by the haystack components."""
+
+    def __init__(self, backend: FakeBackend):
+        self.backend = backend
+        self.chat = _Namespace(completions=_Namespace(create=self._create_completion))
+        self.embeddings = _Namespace(create=self._create_embedding)
+
+    def with_options(self, **options) -> "FakeOpenAI":
+        return self
+
+    def _create_completion(self, model: str, messages: List[Dict[str, Any]], stream: bool = False, stream_options=None, **kwargs):
+        if stream:
+            include_usage = bool(stream_options and stream_options.get("include_usage"))
+            return FakeStream(self.backend.chunks(model, messages, include_usage), self.backend.latency)
+        response = self.backend.completion(model, messages)
+        time.sleep(self.backend.completion_delay(response.usage.completion_tokens))
+        return response
+
+    def _create_embedding(self, model: str, input: Any, dimensions: Optional[int] = None, **kwargs) -> CreateEmbeddingResponse:
+        time.sleep(self.backend.embed_delay(input))
+        return self.backend.embedding_response(model, input, dimensions)
+
+
+class FakeAsyncOpenAI:
+    """Drop-in for openai.AsyncOpenAI as used by async_pipeline."""
+
+    def __init__(self, backend: FakeBackend):
+        self.backend = backend
+        self.chat = _Namespace(completions=_Namespace(create=self._create_completion))
+        self.embeddings = _Namespace(create=self._create_embedding)
+
+    async def _create_completion(self, model: str, messages: List[Dict[str, Any]], stream: bool = False, stream_options=None, **kwargs):
+        if stream:
+            include_usage = bool(stream_options and stream_options.get("include_usage"))
+            return self._paced(self.backend.chunks(model, messages, include_usage))
+        response = self.backend.completion(model, messages)
+        await asyncio.sleep(self.backend.completion_delay(response.usage.completion_tokens))
+        return response
+
+    async def _paced(self, chunks: Iterator[ChatCompletionChunk]) -> AsyncIterator[ChatCompletionChunk]:
+        await asyncio.sleep(self.backend.latency.ttft_seconds)
+        for i, chunk in enumerate(chunks):
+            if i:
+                await asyncio.sleep(1 / self.backend.latency.tokens_per_second)
+            yield chunk
+
+    async def _create_embedding(self, model: str, input: Any, dimensions: Optional[int] = None, **kwargs) -> CreateEmbeddingResponse:
+        await asyncio.sleep(self.backend.embed_delay(input))
+        return self.backend.embedding_response(model, input, dimensions)
+
+
+class RemoteDocumentStoreStandIn(LocalDocumentStore):
+    """LocalDocumentStore with a fixed network round trip per query/write, like a hosted index."""
+
+    def __init__(self, *args, query_latency: float = 0.03, write_latency: float = 0.05, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.query_latency = query_latency
+        self.write_latency = write_latency
+
+    def embedding_retrieval(self, *args, **kwargs):
+        time.sleep(self.query_latency)
+        return super().embedding_retrieval(*args, **kwargs)
+
+    def write_documents(self, *args, **kwargs):
+        time.sleep(self.write_latency)
+        return super().write_documents(*args, **kwargs)
@@ -0,0 +1,153 @@
+"""
+Checks ImageCache against a local HTTP server.
+
+    python benchmarks/image_cache_check.py
+
+A throwaway http.server on localhost serves generated PNGs and a 404. The script checks
+that concurrent requests for one URL share a single download, that a failed URL is not
+retried within `failure_ttl` but is retried after it, that stored files are JPEG
+thumbnails no larger than `thumbnail_size`, and that the least recently used thumbnail
+is evicted once `max_bytes` is exceeded. Exits with status 1 on a failed check, so it
+can run in CI.
+"""
+import io
+import os
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import List
+
+from PIL import Image
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from image_cache import ImageCache  # noqa: E402
+
+THUMBNAIL_SIZE = 128
+# De server wacht zo lang per afbeelding, zodat gelijktijdige verzoeken elkaar zeker overlappen
+RESPONSE_DELAY = 0.3
+
+
+def make_png(width: int = 1600, height: int = 1200) -> bytes:
+    image = Image.linear_gradient("L").resize((width, height)).convert("RGB")
+    out = io.BytesIO()
+    image.save(out, format="PNG")
+    return out.getvalue()
+
+
+class ArchiveHandler(BaseHTTPRequestHandler):
+    png = make_png()
+    requests: Counter = Counter()
+    lock = threading.Lock()
+
+    def do_GET(self):
+        with self.lock:
+            self.requests[self.path] += 1
+        if self.path.startswith("/missing"):
+            self.send_error(404)
+            return
+        time.sleep(RESPONSE_DELAY)
+        self.send_response(200)
+        self.send_header("Content-Type", "image/png")
+        self.send_header("Content-Length", str(len(self.png)))
+        self.end_headers()
+        self.wfile.write(self.png)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class Checks:
+    def __init__(self):
+        self.failures = 0
+
+    def check(self, ok: bool, message: str) -> None:
+        if not ok:
+            self.failures += 1
+        print(f"{'ok  ' if ok else 'FAIL'} {message}")
+
+
+def check_single_flight(checks: Checks, cache: ImageCache, base: str) -> None:
+    url = f"{base}/single.png"
+    barrier = threading.Barrier(8)
+    results: List[str] = []
+
+    def worker():
+        barrier.wait()
+        results.append(cache.get(url))
+
+    threads = [threading.Thread(target=worker) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    checks.check(ArchiveHandler.requests["/single.png"] == 1, f"8 concurrent gets, {ArchiveHandler.requests['/single.png']} download(s)")
+    checks.check(len(set(results)) == 1 and results[0] is not None, "every caller got the same cached file")
+
+
+def check_thumbnail(checks: Checks, cache: ImageCache, base: str) -> None:
+    file_path = cache.get(f"{base}/single.png")
+    with Image.open(file_path) as image:
+        checks.check(image.format == "JPEG", f"stored as {image.format}")
+        checks.check(max(image.size) <= THUMBNAIL_SIZE, f"thumbnail is {image.size[0]}x{image.size[1]}, limit {THUMBNAIL_SIZE}")
+
+
+def check_failure_ttl(checks: Checks, workdir: str, base: str) -> None:
+    cache = ImageCache(os.path.join(workdir, "failures"), thumbnail_size=THUMBNAIL_SIZE, failure_ttl=0.5)
+    url = f"{base}/missing.png"
+    try:
+        first, second = cache.get(url), cache.get(url)
+        checks.check(first is None and second is None, "a missing image returns None")
+        checks.check(ArchiveHandler.requests["/missing.png"] == 1, "no retry within failure_ttl")
+        time.sleep(0.6)
+        cache.get(url)
+        checks.check(ArchiveHandler.requests["/missing.png"] == 2, "retried after failure_ttl")
+    finally:
+        cache.close()
+
+
+def check_eviction(checks: Checks, workdir: str, base: str, thumbnail_bytes: int) -> None:
+    # Ruimte voor precies drie (identieke) thumbnails
+    cache = ImageCache(os.path.join(workdir, "lru"), max_bytes=3 * thumbnail_bytes, thumbnail_size=THUMBNAIL_SIZE)
+    urls = {name: f"{base}/{name}.png" for name in "abcd"}
+    try:
+        for name in "abc":
+            cache.get(urls[name])
+            time.sleep(0.01)
+        # "a" recent gebruikt, dus "b" is nu het langst niet gebruikt
+        cache.cached_path(urls["a"])
+        time.sleep(0.01)
+        cache.get(urls["d"])
+        kept = {name for name, url in urls.items() if cache.cached_path(url) is not None}
+        checks.check(kept == {"a", "c", "d"}, f"kept {sorted(kept)} after exceeding max_bytes, expected ['a', 'c', 'd']")
+        stats = cache.stats()
+        checks.check(stats["bytes"] <= cache.max_bytes, f"{stats['bytes']} bytes cached, limit {cache.max_bytes}")
+    finally:
+        cache.close()
+
+
+def main() -> int:
+    server = ThreadingHTTPServer(("127.0.0.1", 0), ArchiveHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base = f"http://127.0.0.1:{server.server_address[1]}"
+    checks = Checks()
+    with tempfile.TemporaryDirectory() as workdir:
+        cache = ImageCache(os.path.join(workdir, "images"), thumbnail_size=THUMBNAIL_SIZE)
+        try:
+            check_single_flight(checks, cache, base)
+            check_thumbnail(checks, cache, base)
+            thumbnail_bytes = cache.stats()["bytes"]
+        finally:
+            cache.close()
+        check_failure_ttl(checks, workdir, base)
+        check_eviction(checks, workdir, base, thumbnail_bytes)
+    server.shutdown()
+    print(f"{'all checks passed' if not checks.failures else f'{checks.failures} check(s) failed'}")
+    return 1 if checks.failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
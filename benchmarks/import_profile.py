@@ -0,0 +1,133 @@
+"""
+Import-time profile of the entry points, to keep cold starts in check.
+
+    python benchmarks/import_profile.py
+    python benchmarks/import_profile.py pipelines server --repeat 5 --top 15
+    python benchmarks/import_profile.py --warm-up        # also time until the QA pipeline is ready
+
+Every module is imported in a fresh interpreter with `python -X importtime`, `--repeat`
+times. The report gives the median import time per module and the packages that take
+the most time, grouped by top-level package. "startup" is what the Streamlit apps import
+before their first page. `--warm-up` also measures, with the local document store and a dummy
+API key (so nothing goes over the network), how long startup.warm_up_in_background takes
+to deliver a ready pipeline.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+from collections import defaultdict
+from typing import Any, Dict, List, Tuple
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+SRC_DIR = os.path.join(BENCH_DIR, "..", "src")
+DEFAULT_MODULES = ["startup", "streaming_render", "pipelines", "async_pipeline", "server", "evaluate"]
+
+WARM_UP_SCRIPT = """
+import json, time
+start = time.perf_counter()
+from startup import warm_up_in_background
+future = warm_up_in_background()
+first_page = time.perf_counter() - start
+future.result()
+print(json.dumps({"first_page": first_page, "pipeline_ready": time.perf_counter() - start}))
+"""
+
+
+def environment() -> Dict[str, str]:
+    env = dict(os.environ)
+    env.setdefault("OPENAI_API_KEY", "sk-offline-profile")
+    env.setdefault("PINECONE_API_KEY", "offline-profile")
+    env["HAYSTACK_TELEMETRY_ENABLED"] = "False"
+    env["PYTHONDONTWRITEBYTECODE"] = "1"
+    return env
+
+def parse_importtime(stderr: str) -> List[Tuple[str, int, int, int]]:
+    """(module, depth, self us, cumulative us) per line of -X importtime output."""
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        depth = (len(name) - len(name.lstrip(" "))) // 2
+        rows.append((name.strip(), depth, int(self_us), int(cumulative_us)))
+    return rows
+
+def profile(module: str, env: Dict[str, str]) -> Dict[str, Any]:
+    completed = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=SRC_DIR, env=env, capture_output=True, text=True,
+    )
+    if completed.returncode != 0:
+        raise RuntimeError(f"import {module} failed:\n{completed.stderr[-2000:]}")
+    rows = parse_importtime(completed.stderr)
+    packages: Dict[str, int] = defaultdict(int)
+    for name, _, self_us, _ in rows:
+        packages[name.split(".")[0]] += self_us
+    return {
+        "seconds": sum(self_us for _, _, self_us, _ in rows) / 1e6,
+        "modules": len(rows),
+        "packages": {name: us / 1e6 for name, us in packages.items()},
+    }
+
+def warm_up_times(env: Dict[str, str], workdir: str) -> Dict[str, float]:
+    env = {
+        **env,
+        "DOCSTORE_BACKEND": "local",
+        "LOCAL_DOCSTORE_PATH": os.path.join(workdir, "store"),
+        "KEYWORD_INDEX_PATH": os.path.join(workdir, "keyword_index.sqlite"),
+        "METADATA_INDEX_PATH": os.path.join(workdir, "metadata_index.sqlite"),
+        "EMBEDDING_CHECKPOINT_PATH": os.path.join(workdir, "embedding_checkpoint.sqlite"),
+        "IMAGE_CACHE_PATH": os.path.join(workdir, "image_cache"),
+        "CONVERSATION_STORE_PATH": os.path.join(workdir, "conversations.sqlite"),
+        "RERANKER_MODEL": env.get("RERANKER_MODEL", ""),
+    }
+    completed = subprocess.run(
+        [sys.executable, "-c", WARM_UP_SCRIPT], cwd=SRC_DIR, env=env, capture_output=True, text=True
+    )
+    if completed.returncode != 0:
+        raise RuntimeError(f"warm-up failed:\n{completed.stderr[-2000:]}")
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("modules", nargs="*", default=DEFAULT_MODULES)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--top", type=int, default=10, help="Packages listed per module")
+    parser.add_argument("--warm-up", action="store_true", help="Also time startup.warm_up_in_background")
+    parser.add_argument("--output", help="Write the report as JSON")
+    args = parser.parse_args()
+
+    env = environment()
+    report: Dict[str, Any] = {"python": sys.version.split()[0], "modules": {}}
+    for module in args.modules:
+        runs = [profile(module, env) for _ in range(args.repeat)]
+        median = statistics.median(run["seconds"] for run in runs)
+        packages = {
+            name: statistics.median(run["packages"].get(name, 0.0) for run in runs)
+            for name in runs[0]["packages"]
+        }
+        top = sorted(packages.items(), key=lambda item: -item[1])[: args.top]
+        report["modules"][module] = {"seconds": median, "modules": runs[0]["modules"], "top_packages": dict(top)}
+        print(f"{module:<20} {median * 1000:8.1f}ms  ({runs[0]['modules']} modules)")
+        for name, seconds in top:
+            print(f"    {name:<28} {seconds * 1000:8.1f}ms")
+
+    if args.warm_up:
+        import tempfile
+
+        runs = [warm_up_times(env, tempfile.mkdtemp(prefix="import_profile_")) for _ in range(args.repeat)]
+        report["warm_up"] = {key: statistics.median(run[key] for run in runs) for key in runs[0]}
+        print(f"startup: first page after {report['warm_up']['first_page'] * 1000:.0f}ms, "
+              f"QA pipeline ready after {report['warm_up']['pipeline_ready'] * 1000:.0f}ms")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,353 @@
+"""
+Offline throughput/latency benchmark of the indexing and QA pipelines.
+
+    python benchmarks/qa_bench.py --concurrency 8 --repeat 3
+    python benchmarks/qa_bench.py --mode async --concurrency 32 --compare benchmarks/results/<earlier>.json
+
+OpenAI and Pinecone are replaced by the deterministic stand-ins in fakes.py, so the
+numbers measure this repository's code plus the configured fake latencies. The real
+pipeline graphs from pipelines.py are used. Results are written to benchmarks/results/
+as JSON, named after the current commit, so runs can be compared with --compare.
+"""
+import argparse
+import json
+import logging
+import os
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCH_DIR, "..", "src"))
+sys.path.insert(0, BENCH_DIR)
+
+SUBJECTS = [
+    "kasteel", "ridderzaal", "landgoed", "tuin", "familie van reede", "godard van reede", "keizer wilhelm",
+    "franse troepen", "rentmeester", "huishouden", "kapel", "stallen", "oranjerie", "bibliotheek",
+]
+PHRASES = [
+    "In het archief bevindt zich een brief over {s} uit {y}.",
+    "De rekeningen van {y} vermelden uitgaven voor {s}.",
+    "Een tekening van {s} toont de toestand rond {y}.",
+    "Volgens de inventaris werd {s} in {y} hersteld.",
+    "De rentmeester schreef in {y} uitvoerig over {s}.",
+    "Na {y} kwam {s} in handen van een nieuwe eigenaar.",
+]
+
+
+def synthetic_corpus(n: int, seed: int) -> List[Dict[str, Any]]:
+    rng = random.Random(seed)
+    records = []
+    for i in range(n):
+        sentences = [
+            rng.choice(PHRASES).format(s=rng.choice(SUBJECTS), y=rng.randint(1600, 1950))
+            for _ in range(rng.randint(3, 9))
+        ]
+        records.append({
+            "content": " ".join(sentences),
+            "meta": {"invnr": str(i), "representatieve\nafbeelding": f"https://example.org/images/{i}.jpg"},
+        })
+    return records
+
+def read_jsonl(path: str) -> List[Dict[str, Any]]:
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+def percentiles(samples: List[float]) -> Dict[str, float]:
+    if not samples:
+        return {}
+    values = np.asarray(samples)
+    return {
+        "mean": float(values.mean()),
+        "p50": float(np.percentile(values, 50)),
+        "p95": float(np.percentile(values, 95)),
+        "p99": float(np.percentile(values, 99)),
+    }
+
+def peak_rss_mb() -> float:
+    # ru_maxrss is in KB op Linux, in bytes op macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / (1024 * 1024) if sys.platform == "darwin" else rss / 1024
+
+def git_commit() -> str:
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=BENCH_DIR, text=True, stderr=subprocess.DEVNULL
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def configure_environment(args, workdir: str) -> None:
+    # pipelines.py leest de configuratie bij import, dus dit moet eerst
+    os.environ.setdefault("OPENAI_API_KEY", "sk-offline-benchmark")
+    os.environ.setdefault("PINECONE_API_KEY", "offline-benchmark")
+    os.environ["DOCSTORE_BACKEND"] = "local"
+    os.environ["LOCAL_DOCSTORE_PATH"] = os.path.join(workdir, "store")
+    os.environ["LOCAL_DOCSTORE_INDEX"] = args.index
+    os.environ["LOCAL_DOCSTORE_QUANTIZATION"] = args.quantization or ""
+    os.environ["EMBEDDING_DIMENSIONS"] = str(args.dimensions)
+    # Alles wat op schijf komt in de tijdelijke map; anders belanden synthetische documenten in data/
+    os.environ["KEYWORD_INDEX_PATH"] = os.path.join(workdir, "keyword_index.sqlite")
+    os.environ["METADATA_INDEX_PATH"] = os.path.join(workdir, "metadata_index.sqlite")
+    os.environ["EMBEDDING_CHECKPOINT_PATH"] = os.path.join(workdir, "embedding_checkpoint.sqlite")
+    os.environ["IMAGE_CACHE_PATH"] = os.path.join(workdir, "image_cache")
+    os.environ["CONVERSATION_STORE_PATH"] = os.path.join(workdir, "conversations.sqlite")
+    os.environ["EMBEDDING_CACHE_PATH"] = ""
+    os.environ["METRICS_ENABLED"] = "false"
+    os.environ["HAYSTACK_TELEMETRY_ENABLED"] = "False"
+    if args.no_cache:
+        os.environ["EMBEDDING_CACHE_SIZE"] = "0"
+        os.environ["ANSWER_CACHE_THRESHOLD"] = "2"  # cosine similarity haalt dit nooit
+
+
+def run_indexing(pipelines, store, corpus: List[Dict[str, Any]], batch_size: int) -> Dict[str, Any]:
+    from haystack import Document
+
+    pipeline = pipelines.create_indexing_pipeline(docstore=store, convert_pdfs=False)
+    documents = [Document(content=r["content"], meta=r.get("meta", {})) for r in corpus]
+    batch_times = []
+    start = time.perf_counter()
+    for i in range(0, len(documents), batch_size):
+        batch_start = time.perf_counter()
+        pipeline.run({"cleaner": {"documents": documents[i : i + batch_size]}})
+        batch_times.append(time.perf_counter() - batch_start)
+    seconds = time.perf_counter() - start
+    if pipelines.LOCAL_DOCSTORE_INDEX == "ivf":
+        store.train_index()
+    return {
+        "documents": len(documents),
+        "chunks": store.count_documents(),
+        "seconds": seconds,
+        "documents_per_second": len(documents) / seconds if seconds else 0.0,
+        "batch_seconds": percentiles(batch_times),
+    }
+
+
+class RequestTimer:
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.first_token: Optional[float] = None
+        self.chunks = 0
+
+        # Pipeline.run deep-copiet zijn inputs; een gewone functie blijft daarbij dezelfde, een bound method niet
+        def on_chunk(chunk) -> None:
+            if self.first_token is None:
+                self.first_token = time.perf_counter() - self.start
+            self.chunks += 1
+
+        self.on_chunk = on_chunk
+
+
+def run_sync(pipeline, requests: List[Dict[str, Any]], concurrency: int) -> List[Dict[str, Any]]:
+    def one(request):
+        timer = RequestTimer()
+        history = request.get("history") or []
+        try:
+            pipeline.run(data={
+                "rephrase_router": {"query": request["query"], "history": history},
+                "context_assembler": {"history": history},
+                "answer_llm": {"streaming_callback": timer.on_chunk},
+            })
+            error = None
+        except Exception as e:
+            error = repr(e)
+        return {"seconds": time.perf_counter() - timer.start, "ttft": timer.first_token, "error": error}
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        return list(pool.map(one, requests))
+
+def run_async(qa, requests: List[Dict[str, Any]], concurrency: int) -> List[Dict[str, Any]]:
+    import asyncio
+
+    async def main():
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def one(request):
+            async with semaphore:
+                timer = RequestTimer()
+                try:
+                    await qa.run(request["query"], request.get("history") or [], streaming_callback=timer.on_chunk)
+                    error = None
+                except Exception as e:
+                    error = repr(e)
+                return {"seconds": time.perf_counter() - timer.start, "ttft": timer.first_token, "error": error}
+
+        return await asyncio.gather(*(one(r) for r in requests))
+
+    return asyncio.run(main())
+
+
+def compare(current: Dict[str, Any], baseline: Dict[str, Any]) -> None:
+    def walk(result, *keys):
+        for key in keys:
+            result = (result or {}).get(key)
+        return result
+
+    rows = [
+        ("qa throughput (req/s)", ("qa", "throughput"), True),
+        ("qa latency p50 (s)", ("qa", "latency", "p50"), False),
+        ("qa latency p95 (s)", ("qa", "latency", "p95"), False),
+        ("qa ttft p50 (s)", ("qa", "ttft", "p50"), False),
+        ("qa ttft p95 (s)", ("qa", "ttft", "p95"), False),
+        ("indexing docs/s", ("indexing", "documents_per_second"), True),
+        ("peak rss (MB)", ("memory", "peak_rss_mb"), False),
+    ]
+    stages = sorted(set(walk(current, "qa", "stages") or {}) | set(walk(baseline, "qa", "stages") or {}))
+    rows += [(f"stage {s} p95 (s)", ("qa", "stages", s, "p95"), False) for s in stages]
+
+    print(f"\nvs {baseline.get('commit')} ({baseline.get('timestamp')}):")
+    for label, keys, higher_is_better in rows:
+        new, old = walk(current, *keys), walk(baseline, *keys)
+        if new is None or old is None:
+            continue
+        delta = (new - old) / old * 100 if old else 0.0
+        worse = delta < -5 if higher_is_better else delta > 5
+        print(f"  {label:<40} {old:10.4f} -> {new:10.4f}  {delta:+6.1f}%{'  <-- regression' if worse else ''}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--queries", default=os.path.join(BENCH_DIR, "queries.jsonl"), help="JSONL with query (+ history)")
+    parser.add_argument("--corpus", help="JSONL with content + meta; default is a synthetic corpus")
+    parser.add_argument("--documents", type=int, default=2000, help="Size of the synthetic corpus")
+    parser.add_argument("--index", choices=["exact", "ivf"], default="exact")
+    parser.add_argument("--index-batch", type=int, default=100)
+    parser.add_argument("--dimensions", type=int, default=1536, help="Embedding dimensions (text-embedding-3 shortening)")
+    parser.add_argument("--quantization", choices=["int8", "float16"], help="Quantized local store with rescoring")
+    parser.add_argument("--mode", choices=["sync", "async"], default="sync")
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--repeat", type=int, default=1, help="Replay the query set this many times")
+    parser.add_argument("--model", default="gpt-4o-mini")
+    parser.add_argument("--no-cache", action="store_true", help="Disable the embedding and answer caches")
+    parser.add_argument("--embed-latency", type=float, default=0.05)
+    parser.add_argument("--ttft", type=float, default=0.4)
+    parser.add_argument("--tokens-per-second", type=float, default=60.0)
+    parser.add_argument("--reply-tokens", type=int, default=120)
+    parser.add_argument("--store-latency", type=float, default=0.03, help="Round trip per vector store query")
+    parser.add_argument("--tracemalloc", action="store_true", help="Also report peak Python allocations (slow)")
+    parser.add_argument("--output", default=os.path.join(BENCH_DIR, "results"))
+    parser.add_argument("--compare", help="Earlier result JSON to compare against")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    workdir = tempfile.mkdtemp(prefix="qa_bench_")
+    configure_environment(args, workdir)
+    if args.tracemalloc:
+        tracemalloc.start()
+
+    import pipelines
+    from async_pipeline import AsyncQAPipeline
+    from fakes import FakeAsyncOpenAI, FakeBackend, FakeLatency, FakeOpenAI, RemoteDocumentStoreStandIn
+    from instrumentation import enable_instrumentation
+
+    backend = FakeBackend(FakeLatency(
+        embed_seconds=args.embed_latency,
+        ttft_seconds=args.ttft,
+        tokens_per_second=args.tokens_per_second,
+        reply_tokens=args.reply_tokens,
+    ))
+    # Alle componenten halen hun client via get_openai_client / get_async_openai_client
+    pipelines._openai_client = FakeOpenAI(backend)
+    pipelines._async_openai_client = FakeAsyncOpenAI(backend)
+    store = RemoteDocumentStoreStandIn(
+        path=pipelines.LOCAL_DOCSTORE_PATH,
+        index=args.index,
+        n_lists=pipelines.LOCAL_DOCSTORE_N_LISTS,
+        n_probe=pipelines.LOCAL_DOCSTORE_N_PROBE,
+        dimension=pipelines.EMBEDDING_DIMENSIONS,
+        quantization=pipelines.LOCAL_DOCSTORE_QUANTIZATION,
+        rescore=pipelines.LOCAL_DOCSTORE_RESCORE,
+        query_latency=args.store_latency,
+        write_latency=args.store_latency,
+    )
+    registry = enable_instrumentation()
+
+    corpus = read_jsonl(args.corpus) if args.corpus else synthetic_corpus(args.documents, args.seed)
+    indexing = run_indexing(pipelines, store, corpus, args.index_batch)
+    print(f"indexing: {indexing['documents']} documents -> {indexing['chunks']} chunks "
+          f"in {indexing['seconds']:.1f}s ({indexing['documents_per_second']:.1f} docs/s)")
+
+    pipeline = pipelines.get_qa_pipeline(args.model)
+    pipeline.get_component("pinecone_retriever").document_store = store
+    requests = read_jsonl(args.queries) * args.repeat
+    rss_before = peak_rss_mb()
+    start = time.perf_counter()
+    if args.mode == "async":
+        results = run_async(AsyncQAPipeline(pipeline, pipelines._async_openai_client), requests, args.concurrency)
+    else:
+        results = run_sync(pipeline, requests, args.concurrency)
+    seconds = time.perf_counter() - start
+
+    stage_names = set(pipeline.graph.nodes)
+    snapshot = registry.snapshot()
+    stages = {
+        key.split('"')[1]: value
+        for key, value in snapshot.get("qa_stage_seconds", {}).items()
+        if key.split('"')[1] in stage_names
+    }
+    errors = [r["error"] for r in results if r["error"]]
+    qa = {
+        "mode": args.mode,
+        "concurrency": args.concurrency,
+        "requests": len(results),
+        "errors": len(errors),
+        "seconds": seconds,
+        "throughput": len(results) / seconds if seconds else 0.0,
+        "latency": percentiles([r["seconds"] for r in results if not r["error"]]),
+        "ttft": percentiles([r["ttft"] for r in results if r["ttft"] is not None]),
+        "stages": stages,
+        "caches": {
+            "embedding": pipelines.get_embedding_cache().stats(),
+            "answer": pipeline.get_component("answer_llm").cache.stats(),
+            "rephrase_router": pipeline.get_component("rephrase_router").stats(),
+        },
+        "fake_api_calls": dict(backend.calls),
+    }
+    memory = {"peak_rss_mb": peak_rss_mb(), "peak_rss_before_qa_mb": rss_before}
+    if args.tracemalloc:
+        memory["tracemalloc_peak_mb"] = tracemalloc.get_traced_memory()[1] / (1024 * 1024)
+
+    print(f"qa ({args.mode}, concurrency {args.concurrency}): {len(results)} requests in {seconds:.1f}s, "
+          f"{qa['throughput']:.2f} req/s, {len(errors)} errors")
+    for label, values in (("latency", qa["latency"]), ("ttft", qa["ttft"])):
+        if values:
+            print(f"  {label:<22} p50 {values['p50'] * 1000:8.1f}ms  p95 {values['p95'] * 1000:8.1f}ms  "
+                  f"p99 {values['p99'] * 1000:8.1f}ms")
+    for name, values in sorted(stages.items(), key=lambda item: -item[1]["p95"]):
+        print(f"  {name:<22} p50 {values['p50'] * 1000:8.1f}ms  p95 {values['p95'] * 1000:8.1f}ms  "
+              f"p99 {values['p99'] * 1000:8.1f}ms  (n={values['count']})")
+    print(f"  peak rss {memory['peak_rss_mb']:.0f} MB")
+    if errors:
+        print(f"  first error: {errors[0]}")
+
+    result = {
+        "commit": git_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "config": vars(args),
+        "indexing": indexing,
+        "qa": qa,
+        "memory": memory,
+    }
+    os.makedirs(args.output, exist_ok=True)
+    path = os.path.join(args.output, f"{time.strftime('%Y%m%d-%H%M%S')}_{result['commit']}_{args.mode}.json")
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(result, f, indent=2)
+    print(f"results written to {path}")
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            compare(result, json.load(f))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+"""
+Recall, latency and index size of shortened and quantized embeddings in the local store.
+
+    python benchmarks/quantization_recall.py --n 50000 --dimensions 1536 512 256 --rescore 1 4
+    python benchmarks/quantization_recall.py --vectors data/local_index/vectors.npy
+
+Ground truth is exact float32 search on the full vectors. Every configuration goes through
+LocalDocumentStore.embedding_retrieval, so it measures the real scan + rescoring path.
+Shortened embeddings are simulated the way the API produces them: truncate, then
+re-normalise. That only preserves quality for models trained for it (text-embedding-3),
+so the dimension rows are only meaningful on an exported vectors.npy (--vectors); on the
+synthetic vectors they are a pessimistic lower bound. The quantization rows hold for both.
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from haystack import Document  # noqa: E402
+
+from ann_recall import exact_top_k, percentile_ms, synthetic_vectors  # noqa: E402
+from local_store import LocalDocumentStore  # noqa: E402
+
+WRITE_BATCH = 2000
+
+
+def truncate(vectors: np.ndarray, dimensions: int) -> np.ndarray:
+    short = np.ascontiguousarray(vectors[:, :dimensions])
+    return short / np.maximum(np.linalg.norm(short, axis=1, keepdims=True), 1e-12)
+
+
+def build_store(path: str, vectors: np.ndarray, quantization, index: str, n_lists: int) -> LocalDocumentStore:
+    store = LocalDocumentStore(
+        path, dimension=vectors.shape[1], quantization=quantization, index=index, n_lists=n_lists,
+        initial_capacity=len(vectors),
+    )
+    for start in range(0, len(vectors), WRITE_BATCH):
+        store.write_documents([
+            Document(id=str(row), content="", embedding=vectors[row].tolist())
+            for row in range(start, min(start + WRITE_BATCH, len(vectors)))
+        ])
+    return store
+
+
+def scan_bytes(store: LocalDocumentStore) -> int:
+    # Wat per query gescand wordt (en dus in de page cache moet passen)
+    n = store.count_documents()
+    if store._quantized is None:
+        return n * store.dimension * store._vectors.dtype.itemsize
+    return n * store.dimension * store._quantized.dtype.itemsize + (n * 4 if store._scales is not None else 0)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--vectors", help="Existing .npy matrix (e.g. data/local_index/vectors.npy)")
+    parser.add_argument("--n", type=int, default=20_000)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--dimensions", type=int, nargs="+", default=[1536, 512, 256])
+    parser.add_argument("--quantization", nargs="+", default=["none", "float16", "int8"])
+    parser.add_argument("--rescore", type=int, nargs="+", default=[1, 4], help="Candidates rescored = rescore x k")
+    parser.add_argument("--index", choices=["exact", "ivf"], default="exact")
+    parser.add_argument("--lists", type=int, default=64)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    if args.vectors:
+        vectors = np.load(args.vectors, mmap_mode="r")
+        vectors = np.asarray(vectors[np.linalg.norm(vectors, axis=1) > 0], dtype=np.float32)
+    else:
+        vectors = synthetic_vectors(args.n, max(args.dimensions), n_clusters=args.lists * 2, rng=rng)
+    queries = vectors[rng.choice(len(vectors), args.queries, replace=False)]
+    queries = queries + 0.05 * rng.standard_normal(queries.shape).astype(np.float32)
+    queries /= np.linalg.norm(queries, axis=1, keepdims=True)
+    truth = [set(exact_top_k(vectors, query, args.k).tolist()) for query in queries]
+    print(f"{len(vectors)} x {vectors.shape[1]} vectors, {args.queries} queries, index={args.index}")
+    print(f"{'dims':>5} {'storage':>8} {'rescore':>7}  {'recall@' + str(args.k):>9}  {'p50':>9}  {'p95':>9}  {'index MB':>8}")
+
+    workdir = tempfile.mkdtemp(prefix="quant_bench_")
+    try:
+        for dimensions in args.dimensions:
+            if dimensions > vectors.shape[1]:
+                continue
+            short = truncate(vectors, dimensions)
+            short_queries = truncate(queries, dimensions)
+            for quantization in args.quantization:
+                path = os.path.join(workdir, f"{dimensions}_{quantization}")
+                store = build_store(path, short, None if quantization == "none" else quantization, args.index, args.lists)
+                if args.index == "ivf":
+                    store.train_index()
+                for rescore in args.rescore if quantization != "none" else [1]:
+                    store.rescore = rescore
+                    recalls, times = [], []
+                    for query, expected in zip(short_queries, truth):
+                        start = time.perf_counter()
+                        found = store.embedding_retrieval(query.tolist(), top_k=args.k)
+                        times.append(time.perf_counter() - start)
+                        recalls.append(len(expected & {int(doc.id) for doc in found}) / args.k)
+                    print(f"{dimensions:>5} {quantization:>8} {rescore if quantization != 'none' else '-':>7}  "
+                          f"{np.mean(recalls):>9.3f}  {percentile_ms(times, 50):>7.2f}ms  "
+                          f"{percentile_ms(times, 95):>7.2f}ms  {scan_bytes(store) / 1e6:>8.1f}")
+                del store
+                shutil.rmtree(path)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
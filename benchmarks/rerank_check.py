@@ -0,0 +1,60 @@
+"""
+Checks that DocumentReranker reorders retrieved documents without a cross-encoder.
+
+    python benchmarks/rerank_check.py
+
+The documents arrive in a retrieval order that puts the passage closest to the query
+embedding last. Without a `ranker` DocumentReranker must move it to the front, keep
+keyword-only hits (no embedding) in their place, rank merged chunks by their mean
+embedding, and leave the order alone when there is no query embedding (an invnr lookup).
+Exits with status 1 on a failed check, so it can run in CI.
+"""
+import os
+import sys
+from typing import List
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from haystack import Document  # noqa: E402
+
+from reranking import DocumentReranker  # noqa: E402
+
+QUERY = [1.0, 0.0, 0.0]
+
+
+def ids(documents: List[Document]) -> List[str]:
+    return [doc.id for doc in documents]
+
+
+def main() -> int:
+    documents = [
+        Document(id="far", content="Rekeningen van de rentmeester", meta={"invnr": "1"}, embedding=[0.0, 1.0, 0.0]),
+        Document(id="keyword", content="Inventaris van het huisarchief", meta={"invnr": "2"}),
+        Document(id="middle", content="Brieven over de tuinen", meta={"invnr": "3"}, embedding=[0.6, 0.8, 0.0]),
+        Document(id="close", content="Bouwgeschiedenis van het kasteel", meta={"invnr": "4"}, embedding=[0.95, 0.0, 0.3]),
+    ]
+    chunks = [
+        Document(id="c0", content="Eerste deel. ", meta={"file_path": "a.pdf", "split_id": 0}, embedding=[0.0, 0.0, 1.0]),
+        Document(id="c1", content="Tweede deel.", meta={"file_path": "a.pdf", "split_id": 1}, embedding=[1.0, 0.0, 0.0]),
+        Document(id="other", content="Een losse kaart", meta={"file_path": "b.pdf"}, embedding=[0.0, 1.0, 0.0]),
+    ]
+    reranker = DocumentReranker(top_k=10, max_per_source=None)
+    cases = [
+        ("closest passage first", ids(reranker.run(documents=documents, query_embedding=QUERY)["documents"]),
+         ["close", "keyword", "middle", "far"]),
+        ("no query embedding keeps the order", ids(reranker.run(documents=documents)["documents"]),
+         ["far", "keyword", "middle", "close"]),
+        ("merged chunks ranked by their mean embedding", ids(reranker.run(documents=list(reversed(chunks)), query_embedding=QUERY)["documents"]),
+         ["c1", "other"]),
+    ]
+    failures = 0
+    for name, actual, expected in cases:
+        ok = actual == expected
+        failures += not ok
+        print(f"{'ok  ' if ok else 'FAIL'} {name}: {actual}" + ("" if ok else f", expected {expected}"))
+    print(f"{len(cases) - failures}/{len(cases)} checks passed")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
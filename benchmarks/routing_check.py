@@ -0,0 +1,68 @@
+"""
+Checks RephraseRouter's routing on typical follow-up questions.
+
+    python benchmarks/routing_check.py
+
+Every case is routed with a short conversation as history. "rephrase" cases refer back to
+earlier turns and must go through the rephrase LLM; "bypass" cases stand on their own and
+may skip it. Exits with status 1 on a wrong route, so it can run in CI.
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from query_routing import RephraseRouter  # noqa: E402
+
+HISTORY = [
+    {"role": "user", "content": "Wat is Kasteel Amerongen?"},
+    {"role": "assistant", "content": "Kasteel Amerongen is een kasteel in de provincie Utrecht, bewoond door de familie Van Reede."},
+]
+
+CASES = [
+    ("Wanneer werd het gebouwd?", "rephrase"),
+    ("Wanneer is dit kasteel gebouwd?", "rephrase"),
+    ("Wat weet je nog meer over deze familie?", "rephrase"),
+    ("Hoe oud was die man toen?", "rephrase"),
+    ("Waar ligt dat gebouw precies?", "rephrase"),
+    ("Wie woonde daar in de achttiende eeuw?", "rephrase"),
+    ("Was hij getrouwd met Margaretha Turnor?", "rephrase"),
+    ("Welke titels had zijn zoon?", "rephrase"),
+    ("En de tuinen?", "rephrase"),
+    ("When was it built?", "rephrase"),
+    ("En zijn vader in Utrecht?", "rephrase"),
+    ("Wie was zijn vader in Utrecht?", "rephrase"),
+    ("Wat gebeurde er in 1923 met hem?", "rephrase"),
+    ("Hoe oud was die man in 1672?", "rephrase"),
+    ("Wanneer werd het in 1672 herbouwd?", "rephrase"),
+    ("Wie was Godard van Reede van Ginkel?", "bypass"),
+    ("Welke brieven uit 1672 zijn bewaard gebleven?", "bypass"),
+    ("Wanneer is het Kasteel Amerongen herbouwd?", "bypass"),
+    ("Welke kaarten van de Utrechtse Heuvelrug zijn er?", "bypass"),
+    ("Wat zijn de openingstijden van het Utrechts Archief?", "bypass"),
+    ("Welke brieven die Godard schreef zijn bewaard?", "bypass"),
+]
+
+
+def route(router: RephraseRouter, query: str) -> str:
+    return "rephrase" if "rephrase_query" in router.run(query=query, history=HISTORY) else "bypass"
+
+
+def main() -> int:
+    router = RephraseRouter()
+    failures = 0
+    for query, expected in CASES:
+        actual = route(router, query)
+        if actual != expected:
+            failures += 1
+        print(f"{'ok  ' if actual == expected else 'FAIL'} {actual:<8} {query}")
+    # De eerste beurt heeft niets om naar te verwijzen
+    if "rephrase_query" in router.run(query="Wanneer werd het gebouwd?", history=[]):
+        failures += 1
+        print("FAIL first turn was rephrased")
+    print(f"{len(CASES) + 1 - failures}/{len(CASES) + 1} routed as expected")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,191 @@
+"""
+Load test of the HTTP API (src/server.py) over real HTTP.
+
+    python benchmarks/server_bench.py --clients 64 --requests 500 --duplicates 0.5
+    python benchmarks/server_bench.py --max-concurrency 4 --max-queue 8 --clients 64   # backpressure
+    python benchmarks/server_bench.py --url http://localhost:8080 --clients 8            # running server
+
+Without --url the server runs in-process on a free port, with OpenAI and Pinecone replaced
+by the stand-ins from fakes.py (as in qa_bench.py). Every client streams its answer over SSE.
+`--duplicates` is the share of requests that ask the same popular question, which the
+server should coalesce when they overlap in time.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import tempfile
+import time
+from collections import Counter
+from typing import Any, Dict, List
+
+import aiohttp
+
+from qa_bench import (
+    BENCH_DIR,
+    configure_environment,
+    peak_rss_mb,
+    percentiles,
+    read_jsonl,
+    run_indexing,
+    synthetic_corpus,
+)
+
+
+async def stream_question(session: aiohttp.ClientSession, url: str, query: str) -> Dict[str, Any]:
+    start = time.perf_counter()
+    result: Dict[str, Any] = {"status": None, "ttft": None, "seconds": None, "tokens": 0, "error": None}
+    try:
+        async with session.post(f"{url}/v1/chat/stream", json={"query": query}) as response:
+            result["status"] = response.status
+            if response.status != 200:
+                result["error"] = (await response.text())[:200]
+                return result
+            event = None
+            async for line in response.content:
+                line = line.decode("utf-8").rstrip("\n")
+                if line.startswith("event: "):
+                    event = line[len("event: "):]
+                elif line.startswith("data: "):
+                    if event == "token":
+                        if result["ttft"] is None:
+                            result["ttft"] = time.perf_counter() - start
+                        result["tokens"] += 1
+                    elif event == "error":
+                        error = json.loads(line[len("data: "):])
+                        result["status"], result["error"] = error["status"], error["message"]
+    except aiohttp.ClientError as e:
+        result["error"] = repr(e)
+    result["seconds"] = time.perf_counter() - start
+    return result
+
+
+async def run_load(url: str, queries: List[str], args) -> List[Dict[str, Any]]:
+    rng = random.Random(args.seed)
+    plan = [queries[0] if rng.random() < args.duplicates else rng.choice(queries) for _ in range(args.requests)]
+    remaining = iter(plan)
+    results: List[Dict[str, Any]] = []
+
+    async def client(session: aiohttp.ClientSession) -> None:
+        for query in remaining:
+            results.append(await stream_question(session, url, query))
+
+    connector = aiohttp.TCPConnector(limit=args.clients)
+    timeout = aiohttp.ClientTimeout(total=None, sock_read=120)
+    async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+        await asyncio.gather(*(client(session) for _ in range(args.clients)))
+    return results
+
+
+async def run_in_process(args, queries: List[str]) -> Dict[str, Any]:
+    from aiohttp import web
+
+    import pipelines
+    from async_pipeline import AsyncQAPipeline
+    from fakes import FakeAsyncOpenAI, FakeBackend, FakeLatency, FakeOpenAI, RemoteDocumentStoreStandIn
+    from server import QAService, SessionStore, create_app
+
+    backend = FakeBackend(FakeLatency(
+        embed_seconds=args.embed_latency,
+        ttft_seconds=args.ttft,
+        tokens_per_second=args.tokens_per_second,
+        reply_tokens=args.reply_tokens,
+    ))
+    pipelines._openai_client = FakeOpenAI(backend)
+    pipelines._async_openai_client = FakeAsyncOpenAI(backend)
+    store = RemoteDocumentStoreStandIn(
+        path=pipelines.LOCAL_DOCSTORE_PATH,
+        dimension=pipelines.EMBEDDING_DIMENSIONS,
+        query_latency=args.store_latency,
+        write_latency=0.0,
+    )
+    indexing = run_indexing(pipelines, store, synthetic_corpus(args.documents, args.seed), 100)
+    print(f"indexing: {indexing['documents']} documents -> {indexing['chunks']} chunks")
+
+    pipeline = pipelines.get_qa_pipeline(args.model)
+    pipeline.get_component("pinecone_retriever").document_store = store
+    service = QAService(
+        AsyncQAPipeline(pipeline, pipelines._async_openai_client),
+        SessionStore(),
+        max_concurrency=args.max_concurrency,
+        max_queue=args.max_queue,
+        queue_timeout=args.queue_timeout,
+    )
+    runner = web.AppRunner(create_app(service), access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    url = f"http://127.0.0.1:{site._server.sockets[0].getsockname()[1]}"
+    try:
+        start = time.perf_counter()
+        results = await run_load(url, queries, args)
+        seconds = time.perf_counter() - start
+    finally:
+        await runner.cleanup()
+    return {"results": results, "seconds": seconds, "server": service.stats(), "fake_api_calls": dict(backend.calls)}
+
+
+async def run_remote(args, queries: List[str]) -> Dict[str, Any]:
+    start = time.perf_counter()
+    results = await run_load(args.url, queries, args)
+    seconds = time.perf_counter() - start
+    async with aiohttp.ClientSession() as session:
+        async with session.get(f"{args.url}/v1/stats") as response:
+            server = await response.json() if response.status == 200 else {}
+    return {"results": results, "seconds": seconds, "server": server}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", help="Load-test a running server instead of an in-process one with stand-ins")
+    parser.add_argument("--queries", default=os.path.join(BENCH_DIR, "queries.jsonl"))
+    parser.add_argument("--clients", type=int, default=32, help="Concurrent clients, each streaming one answer at a time")
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--duplicates", type=float, default=0.3, help="Share of requests asking the same question")
+    parser.add_argument("--max-concurrency", type=int, default=16)
+    parser.add_argument("--max-queue", type=int, default=64)
+    parser.add_argument("--queue-timeout", type=float, default=30.0)
+    parser.add_argument("--documents", type=int, default=1000, help="Size of the synthetic corpus")
+    parser.add_argument("--model", default="gpt-4o-mini")
+    parser.add_argument("--no-cache", action="store_true", help="Disable the embedding and answer caches")
+    parser.add_argument("--embed-latency", type=float, default=0.05)
+    parser.add_argument("--ttft", type=float, default=0.4)
+    parser.add_argument("--tokens-per-second", type=float, default=60.0)
+    parser.add_argument("--reply-tokens", type=int, default=120)
+    parser.add_argument("--store-latency", type=float, default=0.03)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    # configure_environment verwacht de store-opties van qa_bench
+    args.index, args.quantization, args.dimensions = "exact", None, 1536
+
+    logging.basicConfig(level=logging.WARNING)
+    queries = [request["query"] for request in read_jsonl(args.queries)]
+    if args.url:
+        outcome = asyncio.run(run_remote(args, queries))
+    else:
+        configure_environment(args, tempfile.mkdtemp(prefix="server_bench_"))
+        outcome = asyncio.run(run_in_process(args, queries))
+
+    results, seconds = outcome["results"], outcome["seconds"]
+    ok = [r for r in results if r["status"] == 200 and not r["error"]]
+    statuses = Counter(r["status"] if not r["error"] or r["status"] != 200 else "error" for r in results)
+    print(f"{len(results)} requests from {args.clients} clients in {seconds:.1f}s: "
+          f"{len(ok) / seconds if seconds else 0.0:.1f} answers/s, statuses {dict(statuses)}")
+    for label, values in (("latency", percentiles([r["seconds"] for r in ok])),
+                          ("ttft", percentiles([r["ttft"] for r in ok if r["ttft"] is not None]))):
+        if values:
+            print(f"  {label:<8} p50 {values['p50'] * 1000:8.1f}ms  p95 {values['p95'] * 1000:8.1f}ms  "
+                  f"p99 {values['p99'] * 1000:8.1f}ms")
+    print(f"  server   {outcome['server']}")
+    if "fake_api_calls" in outcome:
+        print(f"  fake api {outcome['fake_api_calls']}")
+    print(f"  peak rss {peak_rss_mb():.0f} MB")
+    errors = [r["error"] for r in results if r["error"]]
+    if errors:
+        print(f"  first error: {errors[0]}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,208 @@
+import json
+import logging
+import os
+from typing import List, Optional
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+CENTROIDS_FILE = "ivf_centroids.npy"
+ASSIGNMENTS_FILE = "ivf_assignments.npy"
+META_FILE = "ivf_meta.json"
+ASSIGN_BATCH_ROWS = 65_536
+# k-means traint op een steekproef van zoveel punten per lijst
+TRAIN_SAMPLE_PER_LIST = 64
+# Opnieuw trainen zodra de index zoveel keer groter is dan bij het trainen, of de grootste lijst
+# zoveel keer voller is (t.o.v. het gemiddelde) dan direct na het trainen
+RETRAIN_GROWTH = 2.0
+RETRAIN_IMBALANCE = 2.0
+# Grotere batches in één keer indelen in plaats van lijst voor lijst bij te werken
+REBUILD_BATCH_ROWS = 4096
+
+
+class IVFIndex:
+    """
+    Inverted-file (IVF) index over the rows of a LocalDocumentStore.
+
+    Vectors are clustered with spherical k-means; every store row is assigned to its
+    nearest centroid. A query only scores the rows in its `n_probe` nearest lists, so
+    `n_probe` is the recall/latency knob: n_probe == n_lists is exact search.
+    The index stores row numbers only, the vectors stay in the store's memmap.
+
+    Inserts and deletes only touch the affected lists. Once saved, the assignments are a
+    memmap that `save` flushes (only the changed pages are written); the centroids are
+    only written after training. `needs_retrain` tells the store when the index has
+    outgrown its centroids.
+    """
+
+    def __init__(self, dimension: int, n_lists: int = 256, n_probe: int = 8):
+        self.dimension = dimension
+        self.n_lists = n_lists
+        self.n_probe = n_probe
+        self.centroids: Optional[np.ndarray] = None
+        # Lijst per store-rij; -1 betekent leeg, verwijderd of nog niet toegewezen
+        self.assignments = np.full(0, -1, dtype=np.int32)
+        # Grootte en scheefheid direct na het trainen, de maatstaf voor needs_retrain
+        self.trained_size = 0
+        self.trained_imbalance = 1.0
+        self._lists: Optional[List[np.ndarray]] = None
+        self._sizes = np.zeros(0, dtype=np.int64)
+        self._meta_dirty = False
+
+    @property
+    def trained(self) -> bool:
+        return self.centroids is not None
+
+    def train(self, vectors: np.ndarray, n_iter: int = 20, sample_size: Optional[int] = None, seed: int = 0) -> None:
+        rng = np.random.default_rng(seed)
+        sample_size = sample_size or self.n_lists * TRAIN_SAMPLE_PER_LIST
+        if len(vectors) > sample_size:
+            vectors = vectors[np.sort(rng.choice(len(vectors), sample_size, replace=False))]
+        sample = np.asarray(vectors, dtype=np.float32)
+        n_lists = min(self.n_lists, len(sample))
+        centroids = sample[rng.choice(len(sample), n_lists, replace=False)].copy()
+        for _ in range(n_iter):
+            labels = np.argmax(sample @ centroids.T, axis=1)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, labels, sample)
+            counts = np.bincount(labels, minlength=n_lists)
+            # Lege clusters opnieuw beginnen vanaf een willekeurig punt
+            empty = counts == 0
+            sums[empty] = sample[rng.choice(len(sample), int(empty.sum()))]
+            norms = np.linalg.norm(sums, axis=1, keepdims=True)
+            centroids = sums / np.maximum(norms, 1e-12)
+        self.centroids = centroids.astype(np.float32)
+        self.n_lists = n_lists
+        self.assignments[:] = -1
+        self._lists = None
+        self._sizes = np.zeros(n_lists, dtype=np.int64)
+        self.trained_size = 0
+        self.trained_imbalance = 1.0
+        self._meta_dirty = True
+        logger.info("Trained IVF index with %d lists on %d vectors", n_lists, len(sample))
+
+    def add(self, rows: np.ndarray, vectors: np.ndarray) -> None:
+        """Assign (or re-assign) store rows to their nearest list."""
+        if not self.trained or len(rows) == 0:
+            return
+        rows = np.asarray(rows, dtype=np.int64)
+        needed = int(rows.max()) + 1
+        if needed > len(self.assignments):
+            # Verdubbelen: het bestand wordt dan bij de volgende save eenmalig opnieuw geschreven
+            grown = np.full(max(needed, len(self.assignments) * 2), -1, dtype=np.int32)
+            grown[: len(self.assignments)] = self.assignments
+            self.assignments = grown
+        self.remove(rows)
+        for start in range(0, len(rows), ASSIGN_BATCH_ROWS):
+            batch_rows = rows[start : start + ASSIGN_BATCH_ROWS]
+            batch = np.asarray(vectors[start : start + ASSIGN_BATCH_ROWS], dtype=np.float32)
+            labels = np.argmax(batch @ self.centroids.T, axis=1).astype(np.int32)
+            self.assignments[batch_rows] = labels
+            self._sizes += np.bincount(labels, minlength=self.n_lists)
+            if self._lists is not None and len(batch_rows) <= REBUILD_BATCH_ROWS:
+                for label, members in self._group(batch_rows, labels):
+                    self._lists[label] = np.concatenate([self._lists[label], members])
+            else:
+                self._lists = None
+
+    def remove(self, rows: np.ndarray) -> None:
+        rows = np.asarray(rows, dtype=np.int64)
+        rows = rows[rows < len(self.assignments)]
+        labels = self.assignments[rows]
+        assigned = labels >= 0
+        rows, labels = rows[assigned], labels[assigned]
+        if len(rows) == 0:
+            return
+        self.assignments[rows] = -1
+        np.subtract.at(self._sizes, labels, 1)
+        if self._lists is not None:
+            for label, members in self._group(rows, labels):
+                self._lists[label] = self._lists[label][~np.isin(self._lists[label], members)]
+
+    def settle(self) -> None:
+        """Take the current size and balance as the baseline after (re)training and assigning."""
+        self.trained_size = int(self._sizes.sum())
+        self.trained_imbalance = self.imbalance()
+        self._meta_dirty = True
+
+    def imbalance(self) -> float:
+        """Size of the largest list relative to the mean list size."""
+        total = int(self._sizes.sum())
+        return float(self._sizes.max()) * len(self._sizes) / total if total else 1.0
+
+    def needs_retrain(self) -> bool:
+        if not self.trained or self.trained_size == 0:
+            return False
+        if self._sizes.sum() > RETRAIN_GROWTH * self.trained_size:
+            return True
+        return self.imbalance() > RETRAIN_IMBALANCE * self.trained_imbalance
+
+    def candidates(self, query: np.ndarray, n_probe: Optional[int] = None) -> np.ndarray:
+        """Store rows in the `n_probe` lists closest to the (normalised) query, sorted by row."""
+        n_probe = min(n_probe or self.n_probe, self.n_lists)
+        lists = self._build_lists()
+        centroid_scores = self.centroids @ query
+        probes = np.argpartition(-centroid_scores, n_probe - 1)[:n_probe]
+        rows = np.concatenate([lists[p] for p in probes])
+        # Gesorteerd lezen is veel sneller op een memmap
+        return np.sort(rows)
+
+    def save(self, path: str) -> None:
+        if not self.trained:
+            return
+        assignments_path = os.path.join(path, ASSIGNMENTS_FILE)
+        if self._meta_dirty:
+            np.save(os.path.join(path, CENTROIDS_FILE), self.centroids)
+            with open(os.path.join(path, META_FILE), "w") as f:
+                json.dump({"trained_size": self.trained_size, "trained_imbalance": self.trained_imbalance}, f)
+            self._meta_dirty = False
+        if isinstance(self.assignments, np.memmap):
+            self.assignments.flush()
+            return
+        # Na trainen of groeien: eenmalig volledig schrijven, daarna alleen flushen
+        mapped = np.lib.format.open_memmap(assignments_path, mode="w+", dtype=np.int32, shape=self.assignments.shape)
+        mapped[:] = self.assignments
+        mapped.flush()
+        self.assignments = mapped
+
+    @classmethod
+    def load(cls, path: str, dimension: int, n_lists: int = 256, n_probe: int = 8) -> "IVFIndex":
+        index = cls(dimension=dimension, n_lists=n_lists, n_probe=n_probe)
+        centroids_path = os.path.join(path, CENTROIDS_FILE)
+        if os.path.exists(centroids_path):
+            index.centroids = np.load(centroids_path)
+            index.n_lists = index.centroids.shape[0]
+            index.assignments = np.lib.format.open_memmap(os.path.join(path, ASSIGNMENTS_FILE), mode="r+")
+            labels = index.assignments[index.assignments >= 0]
+            index._sizes = np.bincount(labels, minlength=index.n_lists).astype(np.int64)
+            meta_path = os.path.join(path, META_FILE)
+            if os.path.exists(meta_path):
+                with open(meta_path) as f:
+                    meta = json.load(f)
+                index.trained_size = meta["trained_size"]
+                index.trained_imbalance = meta["trained_imbalance"]
+            else:
+                # Index van voor de hertrainingsdrempels: de huidige stand als uitgangspunt
+                index.settle()
+        return index
+
+    @staticmethod
+    def _group(rows: np.ndarray, labels: np.ndarray):
+        """(label, rows) per distinct label."""
+        order = np.argsort(labels, kind="stable")
+        rows, labels = rows[order], labels[order]
+        bounds = np.flatnonzero(np.diff(labels)) + 1
+        for members in np.split(np.arange(len(rows)), bounds):
+            yield int(labels[members[0]]), rows[members]
+
+    def _build_lists(self) -> List[np.ndarray]:
+        # Eén keer volledig indelen (na trainen, laden of een grote batch); daarna incrementeel
+        if self._lists is None:
+            assigned = np.flatnonzero(self.assignments >= 0)
+            labels = self.assignments[assigned]
+            order = np.argsort(labels, kind="stable")
+            offsets = np.searchsorted(labels[order], np.arange(self.n_lists + 1))
+            sorted_rows = assigned[order]
+            self._lists = [sorted_rows[offsets[i] : offsets[i + 1]].copy() for i in range(self.n_lists)]
+        return self._lists
@@ -0,0 +1,226 @@
+import hashlib
+import logging
+import os
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional, Set
+
+import numpy as np
+from haystack import component
+from haystack.components.generators import OpenAIGenerator
+from haystack.dataclasses import Document, StreamingChunk
+
+from context_assembly import message_role, message_text
+
+logger = logging.getLogger(__name__)
+
+# Wordt bij elke (her)indexering aangepast; caches die een oudere versie zagen gooien alles weg
+DEFAULT_INDEX_VERSION_PATH = os.path.join(os.path.dirname(__file__), "..", "data", "index_version")
+
+
+def read_index_version(path: str = DEFAULT_INDEX_VERSION_PATH) -> Optional[float]:
+    try:
+        return os.stat(path).st_mtime
+    except FileNotFoundError:
+        return None
+
+def bump_index_version(path: str = DEFAULT_INDEX_VERSION_PATH) -> None:
+    with open(path, "w") as f:
+        f.write(str(time.time()))
+
+
+def invnr_set(documents: Optional[List[Document]]) -> Set[str]:
+    return {str(doc.meta["invnr"]) for doc in documents or [] if doc.meta.get("invnr") is not None}
+
+
+def history_key(history: Optional[List[Any]]) -> str:
+    """Hash of the history in the answer prompt; "" without history."""
+    if not history:
+        return ""
+    digest = hashlib.sha1()
+    for message in history:
+        digest.update(f"{message_role(message)}\0{message_text(message)}\0".encode("utf-8"))
+    return digest.hexdigest()
+
+
+@dataclass
+class CachedAnswer:
+    reply: str
+    documents: List[Document]
+    invnrs: Set[str]
+    meta: Dict[str, Any] = field(default_factory=dict)
+    # Een antwoord op een vervolgvraag hangt ook af van het gesprek dat in de prompt stond
+    history_key: str = ""
+
+
+class SemanticAnswerCache:
+    """
+    Bounded nearest-neighbour cache from query embeddings to generated answers.
+    An answer is only reused for the same conversation history (see `history_key`).
+    """
+
+    def __init__(
+        self,
+        max_entries: int = 512,
+        threshold: float = 0.95,
+        min_invnr_overlap: float = 0.5,
+        index_version_path: str = DEFAULT_INDEX_VERSION_PATH,
+    ):
+        self.max_entries = max_entries
+        self.threshold = threshold
+        self.min_invnr_overlap = min_invnr_overlap
+        self.index_version_path = index_version_path
+        self._index_version = read_index_version(index_version_path)
+        self._vectors: Optional[np.ndarray] = None
+        self._last_used = np.zeros(max_entries, dtype=np.float64)
+        self._answers: List[Optional[CachedAnswer]] = [None] * max_entries
+        self._size = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def lookup(
+        self, embedding: List[float], documents: Optional[List[Document]] = None, history: str = ""
+    ) -> Optional[CachedAnswer]:
+        """`history` is the `history_key` of the conversation in the prompt."""
+        with self._lock:
+            self._check_index_version()
+            if self._size == 0:
+                self.misses += 1
+                return None
+
+            query = self._normalize(embedding)
+            similarities = self._vectors[: self._size] @ query
+            invnrs = invnr_set(documents)
+            # Beste kandidaten eerst; de invnr-check filtert antwoorden op basis van andere bronnen
+            for slot in np.argsort(-similarities):
+                if similarities[slot] < self.threshold:
+                    break
+                answer = self._answers[slot]
+                if answer.history_key == history and self._compatible(invnrs, answer.invnrs):
+                    self._last_used[slot] = time.monotonic()
+                    self.hits += 1
+                    return answer
+            self.misses += 1
+            return None
+
+    def add(self, embedding: List[float], answer: CachedAnswer) -> None:
+        with self._lock:
+            query = self._normalize(embedding)
+            if self._vectors is None:
+                self._vectors = np.zeros((self.max_entries, query.shape[0]), dtype=np.float32)
+            if self._size < self.max_entries:
+                slot = self._size
+                self._size += 1
+            else:
+                slot = int(np.argmin(self._last_used))
+            self._vectors[slot] = query
+            self._answers[slot] = answer
+            self._last_used[slot] = time.monotonic()
+
+    def invalidate(self) -> None:
+        with self._lock:
+            self._clear()
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "lookups": lookups,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "entries": self._size,
+        }
+
+    def _clear(self) -> None:
+        self._answers = [None] * self.max_entries
+        self._last_used[:] = 0
+        self._size = 0
+
+    def _check_index_version(self) -> None:
+        version = read_index_version(self.index_version_path)
+        if version != self._index_version:
+            logger.info("Index was re-ingested, clearing %d cached answers", self._size)
+            self._index_version = version
+            self._clear()
+
+    def _compatible(self, invnrs: Set[str], cached_invnrs: Set[str]) -> bool:
+        if not invnrs and not cached_invnrs:
+            return True
+        return len(invnrs & cached_invnrs) / len(invnrs | cached_invnrs) >= self.min_invnr_overlap
+
+    @staticmethod
+    def _normalize(embedding: List[float]) -> np.ndarray:
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+
+@component
+class CachedAnswerGenerator:
+    """Wraps the answer generator and returns a cached reply for near-identical questions."""
+
+    def __init__(self, generator: OpenAIGenerator, cache: SemanticAnswerCache):
+        self.generator = generator
+        self.cache = cache
+
+    def remember(
+        self,
+        query_embedding: Optional[List[float]],
+        documents: Optional[List[Document]],
+        reply: str,
+        meta: Dict[str, Any],
+        history: Optional[List[Any]] = None,
+    ) -> None:
+        # Afgekapte antwoorden niet bewaren
+        if query_embedding is None or meta.get("finish_reason") != "stop":
+            return
+        self.cache.add(
+            query_embedding,
+            CachedAnswer(
+                reply=reply,
+                documents=documents or [],
+                invnrs=invnr_set(documents),
+                meta={"model": meta.get("model")},
+                history_key=history_key(history),
+            ),
+        )
+
+    @component.output_types(replies=List[str], meta=List[Dict[str, Any]], documents=List[Document])
+    def run(
+        self,
+        prompt: str,
+        query_embedding: Optional[List[float]] = None,
+        documents: Optional[List[Document]] = None,
+        history: Optional[List[Any]] = None,
+        streaming_callback: Optional[Callable[[StreamingChunk], None]] = None,
+        generation_kwargs: Optional[Dict[str, Any]] = None,
+    ):
+        if query_embedding is not None:
+            cached = self.cache.lookup(query_embedding, documents, history_key(history))
+            if cached is not None:
+                if streaming_callback is not None:
+                    streaming_callback(StreamingChunk(content=cached.reply, meta={"cache_hit": True}))
+                return {
+                    "replies": [cached.reply],
+                    "meta": [{**cached.meta, "cache_hit": True}],
+                    "documents": cached.documents,
+                }
+
+        kwargs: Dict[str, Any] = {"prompt": prompt}
+        if streaming_callback is not None:
+            kwargs["streaming_callback"] = streaming_callback
+        if generation_kwargs is not None:
+            kwargs["generation_kwargs"] = generation_kwargs
+        result = self.generator.run(**kwargs)
+
+        if result["replies"]:
+            self.remember(
+                query_embedding, documents, result["replies"][0], result["meta"][0] if result["meta"] else {}, history
+            )
+        return {
+            "replies": result["replies"],
+            "meta": [{**m, "cache_hit": False} for m in result["meta"]],
+            "documents": documents or [],
+        }
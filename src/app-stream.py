@@ -3,19 +3,14 @@ from dotenv import load_dotenv
 import logging
 import os
 import sys
-from haystack_integrations.document_stores.pinecone import PineconeDocumentStore
-from haystack.components.embedders import OpenAIDocumentEmbedder, OpenAITextEmbedder
-from haystack.utils import Secret
-from haystack.document_stores.types.policy import DuplicatePolicy
-from haystack.components.writers import DocumentWriter
-from haystack.components.builders import PromptBuilder
-from haystack.components.generators import OpenAIGenerator
-from prompts import QUERY_REPHRASE_TEMPLATE, QUERY_ANSWER_TEMPLATE, SYSTEM_PROMPT, SYSTEM_PROMPT_2
-from haystack.components.converters import OutputAdapter
-from haystack_integrations.components.retrievers.pinecone import PineconeEmbeddingRetriever
-from haystack import Pipeline
-from haystack.dataclasses import Document, StreamingChunk
-from typing import List, Tuple
+import uuid
+from typing import TYPE_CHECKING, List, Tuple
+# Alleen lichte imports hier; haystack en de pipeline laden op de achtergrond (zie startup.py)
+from startup import warm_up_in_background
+from streaming_render import StreamingRenderer
+
+if TYPE_CHECKING:
+    from haystack.dataclasses import Document
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
@@ -23,66 +18,15 @@ logger = logging.getLogger(__name__)
 if not load_dotenv():
     logger.error("No .env file found")
 
-def create_docstore() -> PineconeDocumentStore:
-    return PineconeDocumentStore(
-        api_key=Secret.from_env_var("PINECONE_API_KEY"),
-        index="archiefutrecht",
-        dimension=1536,
-    )
-
-def create_document_embedder() -> OpenAIDocumentEmbedder:
-    return OpenAIDocumentEmbedder(
-        model="text-embedding-3-small",
-        api_key=Secret.from_env_var("OPENAI_API_KEY"),
-    )
-
-def create_text_embedder() -> OpenAITextEmbedder:
-    return OpenAITextEmbedder(
-        model="text-embedding-3-small",
-        api_key=Secret.from_env_var("OPENAI_API_KEY"),
-    )
-
-def create_document_writer(docstore) -> DocumentWriter:
-    return DocumentWriter(document_store=docstore, policy=DuplicatePolicy.OVERWRITE) 
-
-def create_pinecone_retriever() -> PineconeEmbeddingRetriever:
-    return PineconeEmbeddingRetriever(
-        document_store=create_docstore()
-    )
+warm_up_in_background()
 
-def create_llm_output_adapter() -> OutputAdapter:
-    return OutputAdapter(
-        template="{{ replies [0] }}",
-        output_type=str
-    )
+@st.cache_resource
+def load_qa_pipeline():
+    # Eén keer per proces bouwen en opwarmen, daarna hergebruiken voor elke vraag
+    warm_up_in_background().result()
+    from async_pipeline import get_async_qa_pipeline
 
-def create_qa_pipeline(streaming_callback) -> Pipeline:
-    pipeline = Pipeline()
-
-    query_rephrase_builder = PromptBuilder(template=QUERY_REPHRASE_TEMPLATE)
-    answer_builder = PromptBuilder(template=QUERY_ANSWER_TEMPLATE)
-    answer_llm = OpenAIGenerator(system_prompt=SYSTEM_PROMPT_2, streaming_callback=streaming_callback)
-    rephrase_llm = OpenAIGenerator()
-    rephrase_output_adapter = create_llm_output_adapter()
-    question_embedder = create_text_embedder()
-    pinecone_retriever = create_pinecone_retriever()
-
-    pipeline.add_component("query_rephrase_builder", query_rephrase_builder)
-    pipeline.add_component("rephrase_output_adapter", rephrase_output_adapter)
-    pipeline.add_component("answer_builder", answer_builder)
-    pipeline.add_component("rephrase_llm", rephrase_llm)
-    pipeline.add_component("answer_llm", answer_llm)
-    pipeline.add_component("question_embedder", question_embedder)
-    pipeline.add_component("pinecone_retriever", pinecone_retriever)
-
-    pipeline.connect("query_rephrase_builder", "rephrase_llm")
-    pipeline.connect("rephrase_llm", "rephrase_output_adapter")
-    pipeline.connect("rephrase_output_adapter", "question_embedder")
-    pipeline.connect("question_embedder.embedding", "pinecone_retriever.query_embedding")
-    pipeline.connect("pinecone_retriever", "answer_builder")
-    pipeline.connect("answer_builder", "answer_llm")
-
-    return pipeline
+    return get_async_qa_pipeline()
 
 st.title("Document Chatbot")
 
@@ -90,65 +34,84 @@ st.title("Document Chatbot")
 if "messages" not in st.session_state:
     st.session_state.messages = []
 
-def create_streaming_callback(message_placeholder):
-    full_response = ""
-    image_paths: List[str] = []
-    archive_numbers: List[str] = []
-
-    def streaming_callback(chunk: StreamingChunk):
-        nonlocal full_response, image_paths, archive_numbers
-        full_response, image_paths, archive_numbers = process_streaming_response(
-            [{'answer_llm': {'replies': [chunk.content]}, 'pinecone_retriever': {'documents': []}}],
-            message_placeholder,
-            full_response,
-            image_paths,
-            archive_numbers
-        )
-    
-    def get_data() -> Tuple[str, List[str], List[str], List[str]]:
-        return full_response, image_paths, archive_numbers
-    
-    return streaming_callback, get_data
-
-def process_streaming_response(response_stream, message_placeholder, full_response, image_paths, archive_numbers):
-    for output in response_stream:
-        if "answer_llm" in output:
-            bot_response = output["answer_llm"].get("replies")[0]
-            full_response += bot_response
-            message_placeholder.markdown(full_response)
-
-        if "pinecone_retriever" in output:
-            source_documents = output["pinecone_retriever"].get("documents", [])
-            for doc in source_documents:
-                if isinstance(doc, Document):
-                    img_url = doc.meta.get("representatieve\nafbeelding", None)
-                    inv_number = doc.meta.get("invnr", "unknown")
-
-                    image_paths.append(img_url if img_url else None)
-                    archive_numbers.append(inv_number)
-
-    return full_response, image_paths, archive_numbers
-from haystack.dataclasses import ChatMessage
-
-def get_message_history():
-    return st.session_state.messages
-
-def get_haystack_chat_history():
-    history = get_message_history()
-    messages = []
-    messages.append(ChatMessage.from_system(SYSTEM_PROMPT_2))
-    for message in history:
-        print(history)
-        if message.get("role") == "user":
-            messages.append(ChatMessage.from_user(message.get("content")))
-        elif message.get("role") == "assistant":
-            messages.append(ChatMessage.from_assistant(message.get("content")))
-    return messages
-            
+def collect_sources(documents: List["Document"]) -> Tuple[List[str], List[str]]:
+    from haystack.dataclasses import Document
+
+    image_paths = []
+    archive_numbers = []
+    for doc in documents:
+        if isinstance(doc, Document):
+            image_paths.append(doc.meta.get("representatieve\nafbeelding", None))
+            archive_numbers.append(doc.meta.get("invnr", "unknown"))
+    return image_paths, archive_numbers
+
+def render_sources(placeholder, image_paths: List[str], archive_numbers: List[str]):
+    from pipelines import get_image_cache
+
+    # Thumbnails worden parallel gedownload terwijl het antwoord streamt; tot die tijd een lege plek
+    futures = get_image_cache().prefetch(zip(image_paths, archive_numbers))
+    pending = []
+    with placeholder.container():
+        st.markdown("### Sources")
+        for i, source in enumerate(archive_numbers):
+            st.write(f"**Invnr:** {archive_numbers[i]}")
+            if image_paths[i]:
+                pending.append((st.empty(), image_paths[i], futures[image_paths[i]]))
+            # Optional: Add a horizontal divider for clarity
+            if i < len(archive_numbers) - 1:
+                st.markdown("---")
+    return pending
+
+def fill_images(pending, wait: bool = False):
+    """Show downloaded thumbnails; with `wait`, block for the rest (falling back to the remote URL)."""
+    remaining = []
+    for image_placeholder, url, future in pending:
+        if future.done() or wait:
+            image_placeholder.image(future.result() or url, use_container_width=True)
+        else:
+            remaining.append((image_placeholder, url, future))
+    return remaining
+
+def get_session_id() -> str:
+    # Het sessie-id staat in de URL, zodat dezelfde link na een herstart het gesprek terugvindt
+    session_id = st.query_params.get("session")
+    if not session_id:
+        session_id = uuid.uuid4().hex
+        st.query_params["session"] = session_id
+    return session_id
+
+def get_conversation_memory(wait: bool = True):
+    """
+    Compact memory of this session (summary + recent messages), loaded once per Streamlit session.
+    Without `wait` it returns None while the pipeline modules are still being imported.
+    """
+    if "memory" not in st.session_state:
+        if not wait and not warm_up_in_background().done():
+            return None
+        from pipelines import get_conversation_store
+
+        memory = get_conversation_store().load_or_create(get_session_id())
+        st.session_state.memory = memory
+        if not st.session_state.messages:
+            # Na een herstart: de letterlijk bewaarde berichten weer tonen
+            st.session_state.messages = [dict(m) for m in memory.messages]
+    return st.session_state.memory
+
+def remember_exchange(memory, query: str, answer: str):
+    from pipelines import get_conversation_store, get_conversation_summarizer
+
+    memory.add_exchange(query, answer)
+    get_conversation_store().save(memory)
+    # Alleen als er berichten uit het venster vielen; op de achtergrond, het antwoord staat er al
+    get_conversation_summarizer().submit(memory)
+
 
 # Layout: left column for chat, right column for sources
 col1, _ = st.columns([3, 1])
 
+# Een bewaard gesprek terughalen zodra de modules geladen zijn, zonder de eerste pagina op te houden
+get_conversation_memory(wait=False)
+
 
 # Display chat messages from history in the left column
 with col1:
@@ -164,7 +127,7 @@ if query:
     st.session_state.messages.append({"role": "user", "content": query})
 
     # Clear the sidebar for new response
-    st.sidebar.empty()
+    sources_placeholder = st.sidebar.empty()
 
     # Show user's query in chat
     with col1:
@@ -175,25 +138,38 @@ if query:
     with col1:
         with st.chat_message("assistant"):
             message_placeholder = st.empty()
-            streaming_callback, get_data = create_streaming_callback(message_placeholder)
-            
-            pipeline = create_qa_pipeline(streaming_callback)
+
+            pipeline = load_qa_pipeline()
+            from async_pipeline import stream_run
+
+            memory = get_conversation_memory()
+            # Pas na het laden van de pipeline, anders telt de warm-up mee in de gelogde TTFT
+            renderer = StreamingRenderer(message_placeholder)
             try:
-                history = get_haystack_chat_history()
-                print(history)
-                response = pipeline.run(
-                    data={"query_rephrase_builder": {"query": query, "history": history}, "answer_builder": {"history": history}},
-                    include_outputs_from=["pinecone_retriever", "query_rephrase_builder"],
-                )
-                print(response.get("query_rephrase_builder"))
-
-                full_response, image_paths, archive_numbers = process_streaming_response(
-                    [{
-                        'answer_llm': {'replies': [response["answer_llm"]["replies"][0]]}, 
-                        'pinecone_retriever': {'documents': response["pinecone_retriever"]["documents"]}
-                    }],
-                    message_placeholder, "", [], []
-                )
+                # Samenvatting + recente berichten; de prompt groeit niet mee met het gesprek
+                history = memory.history()
+                logger.debug("Chat history: %d messages (summary of %d)", len(history), memory.summarized)
+                image_paths, archive_numbers = [], []
+                pending_images = []
+                # De pipeline draait op de gedeelde event loop; stuurt de gebruiker intussen een nieuw
+                # bericht, dan stopt Streamlit dit script en annuleert stream_run de lopende run
+                for event, payload in stream_run(pipeline, query, history):
+                    if event == "chunk":
+                        renderer(payload)
+                        pending_images = fill_images(pending_images)
+                    elif event == "sources":
+                        # Komt binnen zodra retrieval klaar is, vóór het eerste token van het antwoord
+                        image_paths, archive_numbers = collect_sources(payload)
+                        if archive_numbers:
+                            pending_images = render_sources(sources_placeholder, image_paths, archive_numbers)
+                    else:
+                        response = payload
+                fill_images(pending_images, wait=True)
+                logger.debug("Search query: %s", response["query_joiner"]["value"])
+
+                full_response = renderer.finish(response["answer_llm"]["replies"][0])
+                logger.info("Streaming stats: %s", renderer.stats())
+                remember_exchange(memory, query, full_response)
 
             except Exception as e:
                 full_response = f"An error occurred: {e}"
@@ -210,14 +186,3 @@ if query:
             "archive_numbers": archive_numbers
         }
     )
-
-    # Now display the sources for this assistant message in the sidebar
-    if archive_numbers:
-        st.sidebar.markdown("### Sources")
-        for i, source in enumerate(archive_numbers):
-            st.sidebar.write(f"**Invnr:** {archive_numbers[i]}")
-            if image_paths[i]:
-                st.sidebar.image(image_paths[i], use_container_width=True)
-            # Optional: Add a horizontal divider for clarity
-            if i < len(archive_numbers) - 1:
-                st.sidebar.markdown("---")
\ No newline at end of file
@@ -3,18 +3,8 @@ from dotenv import load_dotenv
 import logging
 import os
 import sys
-from haystack_integrations.document_stores.pinecone import PineconeDocumentStore
-from haystack.components.embedders import OpenAIDocumentEmbedder, OpenAITextEmbedder
-from haystack.utils import Secret
-from haystack.document_stores.types.policy import DuplicatePolicy
-from haystack.components.writers import DocumentWriter
-from haystack.components.builders import PromptBuilder
-from haystack.components.generators import OpenAIGenerator
-from prompts import QUERY_REPHRASE_TEMPLATE, QUERY_ANSWER_TEMPLATE, SYSTEM_PROMPT, SYSTEM_PROMPT_2
-from haystack.components.converters import OutputAdapter
-from haystack_integrations.components.retrievers.pinecone import PineconeEmbeddingRetriever
-from haystack import Pipeline
-from haystack.dataclasses import Document
+# Alleen lichte imports hier; haystack en de pipeline laden op de achtergrond (zie startup.py)
+from startup import warm_up_in_background
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
@@ -22,74 +12,21 @@ logger = logging.getLogger(__name__)
 if not load_dotenv():
     logger.error("No .env file found")
 
+warm_up_in_background("gpt-4o")
 
-# --- Helper Functions (from your notebook) ---
-def create_docstore() -> PineconeDocumentStore:
-    return PineconeDocumentStore(
-        api_key=Secret.from_env_var("PINECONE_API_KEY"),
-        index="archiefutrecht",  # is nu statisch, raad aan gewoon in .env te zetten
-        dimension=1536,  # text-embedding-3-small
-    )
-
-def create_document_embedder() -> OpenAIDocumentEmbedder:
-    return OpenAIDocumentEmbedder(
-        model="text-embedding-3-small",
-        api_key=Secret.from_env_var("OPENAI_API_KEY"),
-    )
-
-def create_text_embedder() -> OpenAITextEmbedder:
-    return OpenAITextEmbedder(
-        model="text-embedding-3-small",
-        api_key=Secret.from_env_var("OPENAI_API_KEY"),
-    )
 
+@st.cache_resource
+def load_qa_pipeline():
+    # Eén keer per proces bouwen en opwarmen, daarna hergebruiken voor elke vraag
+    return warm_up_in_background("gpt-4o").result()
 
-def create_document_writer(docstore) -> DocumentWriter:
-    return DocumentWriter(document_store=docstore, policy=DuplicatePolicy.OVERWRITE) 
-
-
-def create_pinecone_retriever() -> PineconeEmbeddingRetriever:
-    return PineconeEmbeddingRetriever(
-        document_store=create_docstore()
-    )
-
-def create_llm_output_adapter() -> OutputAdapter:
-    return OutputAdapter(
-        template="{{ replies [0] }}",
-        output_type=str
-    )
-
-def create_qa_pipeline() -> Pipeline:
-    pipeline = Pipeline()
-
-    query_rephrase_builder = PromptBuilder(template=QUERY_REPHRASE_TEMPLATE)
-    answer_builder = PromptBuilder(template=QUERY_ANSWER_TEMPLATE)
-
-    rephrase_llm = OpenAIGenerator()
-    answer_llm = OpenAIGenerator(system_prompt=SYSTEM_PROMPT_2, model="gpt-4o")
-
-    rephrase_output_adapter = create_llm_output_adapter()
-
-    question_embedder = create_text_embedder()
-    pinecone_retriever = create_pinecone_retriever()
-
-    pipeline.add_component("query_rephrase_builder", query_rephrase_builder)
-    pipeline.add_component("rephrase_output_adapter", rephrase_output_adapter)
-    pipeline.add_component("answer_builder", answer_builder)
-    pipeline.add_component("rephrase_llm", rephrase_llm)
-    pipeline.add_component("answer_llm", answer_llm)
-    pipeline.add_component("question_embedder", question_embedder)
-    pipeline.add_component("pinecone_retriever", pinecone_retriever)
-
-    pipeline.connect("query_rephrase_builder", "rephrase_llm")
-    pipeline.connect("rephrase_llm", "rephrase_output_adapter")
-    pipeline.connect("rephrase_output_adapter", "question_embedder")
-    pipeline.connect("question_embedder.embedding", "pinecone_retriever.query_embedding")
-    pipeline.connect("pinecone_retriever", "answer_builder")
-    pipeline.connect("answer_builder", "answer_llm")
-
-    return pipeline
+def show_images(image_paths):
+    from pipelines import get_image_cache
 
+    # Lokale thumbnails; bij elke rerun (ook de history hieronder) dus geen volledige scans opnieuw ophalen
+    futures = get_image_cache().prefetch((path, None) for path in image_paths)
+    for image_path in image_paths:
+        st.image(futures[image_path].result() or image_path)
 
 # --- Streamlit App ---
 st.title("Document Chatbot")
@@ -107,8 +44,7 @@ for message in st.session_state.messages:
                 for source in message["sources"]:
                     st.markdown(f"- `{source}`")
                 if "image_paths" in message:
-                    for image_path in message["image_paths"]:
-                        st.image(image_path)
+                    show_images(message["image_paths"])
 
                 if "archive_numbers" in message:
                     st.markdown("Archive Numbers:")
@@ -126,10 +62,13 @@ if query := st.chat_input("Ask a question about the documents"):
 
     # Get the response from the pipeline
     try:
-        pipeline = create_qa_pipeline()
-        response = pipeline.run(data={"query_rephrase_builder": {"query": query}}, include_outputs_from=["pinecone_retriever"])
+        pipeline = load_qa_pipeline()
+        from haystack.dataclasses import Document
+        from pipelines import SOURCES_COMPONENT
+
+        response = pipeline.run(data={"rephrase_router": {"query": query}}, include_outputs_from=[SOURCES_COMPONENT])
         bot_response = response.get("answer_llm").get("replies")[0]
-        source_documents = response.get("pinecone_retriever").get("documents")
+        source_documents = response.get(SOURCES_COMPONENT).get("documents")
         
         # Extract source file paths, image paths and archive numbers from Document objects
         source_paths = []
@@ -137,8 +76,7 @@ if query := st.chat_input("Ask a question about the documents"):
         archive_numbers = set()
         for doc in source_documents:
             if isinstance(doc, Document):
-                print(doc.meta)
-                print("------------------------------------------------")
+                logger.debug("Source document meta: %s", doc.meta)
                 image_paths.add(doc.meta.get("representatieve\nafbeelding", None))
                 archive_numbers.add(doc.meta.get("invnr", "unknown")) # assuming your key for archive number is invnr
         
@@ -172,8 +110,7 @@ if query := st.chat_input("Ask a question about the documents"):
                 for source in source_paths:
                     st.markdown(f"- `{source}`")
                 if image_paths:
-                    for image_path in image_paths:
-                       st.image(image_path)
+                    show_images(image_paths)
 
                 if archive_numbers:
                      st.markdown("Archive Numbers:")
@@ -0,0 +1,268 @@
+import asyncio
+import concurrent.futures
+import logging
+import queue
+import threading
+from typing import Any, Callable, Coroutine, Dict, Iterator, List, Optional, Tuple
+
+from haystack import Pipeline, tracing
+from haystack.dataclasses import Document, StreamingChunk
+from openai import AsyncOpenAI
+
+from answer_cache import history_key
+from instrumentation import instrument_streaming_callback
+from pipelines import get_async_openai_client, get_qa_pipeline
+
+logger = logging.getLogger(__name__)
+
+
+def _stage(name: str):
+    # Zelfde span als Pipeline._run_component, zodat de metrics-tracer beide modi gelijk meet
+    return tracing.tracer.trace("haystack.component.run", tags={"haystack.component.name": name})
+
+
+class AsyncQAPipeline:
+    """
+    asyncio execution mode for the QA pipeline.
+
+    Reuses the components (caches, router, retrievers, prompt builders) of a pipeline
+    built by create_qa_pipeline, but talks to OpenAI through an AsyncOpenAI client and
+    runs independent branches concurrently: keyword retrieval overlaps with
+    embedding + dense retrieval. Blocking document store calls run in the default
+    executor. Cancelling the task cancels in-flight OpenAI requests.
+
+    `run` returns the same shape as Pipeline.run with include_outputs_from=[SOURCES_COMPONENT].
+    """
+
+    def __init__(self, pipeline: Pipeline, client: AsyncOpenAI):
+        self.pipeline = pipeline
+        self.client = client
+        self.rephrase_router = pipeline.get_component("rephrase_router")
+        self.query_rephrase_builder = pipeline.get_component("query_rephrase_builder")
+        self.rephrase_llm = pipeline.get_component("rephrase_llm")
+        self.question_embedder = pipeline.get_component("question_embedder")
+        self.retriever = pipeline.get_component("pinecone_retriever")
+        self.keyword_retriever = pipeline.get_component("keyword_retriever")
+        self.document_joiner = pipeline.get_component("document_joiner")
+        self.document_reranker = pipeline.get_component("document_reranker")
+        self.context_assembler = pipeline.get_component("context_assembler")
+        self.answer_builder = pipeline.get_component("answer_builder")
+        self.answer_llm = pipeline.get_component("answer_llm")
+
+    async def run(
+        self,
+        query: str,
+        history: Optional[List[Any]] = None,
+        streaming_callback: Optional[Callable[[StreamingChunk], None]] = None,
+        sources_callback: Optional[Callable[[List[Document]], None]] = None,
+    ) -> Dict[str, Dict[str, Any]]:
+        with tracing.tracer.trace("haystack.pipeline.run"):
+            with _stage("rephrase_router") as span:
+                route = self.rephrase_router.run(query=query, history=history)
+                span.set_content_tag("haystack.component.output", route)
+            if "query" in route:
+                search_query = route["query"]
+            else:
+                search_query = await self._rephrase(route["rephrase_query"], route["history"])
+
+            embedding, documents = await self._retrieve(search_query)
+            with _stage("document_reranker") as span:
+                # Cross-encoder is CPU-werk; niet op de event loop
+                result = await asyncio.to_thread(
+                    self.document_reranker.run, documents=documents, query=search_query, query_embedding=embedding
+                )
+                span.set_content_tag("haystack.component.output", result)
+            documents = result["documents"]
+            if sources_callback is not None:
+                # Bronnen zijn nu al bekend; de UI kan ze tonen terwijl het antwoord nog gegenereerd wordt
+                sources_callback(documents)
+
+            with _stage("context_assembler") as span:
+                context = self.context_assembler.run(documents=documents, history=history, query=search_query)
+                span.set_content_tag("haystack.component.output", context)
+            with _stage("answer_builder"):
+                prompt = self.answer_builder.run(
+                    documents=context["documents"], history=context["history"], query=context["query"]
+                )["prompt"]
+            with _stage("answer_llm") as span:
+                replies, meta = await self._answer(
+                    prompt, embedding, context["documents"], context["history"], streaming_callback
+                )
+                span.set_content_tag("haystack.component.output", {"replies": replies, "meta": meta})
+        return {
+            "query_joiner": {"value": search_query},
+            "document_reranker": {"documents": documents},
+            "context_assembler": {"token_counts": context["token_counts"]},
+            "answer_llm": {"replies": replies, "meta": meta},
+        }
+
+    async def _rephrase(self, query: str, history: List[Any]) -> str:
+        prompt = self.query_rephrase_builder.run(query=query, history=history)["prompt"]
+        with _stage("rephrase_llm") as span:
+            completion = await self.client.chat.completions.create(
+                model=self.rephrase_llm.model,
+                messages=[{"role": "user", "content": prompt}],
+                **self.rephrase_llm.generation_kwargs,
+            )
+            usage = completion.usage.model_dump() if completion.usage is not None else {}
+            span.set_content_tag("haystack.component.output", {"meta": [{"usage": usage}]})
+        return completion.choices[0].message.content or query
+
+    async def _retrieve(self, search_query: str) -> Tuple[Optional[List[float]], List[Document]]:
+        keyword_task = asyncio.create_task(self._keyword(search_query))
+        dense_task = asyncio.create_task(self._dense(search_query))
+        try:
+            keyword = await keyword_task
+            if "dense_query" not in keyword:
+                # Exacte invnr-vraag: de keyword index is genoeg
+                dense_task.cancel()
+                return None, self._join([keyword["documents"]])
+            embedding, dense_documents = await dense_task
+        except BaseException:
+            keyword_task.cancel()
+            dense_task.cancel()
+            raise
+        return embedding, self._join([keyword["documents"], dense_documents])
+
+    async def _keyword(self, text: str) -> Dict[str, Any]:
+        with _stage("keyword_retriever") as span:
+            result = await asyncio.to_thread(self.keyword_retriever.run, query=text)
+            span.set_content_tag("haystack.component.output", result)
+        return result
+
+    def _join(self, document_lists: List[List[Document]]) -> List[Document]:
+        with _stage("document_joiner") as span:
+            result = self.document_joiner.run(documents=document_lists)
+            span.set_content_tag("haystack.component.output", result)
+        return result["documents"]
+
+    async def _dense(self, text: str) -> Tuple[List[float], List[Document]]:
+        with _stage("question_embedder") as span:
+            embedding, cache_hit = await self._embed(text)
+            span.set_content_tag("haystack.component.output", {"meta": {"cache_hit": cache_hit}})
+        with _stage("pinecone_retriever") as span:
+            result = await asyncio.to_thread(self.retriever.run, query_embedding=embedding)
+            span.set_content_tag("haystack.component.output", result)
+        return embedding, result["documents"]
+
+    async def _embed(self, text: str) -> Tuple[List[float], bool]:
+        cache = self.question_embedder.cache
+        model_key = self.question_embedder.model_key
+        embedding = cache.peek(text, model_key)
+        if embedding is None:
+            # De disk tier (SQLite, met commit) blokkeert anders de streams van alle andere sessies
+            embedding = await asyncio.to_thread(cache.get, text, model_key)
+        if embedding is not None:
+            return embedding, True
+        embedder = self.question_embedder.embedder
+        kwargs = {"dimensions": embedder.dimensions} if embedder.dimensions else {}
+        response = await self.client.embeddings.create(
+            model=embedder.model, input=embedder.prefix + text.replace("\n", " ") + embedder.suffix, **kwargs
+        )
+        embedding = response.data[0].embedding
+        await asyncio.to_thread(cache.put, text, model_key, embedding)
+        return embedding, False
+
+    async def _answer(
+        self,
+        prompt: str,
+        embedding: Optional[List[float]],
+        documents: List[Document],
+        history: List[Any],
+        streaming_callback: Optional[Callable[[StreamingChunk], None]],
+    ) -> Tuple[List[str], List[Dict[str, Any]]]:
+        if embedding is not None:
+            cached = self.answer_llm.cache.lookup(embedding, documents, history_key(history))
+            if cached is not None:
+                if streaming_callback is not None:
+                    streaming_callback(StreamingChunk(content=cached.reply, meta={"cache_hit": True}))
+                return [cached.reply], [{**cached.meta, "cache_hit": True}]
+
+        generator = self.answer_llm.generator
+        messages = [{"role": "user", "content": prompt}]
+        if generator.system_prompt:
+            messages.insert(0, {"role": "system", "content": generator.system_prompt})
+        stream = await self.client.chat.completions.create(
+            model=generator.model,
+            messages=messages,
+            stream=True,
+            stream_options={"include_usage": True},
+            **generator.generation_kwargs,
+        )
+        parts: List[str] = []
+        meta: Dict[str, Any] = {"model": generator.model, "finish_reason": None, "usage": {}}
+        async for chunk in stream:
+            if chunk.usage is not None:
+                meta["usage"] = chunk.usage.model_dump()
+            if not chunk.choices:
+                continue
+            choice = chunk.choices[0]
+            if choice.finish_reason:
+                meta["finish_reason"] = choice.finish_reason
+            if choice.delta.content:
+                parts.append(choice.delta.content)
+                if streaming_callback is not None:
+                    streaming_callback(
+                        StreamingChunk(content=choice.delta.content, meta={"model": chunk.model, "finish_reason": choice.finish_reason})
+                    )
+        reply = "".join(parts)
+        self.answer_llm.remember(embedding, documents, reply, meta, history)
+        return [reply], [{**meta, "cache_hit": False}]
+
+
+# --- Background event loop ---
+# Eén event loop per proces bedient alle sessies; de async OpenAI client is aan deze loop gebonden.
+_loop: Optional[asyncio.AbstractEventLoop] = None
+_loop_lock = threading.Lock()
+_async_pipelines: Dict[str, AsyncQAPipeline] = {}
+
+def get_event_loop() -> asyncio.AbstractEventLoop:
+    global _loop
+    with _loop_lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            threading.Thread(target=_loop.run_forever, name="qa-event-loop", daemon=True).start()
+        return _loop
+
+def submit(coro: Coroutine) -> concurrent.futures.Future:
+    return asyncio.run_coroutine_threadsafe(coro, get_event_loop())
+
+def get_async_qa_pipeline(answer_model: str = "gpt-4o-mini") -> AsyncQAPipeline:
+    with _loop_lock:
+        pipeline = _async_pipelines.get(answer_model)
+        if pipeline is None:
+            pipeline = AsyncQAPipeline(get_qa_pipeline(answer_model), get_async_openai_client())
+            _async_pipelines[answer_model] = pipeline
+        return pipeline
+
+def stream_run(
+    pipeline: AsyncQAPipeline, query: str, history: Optional[List[Any]] = None
+) -> Iterator[Tuple[str, Any]]:
+    """
+    Run the async pipeline from synchronous code (e.g. a Streamlit script thread).
+
+    Yields one ("sources", List[Document]) event as soon as retrieval is done, then
+    ("chunk", StreamingChunk) events, followed by one ("result", dict). Closing the
+    iterator early, for example because Streamlit stops the script for a new message,
+    cancels the pipeline run.
+    """
+    events: "queue.Queue[Tuple[str, Any]]" = queue.Queue()
+    streaming_callback = instrument_streaming_callback(lambda chunk: events.put(("chunk", chunk)))
+    future = submit(
+        pipeline.run(
+            query,
+            history,
+            streaming_callback=streaming_callback,
+            sources_callback=lambda documents: events.put(("sources", documents)),
+        )
+    )
+    future.add_done_callback(lambda f: events.put(("done", f)))
+    try:
+        while True:
+            kind, payload = events.get()
+            if kind == "done":
+                yield "result", payload.result()
+                return
+            yield kind, payload
+    finally:
+        future.cancel()
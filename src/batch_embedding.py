@@ -0,0 +1,316 @@
+import hashlib
+import logging
+import random
+import sqlite3
+import threading
+import time
+from array import array
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, as_completed, wait
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from haystack import Document, component
+from haystack.utils import Secret
+from openai import APIConnectionError, APIStatusError, APITimeoutError, InternalServerError, OpenAI, RateLimitError
+
+from context_assembly import TokenCounter
+
+logger = logging.getLogger(__name__)
+
+
+class RateLimiter:
+    """
+    Token buckets for requests and tokens per minute, shared by all embedding threads.
+    `pause` stops everyone for a while, e.g. after a 429 with a Retry-After header.
+    """
+
+    def __init__(self, requests_per_minute: Optional[int] = None, tokens_per_minute: Optional[int] = None):
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self._requests = float(requests_per_minute or 0)
+        self._tokens = float(tokens_per_minute or 0)
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self, tokens: int = 0) -> None:
+        if self.tokens_per_minute:
+            # Een batch groter dan het hele budget zou anders eeuwig wachten
+            tokens = min(tokens, self.tokens_per_minute)
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._refill(now)
+                wait = self._paused_until - now
+                if wait <= 0:
+                    wait = max(self._shortfall(self._requests, 1, self.requests_per_minute),
+                               self._shortfall(self._tokens, tokens, self.tokens_per_minute))
+                    if wait <= 0:
+                        self._requests -= 1
+                        self._tokens -= tokens
+                        return
+            time.sleep(wait)
+
+    def pause(self, seconds: float) -> None:
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+    def _refill(self, now: float) -> None:
+        elapsed = now - self._updated
+        self._updated = now
+        if self.requests_per_minute:
+            self._requests = min(self.requests_per_minute, self._requests + elapsed * self.requests_per_minute / 60)
+        if self.tokens_per_minute:
+            self._tokens = min(self.tokens_per_minute, self._tokens + elapsed * self.tokens_per_minute / 60)
+
+    @staticmethod
+    def _shortfall(available: float, needed: int, per_minute: Optional[int]) -> float:
+        if not per_minute or available >= needed:
+            return 0.0
+        return (needed - available) * 60 / per_minute
+
+
+class EmbeddingCheckpoint:
+    """
+    SQLite file with document embeddings that are computed but not yet safely in the store.
+
+    Keys are derived from model and text, so after a crash a re-run finds the vectors
+    again even though the chunks are split anew. Entries are removed with `discard` once
+    the documents are written.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vector BLOB NOT NULL)")
+        self._db.commit()
+
+    @staticmethod
+    def make_key(text: str, model: str) -> str:
+        return hashlib.sha256(f"{model}\x00{text}".encode("utf-8")).hexdigest()
+
+    def get_many(self, keys: List[str]) -> Dict[str, List[float]]:
+        found: Dict[str, List[float]] = {}
+        with self._lock:
+            # SQLite staat standaard maximaal 999 parameters per statement toe
+            for start in range(0, len(keys), 900):
+                part = keys[start:start + 900]
+                rows = self._db.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({','.join('?' * len(part))})", part
+                ).fetchall()
+                found.update((key, array("f", vector).tolist()) for key, vector in rows)
+        return found
+
+    def put_many(self, items: Iterable[Tuple[str, List[float]]]) -> None:
+        with self._lock:
+            self._db.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, vector) VALUES (?, ?)",
+                [(key, array("f", vector).tobytes()) for key, vector in items],
+            )
+            self._db.commit()
+
+    def discard(self, keys: List[str]) -> None:
+        with self._lock:
+            self._db.executemany("DELETE FROM embeddings WHERE key = ?", [(key,) for key in keys])
+            self._db.commit()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+
+    def close(self) -> None:
+        self._db.close()
+
+
+@component
+class ConcurrentDocumentEmbedder:
+    """
+    Drop-in replacement for OpenAIDocumentEmbedder that keeps several batches in flight.
+
+    Batches are capped by document count and tokens and sent from a thread pool under a
+    shared requests/tokens-per-minute budget. Rate limits, timeouts and 5xx errors are
+    retried with exponential backoff (honouring Retry-After); a batch that still fails
+    leaves its documents without embedding, like OpenAIDocumentEmbedder does. Input is
+    consumed lazily, at most `max_in_flight` batches ahead. With a `checkpoint` every
+    finished batch is stored on disk first, so an interrupted run does not pay for the
+    same vectors twice.
+    """
+
+    def __init__(
+        self,
+        model: str = "text-embedding-3-small",
+        dimensions: Optional[int] = None,
+        client: Optional[OpenAI] = None,
+        batch_size: int = 128,
+        max_batch_tokens: int = 100_000,
+        max_concurrency: int = 4,
+        max_in_flight: Optional[int] = None,
+        requests_per_minute: Optional[int] = None,
+        tokens_per_minute: Optional[int] = None,
+        max_retries: int = 6,
+        max_backoff: float = 60.0,
+        checkpoint: Optional[EmbeddingCheckpoint] = None,
+        meta_fields_to_embed: Optional[List[str]] = None,
+        embedding_separator: str = "\n",
+    ):
+        self.model = model
+        self.dimensions = dimensions
+        self.client = client or OpenAI(api_key=Secret.from_env_var("OPENAI_API_KEY").resolve_value())
+        self.batch_size = batch_size
+        self.max_batch_tokens = max_batch_tokens
+        self.max_concurrency = max_concurrency
+        # Eén batch extra per thread in de wachtrij, zodat de threads niet stilvallen tijdens het schrijven
+        self.max_in_flight = max_in_flight or 2 * max_concurrency
+        self.rate_limiter = RateLimiter(requests_per_minute, tokens_per_minute)
+        self.max_retries = max_retries
+        self.max_backoff = max_backoff
+        self.checkpoint = checkpoint
+        self.meta_fields_to_embed = meta_fields_to_embed or []
+        self.embedding_separator = embedding_separator
+        self.model_key = f"{model}:{dimensions}" if dimensions else model
+        self._counter = TokenCounter(model)
+        self._stats_lock = threading.Lock()
+        self.requests = 0
+        self.retries = 0
+        self.checkpoint_hits = 0
+        self.failed = 0
+
+    @component.output_types(documents=List[Document], meta=Dict[str, Any])
+    def run(self, documents: List[Document]):
+        usage = {"prompt_tokens": 0, "total_tokens": 0}
+        for _, batch_usage in self.iter_batches(documents):
+            for key in usage:
+                usage[key] += batch_usage.get(key, 0)
+        return {"documents": documents, "meta": {"model": self.model, "usage": usage}}
+
+    def iter_batches(self, documents: Iterable[Document]) -> Iterator[Tuple[List[Document], Dict[str, int]]]:
+        """
+        Embed `documents` in place and yield (documents, usage) per batch in completion order,
+        so the caller can write while later batches are still in flight. `documents` may be a
+        generator; it is only consumed as far as `max_in_flight` batches allow. Documents of
+        a batch that failed are yielded with `embedding=None`.
+        """
+        in_flight: Dict[Future, Tuple[List[Document], List[str]]] = {}
+        with ThreadPoolExecutor(max_workers=self.max_concurrency, thread_name_prefix="embedder") as pool:
+            for batch, texts, tokens in self._batches(documents):
+                keys = [EmbeddingCheckpoint.make_key(text, self.model_key) for text in texts]
+                if self.checkpoint is not None:
+                    stored = self.checkpoint.get_many(keys)
+                    if stored:
+                        restored = []
+                        for doc, key in zip(batch, keys):
+                            if key in stored:
+                                doc.embedding = stored[key]
+                                restored.append(doc)
+                        self.checkpoint_hits += len(restored)
+                        logger.debug("Restored %d embeddings from checkpoint", len(restored))
+                        yield restored, {}
+                        missing = [(doc, text, key) for doc, text, key in zip(batch, texts, keys) if key not in stored]
+                        if not missing:
+                            continue
+                        batch, texts, keys = (list(column) for column in zip(*missing))
+                        tokens = sum(self._counter.count(text) for text in texts)
+                in_flight[pool.submit(self._embed, texts, tokens)] = (batch, keys)
+                # Backpressure: pas weer documenten ophalen als er een batch klaar is
+                if len(in_flight) >= self.max_in_flight:
+                    done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        yield self._finish(future, *in_flight.pop(future))
+            for future in as_completed(list(in_flight)):
+                yield self._finish(future, *in_flight.pop(future))
+
+    def checkpoint_keys(self, documents: List[Document]) -> List[str]:
+        return [EmbeddingCheckpoint.make_key(self._text_to_embed(doc), self.model_key) for doc in documents]
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "requests": self.requests,
+            "retries": self.retries,
+            "checkpoint_hits": self.checkpoint_hits,
+            "failed": self.failed,
+        }
+
+    def _text_to_embed(self, doc: Document) -> str:
+        # Gelijk aan OpenAIDocumentEmbedder, zodat bestaande vectoren vergelijkbaar blijven
+        meta_values = [str(doc.meta[key]) for key in self.meta_fields_to_embed if doc.meta.get(key) is not None]
+        return self.embedding_separator.join(meta_values + [doc.content or ""]).replace("\n", " ")
+
+    def _batches(self, documents: Iterable[Document]) -> Iterator[Tuple[List[Document], List[str], int]]:
+        batch: List[Document] = []
+        texts: List[str] = []
+        batch_tokens = 0
+        for doc in documents:
+            text = self._text_to_embed(doc)
+            tokens = self._counter.count(text)
+            if batch and (len(batch) >= self.batch_size or batch_tokens + tokens > self.max_batch_tokens):
+                yield batch, texts, batch_tokens
+                batch, texts, batch_tokens = [], [], 0
+            batch.append(doc)
+            texts.append(text)
+            batch_tokens += tokens
+        if batch:
+            yield batch, texts, batch_tokens
+
+    def _finish(self, future: Future, batch: List[Document], keys: List[str]) -> Tuple[List[Document], Dict[str, int]]:
+        try:
+            embeddings, usage = future.result()
+        except Exception as e:
+            # Zelfde contract als OpenAIDocumentEmbedder: loggen en zonder embedding laten
+            logger.error("Embedding %d documents failed: %s", len(batch), e)
+            self._count("failed", len(batch))
+            return batch, {}
+        for doc, embedding in zip(batch, embeddings):
+            doc.embedding = embedding
+        if self.checkpoint is not None:
+            self.checkpoint.put_many(zip(keys, embeddings))
+        return batch, usage
+
+    def _embed(self, texts: List[str], tokens: int) -> Tuple[List[List[float]], Dict[str, int]]:
+        args: Dict[str, Any] = {"model": self.model, "input": texts}
+        if self.dimensions is not None:
+            args["dimensions"] = self.dimensions
+        # Retries doen we zelf, met gedeelde rate limiter; de SDK zou anders per thread opnieuw proberen
+        client = self.client.with_options(max_retries=0)
+        attempt = 0
+        while True:
+            self.rate_limiter.acquire(tokens)
+            self._count("requests")
+            try:
+                response = client.embeddings.create(**args)
+                embeddings = [item.embedding for item in sorted(response.data, key=lambda item: item.index)]
+                return embeddings, {"prompt_tokens": response.usage.prompt_tokens, "total_tokens": response.usage.total_tokens}
+            except RateLimitError as e:
+                if e.code == "insufficient_quota" or attempt >= self.max_retries:
+                    raise
+                delay = _retry_after(e) or self._backoff(attempt)
+                self.rate_limiter.pause(delay)
+                error: Exception = e
+            except (APIConnectionError, APITimeoutError, InternalServerError) as e:
+                if attempt >= self.max_retries:
+                    raise
+                delay = self._backoff(attempt)
+                error = e
+            attempt += 1
+            self._count("retries")
+            logger.warning("Embedding request failed (%s), retry %d in %.1fs", error, attempt, delay)
+            time.sleep(delay)
+
+    def _count(self, counter: str, n: int = 1) -> None:
+        with self._stats_lock:
+            setattr(self, counter, getattr(self, counter) + n)
+
+    def _backoff(self, attempt: int) -> float:
+        # Exponentieel met jitter, zodat de threads niet tegelijk terugkomen
+        return random.uniform(0.5, 1.0) * min(self.max_backoff, 2.0 ** attempt)
+
+
+def _retry_after(error: APIStatusError) -> Optional[float]:
+    headers = error.response.headers
+    try:
+        if headers.get("retry-after-ms"):
+            return float(headers["retry-after-ms"]) / 1000
+        if headers.get("retry-after"):
+            return float(headers["retry-after"])
+    except ValueError:
+        pass
+    return None
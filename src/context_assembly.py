@@ -0,0 +1,160 @@
+import hashlib
+import logging
+from functools import lru_cache
+from typing import Any, Dict, List, Optional, Tuple
+
+from haystack import Document, component
+
+try:
+    import tiktoken
+except ImportError:  # tiktoken staat in requirements.txt, maar zonder kunnen we ook (grof) tellen
+    tiktoken = None
+
+logger = logging.getLogger(__name__)
+
+# Rol van de lopende samenvatting van oudere beurten (zie conversation_memory.py)
+SUMMARY_ROLE = "samenvatting"
+
+
+def message_role(message: Any) -> str:
+    role = message.get("role") if isinstance(message, dict) else getattr(message, "role", None)
+    return str(getattr(role, "value", role))
+
+def message_text(message: Any) -> str:
+    if isinstance(message, dict):
+        return message.get("content") or ""
+    return getattr(message, "text", None) or getattr(message, "content", None) or ""
+
+
+class TokenCounter:
+    """Counts tokens locally with tiktoken; falls back to ~4 characters per token."""
+
+    def __init__(self, model: str = "gpt-4o"):
+        self.model = model
+        self._encoding = _encoding_for(model)
+
+    def count(self, text: str) -> int:
+        if self._encoding is None:
+            return (len(text) + 3) // 4
+        return len(self._encoding.encode(text, disallowed_special=()))
+
+    def truncate(self, text: str, max_tokens: int) -> str:
+        if self._encoding is None:
+            return text[: max_tokens * 4]
+        tokens = self._encoding.encode(text, disallowed_special=())
+        return text if len(tokens) <= max_tokens else self._encoding.decode(tokens[:max_tokens])
+
+@lru_cache(maxsize=None)
+def _encoding_for(model: str):
+    if tiktoken is None:
+        return None
+    try:
+        try:
+            return tiktoken.encoding_for_model(model)
+        except KeyError:
+            return tiktoken.get_encoding("o200k_base")
+    except Exception as e:
+        # tiktoken downloadt de BPE-bestanden bij eerste gebruik; offline schatten we
+        logger.warning("No tiktoken encoding for %s (%s), estimating tokens from length", model, e)
+        return None
+
+
+def fit_history(
+    history: Optional[List[Any]], max_tokens: int, counter: TokenCounter, query: Optional[str] = None
+) -> Tuple[List[Any], int, int]:
+    """
+    Keep the most recent turns that fit in `max_tokens`.
+
+    System messages are dropped (the generator sends its own system prompt), as is a
+    trailing user message equal to `query`, which the templates render separately.
+    A leading conversation summary is kept first, since it stands for every older turn.
+    Returns (kept turns, tokens used, number of dropped turns).
+    """
+    turns = [m for m in history or [] if message_role(m) != "system"]
+    if turns and query is not None and message_role(turns[-1]) == "user" and message_text(turns[-1]) == query:
+        turns = turns[:-1]
+    # De samenvatting staat voor alle oudere beurten en krijgt daarom als eerste budget
+    pinned: List[Any] = []
+    used = 0
+    if turns and message_role(turns[0]) == SUMMARY_ROLE:
+        tokens = counter.count(message_text(turns[0])) + 4
+        if tokens <= max_tokens:
+            pinned, used = [turns[0]], tokens
+        turns = turns[1:]
+    kept: List[Any] = []
+    for message in reversed(turns):
+        tokens = counter.count(message_text(message)) + 4  # rol + opmaak in de template
+        if used + tokens > max_tokens:
+            break
+        kept.append(message)
+        used += tokens
+    kept.reverse()
+    return pinned + kept, used, len(turns) - len(kept)
+
+
+def document_prompt_text(doc: Document) -> str:
+    """A document as QUERY_ANSWER_TEMPLATE renders it; keep both in sync."""
+    invnr = doc.meta.get("invnr")
+    return f"(invnr {invnr}) {doc.content or ''}" if invnr else doc.content or ""
+
+
+@component
+class ContextAssembler:
+    """
+    Fits conversation history and retrieved documents into a token budget before answer_builder.
+
+    History gets at most `history_share` of `max_tokens`, newest turns first. Documents are
+    de-duplicated on content, each truncated to `max_document_tokens`, and added in rank
+    order until the remaining budget is spent. A document counts as the prompt renders it
+    (`document_prompt_text`), invnr included.
+    """
+
+    def __init__(
+        self,
+        max_tokens: int = 6000,
+        history_share: float = 0.3,
+        max_document_tokens: int = 400,
+        model: str = "gpt-4o",
+    ):
+        self.max_tokens = max_tokens
+        self.history_share = history_share
+        self.max_document_tokens = max_document_tokens
+        self.counter = TokenCounter(model)
+
+    @component.output_types(documents=List[Document], history=List[Any], query=str, token_counts=Dict[str, int])
+    def run(self, documents: List[Document], history: Optional[List[Any]] = None, query: Optional[str] = None):
+        query = query or ""
+        query_tokens = self.counter.count(query)
+        history, history_tokens, dropped_turns = fit_history(
+            history, int(self.max_tokens * self.history_share), self.counter, query=query
+        )
+
+        budget = self.max_tokens - query_tokens - history_tokens
+        fitted: List[Document] = []
+        seen = set()
+        document_tokens = 0
+        for doc in documents:
+            content = doc.content or ""
+            digest = hashlib.sha1(content.strip().lower().encode("utf-8")).digest()
+            if digest in seen:
+                continue
+            seen.add(digest)
+            truncated = self.counter.truncate(content, self.max_document_tokens)
+            if truncated != content:
+                doc = Document(id=doc.id, content=truncated, meta=doc.meta, score=doc.score, embedding=doc.embedding)
+            tokens = self.counter.count(document_prompt_text(doc))
+            if document_tokens + tokens > budget:
+                break
+            document_tokens += tokens
+            fitted.append(doc)
+
+        token_counts = {
+            "query": query_tokens,
+            "history": history_tokens,
+            "documents": document_tokens,
+            "total": query_tokens + history_tokens + document_tokens,
+            "dropped_turns": dropped_turns,
+            "dropped_documents": len(documents) - len(fitted),
+        }
+        logger.debug("Context tokens: %s", token_counts)
+        return {"documents": fitted, "history": history, "query": query, "token_counts": token_counts}
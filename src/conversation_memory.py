@@ -0,0 +1,242 @@
+"""
+Rolling conversation memory: a running summary plus the most recent messages verbatim.
+
+The prompts get the summary and the last `window` messages instead of the whole transcript,
+so the work per turn stays constant however long a session runs. Messages that fall out
+of the window wait in `pending` (and still go into the prompt) until a ConversationSummarizer
+has folded them into the summary with a cheap model, off the request path. ConversationStore
+keeps the compact state per session in SQLite, so sessions survive a restart.
+"""
+import json
+import logging
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
+
+from haystack.components.builders import PromptBuilder
+
+from context_assembly import SUMMARY_ROLE
+from prompts import CONVERSATION_SUMMARY_TEMPLATE
+
+logger = logging.getLogger(__name__)
+
+
+class ConversationMemory:
+    """Summary, messages waiting to be summarized and the recent window of one session."""
+
+    def __init__(
+        self,
+        session_id: str,
+        window: int = 6,
+        summary: str = "",
+        messages: Optional[List[Dict[str, str]]] = None,
+        pending: Optional[List[Dict[str, str]]] = None,
+        summarized: int = 0,
+        updated: Optional[float] = None,
+    ):
+        self.session_id = session_id
+        self.window = window
+        self.summary = summary
+        self.messages: List[Dict[str, str]] = list(messages or [])
+        self.pending: List[Dict[str, str]] = list(pending or [])
+        self.summarized = summarized
+        self.updated = updated if updated is not None else time.time()
+        # De summarizer werkt de samenvatting bij vanuit een andere thread
+        self._lock = threading.Lock()
+
+    def add(self, role: str, content: str) -> None:
+        with self._lock:
+            self.messages.append({"role": role, "content": content})
+            overflow = len(self.messages) - self.window
+            if overflow > 0:
+                self.pending.extend(self.messages[:overflow])
+                del self.messages[:overflow]
+            self.updated = time.time()
+
+    def add_exchange(self, query: str, answer: str) -> None:
+        self.add("user", query)
+        self.add("assistant", answer)
+
+    def history(self) -> List[Dict[str, str]]:
+        """Messages for the prompts: the summary first, then everything not yet summarized."""
+        with self._lock:
+            head = [{"role": SUMMARY_ROLE, "content": self.summary}] if self.summary else []
+            return head + [dict(m) for m in self.pending + self.messages]
+
+    def take_pending(self) -> Tuple[str, List[Dict[str, str]]]:
+        """(current summary, messages to fold in); they stay pending until `fold`."""
+        with self._lock:
+            return self.summary, list(self.pending)
+
+    def fold(self, summary: str, count: int) -> None:
+        """Replace the summary by one that covers the first `count` pending messages."""
+        with self._lock:
+            self.summary = summary
+            del self.pending[:count]
+            self.summarized += count
+
+    def discard_pending(self) -> None:
+        # Zonder summarizer vallen oude berichten gewoon weg, zoals een vast venster
+        with self._lock:
+            self.pending.clear()
+
+    def to_dict(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "summary": self.summary,
+                "messages": list(self.messages),
+                "pending": list(self.pending),
+                "summarized": self.summarized,
+            }
+
+    @classmethod
+    def from_dict(cls, session_id: str, data: Dict[str, Any], window: int = 6, updated: Optional[float] = None):
+        memory = cls(
+            session_id,
+            window=window,
+            summary=data.get("summary") or "",
+            pending=data.get("pending"),
+            summarized=data.get("summarized", 0),
+            updated=updated,
+        )
+        # Een kleiner venster na een herstart: de oudste berichten gaan alsnog naar pending
+        for message in data.get("messages") or []:
+            memory.messages.append(message)
+        overflow = len(memory.messages) - window
+        if overflow > 0:
+            memory.pending.extend(memory.messages[:overflow])
+            del memory.messages[:overflow]
+        return memory
+
+
+class ConversationStore:
+    """SQLite persistence of ConversationMemory per session id; idle sessions expire after `ttl_seconds`."""
+
+    def __init__(self, path: str = ":memory:", window: int = 6, ttl_seconds: Optional[float] = None):
+        self.path = path
+        self.window = window
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        if path != ":memory:":
+            # Meerdere Streamlit- en serverprocessen kunnen dezelfde sessies lezen
+            self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS conversations (session_id TEXT PRIMARY KEY, data TEXT NOT NULL, updated REAL NOT NULL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS conversations_updated ON conversations (updated)")
+        self._db.commit()
+
+    def load(self, session_id: str) -> Optional[ConversationMemory]:
+        with self._lock:
+            row = self._db.execute(
+                "SELECT data, updated FROM conversations WHERE session_id = ?", (session_id,)
+            ).fetchone()
+        if row is None or self._expired(row[1]):
+            return None
+        return ConversationMemory.from_dict(session_id, json.loads(row[0]), window=self.window, updated=row[1])
+
+    def load_or_create(self, session_id: str) -> ConversationMemory:
+        return self.load(session_id) or ConversationMemory(session_id, window=self.window)
+
+    def save(self, memory: ConversationMemory) -> None:
+        data = json.dumps(memory.to_dict(), ensure_ascii=False)
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO conversations (session_id, data, updated) VALUES (?, ?, ?)",
+                (memory.session_id, data, memory.updated),
+            )
+            if self.ttl_seconds is not None:
+                self._db.execute("DELETE FROM conversations WHERE updated < ?", (time.time() - self.ttl_seconds,))
+            self._db.commit()
+
+    def delete(self, session_id: str) -> bool:
+        with self._lock:
+            cursor = self._db.execute("DELETE FROM conversations WHERE session_id = ?", (session_id,))
+            self._db.commit()
+        return cursor.rowcount > 0
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM conversations").fetchone()[0]
+
+    def _expired(self, updated: float) -> bool:
+        return self.ttl_seconds is not None and time.time() - updated > self.ttl_seconds
+
+
+class ConversationSummarizer:
+    """
+    Folds the pending messages of a ConversationMemory into its summary with `generator`
+    (a cheap model), on background threads. Only called when messages have left the window,
+    so most turns cost nothing extra. A failed call leaves the messages pending; the next
+    turn retries.
+    """
+
+    def __init__(
+        self,
+        generator,
+        store: Optional[ConversationStore] = None,
+        max_words: int = 150,
+        max_message_chars: int = 2000,
+        max_workers: int = 2,
+    ):
+        self.generator = generator
+        self.store = store
+        self.max_words = max_words
+        self.max_message_chars = max_message_chars
+        self.prompt_builder = PromptBuilder(template=CONVERSATION_SUMMARY_TEMPLATE, required_variables=["messages"])
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="conversation-summary")
+        self._lock = threading.Lock()
+        self._in_flight: Dict[str, Future] = {}
+        self.calls = 0
+        self.failures = 0
+
+    def summarize(self, summary: str, messages: List[Dict[str, str]]) -> str:
+        # Lange antwoorden (met opsommingen van bronnen) hoeven niet volledig mee
+        messages = [
+            {"role": m["role"], "content": m["content"][: self.max_message_chars]} for m in messages
+        ]
+        prompt = self.prompt_builder.run(summary=summary, messages=messages, max_words=self.max_words)["prompt"]
+        self.calls += 1
+        return self.generator.run(prompt=prompt)["replies"][0].strip()
+
+    def update(self, memory: ConversationMemory) -> bool:
+        """Summarize synchronously until nothing is pending; True when the summary changed."""
+        changed = False
+        while True:
+            summary, pending = memory.take_pending()
+            if not pending:
+                return changed
+            memory.fold(self.summarize(summary, pending), len(pending))
+            changed = True
+            if self.store is not None:
+                self.store.save(memory)
+
+    def submit(self, memory: ConversationMemory) -> Optional[Future]:
+        """Update in the background; at most one update per session runs at a time."""
+        if not memory.pending:
+            return None
+        with self._lock:
+            future = self._in_flight.get(memory.session_id)
+            if future is None:
+                future = self._executor.submit(self._update, memory)
+                self._in_flight[memory.session_id] = future
+                future.add_done_callback(lambda _, session_id=memory.session_id: self._done(session_id))
+            return future
+
+    def _update(self, memory: ConversationMemory) -> bool:
+        try:
+            return self.update(memory)
+        except Exception as e:
+            self.failures += 1
+            logger.warning("Summarizing session %s failed, retrying next turn: %s", memory.session_id, e)
+            return False
+
+    def _done(self, session_id: str) -> None:
+        with self._lock:
+            self._in_flight.pop(session_id, None)
+
+    def stats(self) -> Dict[str, Any]:
+        return {"calls": self.calls, "failures": self.failures, "in_flight": len(self._in_flight)}
@@ -0,0 +1,165 @@
+import hashlib
+import logging
+import re
+import sqlite3
+import threading
+import time
+from array import array
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+
+from haystack import component
+from haystack.components.embedders import OpenAITextEmbedder
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_query(text: str) -> str:
+    # "Wat is Kasteel Amerongen?" en "wat is kasteel amerongen" moeten dezelfde key opleveren
+    text = re.sub(r"\s+", " ", text.strip().lower())
+    return text.rstrip("?!. ")
+
+
+class EmbeddingCache:
+    """Two-tier (memory LRU + optional SQLite) cache for query embeddings."""
+
+    def __init__(
+        self,
+        max_entries: int = 1024,
+        path: Optional[str] = None,
+        ttl_seconds: Optional[float] = None,
+        max_disk_entries: int = 100_000,
+    ):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.max_disk_entries = max_disk_entries
+        self._memory: "OrderedDict[str, List[float]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._db: Optional[sqlite3.Connection] = None
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        if path:
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings ("
+                "key TEXT PRIMARY KEY, vector BLOB NOT NULL, created REAL NOT NULL, accessed REAL NOT NULL)"
+            )
+            self._db.execute("CREATE INDEX IF NOT EXISTS embeddings_accessed ON embeddings (accessed)")
+            self._db.commit()
+
+    @staticmethod
+    def make_key(text: str, model: str) -> str:
+        return hashlib.sha256(f"{model}\x00{normalize_query(text)}".encode("utf-8")).hexdigest()
+
+    def get(self, text: str, model: str) -> Optional[List[float]]:
+        key = self.make_key(text, model)
+        with self._lock:
+            embedding = self._memory.get(key)
+            if embedding is not None:
+                self._memory.move_to_end(key)
+                self.memory_hits += 1
+                return embedding
+            embedding = self._disk_get(key)
+            if embedding is not None:
+                self._memory_put(key, embedding)
+                self.disk_hits += 1
+                return embedding
+            self.misses += 1
+            return None
+
+    def peek(self, text: str, model: str) -> Optional[List[float]]:
+        """Memory tier only, so safe on an event loop; a None still needs `get` for the disk tier."""
+        key = self.make_key(text, model)
+        with self._lock:
+            embedding = self._memory.get(key)
+            if embedding is not None:
+                self._memory.move_to_end(key)
+                self.memory_hits += 1
+            return embedding
+
+    def put(self, text: str, model: str, embedding: List[float]) -> None:
+        key = self.make_key(text, model)
+        with self._lock:
+            self._memory_put(key, embedding)
+            self._disk_put(key, embedding)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._memory.clear()
+            if self._db is not None:
+                self._db.execute("DELETE FROM embeddings")
+                self._db.commit()
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.memory_hits + self.disk_hits + self.misses
+        return {
+            "lookups": lookups,
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": (self.memory_hits + self.disk_hits) / lookups if lookups else 0.0,
+            "memory_entries": len(self._memory),
+        }
+
+    def _memory_put(self, key: str, embedding: List[float]) -> None:
+        self._memory[key] = embedding
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    def _disk_get(self, key: str) -> Optional[List[float]]:
+        if self._db is None:
+            return None
+        row = self._db.execute("SELECT vector, created FROM embeddings WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        now = time.time()
+        if self.ttl_seconds is not None and now - row[1] > self.ttl_seconds:
+            self._db.execute("DELETE FROM embeddings WHERE key = ?", (key,))
+            self._db.commit()
+            return None
+        self._db.execute("UPDATE embeddings SET accessed = ? WHERE key = ?", (now, key))
+        self._db.commit()
+        return array("f", row[0]).tolist()
+
+    def _disk_put(self, key: str, embedding: List[float]) -> None:
+        if self._db is None:
+            return
+        now = time.time()
+        self._db.execute(
+            "INSERT OR REPLACE INTO embeddings (key, vector, created, accessed) VALUES (?, ?, ?, ?)",
+            (key, array("f", embedding).tobytes(), now, now),
+        )
+        if self.ttl_seconds is not None:
+            self._db.execute("DELETE FROM embeddings WHERE created < ?", (now - self.ttl_seconds,))
+        # Least recently used entries vallen eruit zodra de disk tier vol zit
+        self._db.execute(
+            "DELETE FROM embeddings WHERE key IN ("
+            "SELECT key FROM embeddings ORDER BY accessed DESC LIMIT -1 OFFSET ?)",
+            (self.max_disk_entries,),
+        )
+        self._db.commit()
+
+
+@component
+class CachedTextEmbedder:
+    """Drop-in replacement for OpenAITextEmbedder that consults an EmbeddingCache first."""
+
+    def __init__(self, embedder: OpenAITextEmbedder, cache: EmbeddingCache):
+        self.embedder = embedder
+        self.cache = cache
+        # Met een andere dimensie is een embedding niet uitwisselbaar, dus die hoort in de key
+        dimensions = getattr(embedder, "dimensions", None)
+        self.model_key = f"{embedder.model}:{dimensions}" if dimensions else embedder.model
+
+    @component.output_types(embedding=List[float], meta=Dict[str, Any])
+    def run(self, text: str):
+        embedding = self.cache.get(text, self.model_key)
+        if embedding is not None:
+            logger.debug("Embedding cache hit (hit rate %.2f)", self.cache.stats()["hit_rate"])
+            return {"embedding": embedding, "meta": {"model": self.embedder.model, "cache_hit": True}}
+
+        result = self.embedder.run(text=text)
+        self.cache.put(text, self.model_key, result["embedding"])
+        return {"embedding": result["embedding"], "meta": {**result["meta"], "cache_hit": False}}
@@ -0,0 +1,319 @@
+"""
+Offline batch question answering and retrieval evaluation.
+
+    python src/evaluate.py data/eval/questions.jsonl --output data/eval/answers.jsonl
+    python src/evaluate.py questions.jsonl --output answers.parquet --concurrency 16
+    python src/evaluate.py questions.jsonl --output new.jsonl --compare old.summary.json --min-hit-rate 0.8
+
+Every line of the input is one question:
+
+    {"id": "q1", "query": "Wie bouwde het kasteel?", "expected_invnr": ["12", "13"]}
+    {"query": "En wanneer?", "history": [{"role": "user", "content": "..."}, ...]}
+
+`id`, `history` and `expected_invnr` (one inventory number or a list) are optional.
+Questions run through the QA pipeline of create_qa_pipeline (in its asyncio mode) with
+bounded concurrency. Query embeddings are requested in batches ahead of the questions
+that need them. Answers, sources, token usage and seconds per stage are written to
+--output (.jsonl or .parquet), and a summary with latency percentiles and the retrieval
+hit rate on `expected_invnr` goes to <output>.summary.json.
+
+The semantic answer cache is off unless --answer-cache is given, so every question gets
+a freshly generated answer.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import sys
+import time
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+from haystack import Document
+
+from async_pipeline import AsyncQAPipeline, get_async_qa_pipeline
+from instrumentation import collect_stage_timings, enable_instrumentation
+from pipelines import EMBEDDING_BATCH_SIZE, get_keyword_index, warm_up
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CONCURRENCY = 8
+
+
+def read_questions(path: str) -> List[Dict[str, Any]]:
+    questions = []
+    with open(path, encoding="utf-8") as f:
+        for line_number, line in enumerate(f, start=1):
+            if not line.strip():
+                continue
+            question = json.loads(line)
+            if not isinstance(question.get("query"), str) or not question["query"].strip():
+                raise ValueError(f"{path}:{line_number}: 'query' is required")
+            expected = question.get("expected_invnr")
+            if expected is not None and not isinstance(expected, list):
+                expected = [expected]
+            questions.append({
+                "id": str(question.get("id", line_number)),
+                "query": question["query"],
+                "history": question.get("history") or [],
+                "expected_invnr": None if expected is None else [str(invnr) for invnr in expected],
+            })
+    return questions
+
+def source_record(doc: Document) -> Dict[str, Any]:
+    return {
+        "id": doc.id,
+        "invnr": None if doc.meta.get("invnr") is None else str(doc.meta["invnr"]),
+        "file_path": doc.meta.get("file_path"),
+        "page_number": doc.meta.get("page_number"),
+        "score": doc.score,
+        "content": doc.content,
+    }
+
+def retrieval_scores(sources: List[Dict[str, Any]], expected: Optional[List[str]]) -> Dict[str, Any]:
+    """Hit, reciprocal rank of the first expected source and the share of expected invnrs found."""
+    if not expected:
+        return {"hit": None, "reciprocal_rank": None, "recall": None}
+    wanted = {invnr.strip().lower() for invnr in expected}
+    found = [str(source["invnr"]).strip().lower() if source["invnr"] is not None else None for source in sources]
+    ranks = [rank for rank, invnr in enumerate(found, start=1) if invnr in wanted]
+    return {
+        "hit": bool(ranks),
+        "reciprocal_rank": 1.0 / ranks[0] if ranks else 0.0,
+        "recall": len(wanted.intersection(found)) / len(wanted),
+    }
+
+
+async def prime_embeddings(qa: AsyncQAPipeline, questions: List[Dict[str, Any]]) -> int:
+    """
+    Embeds the queries that go to dense retrieval unchanged in one request and puts them
+    in the query embedding cache, where question_embedder finds them. Follow-ups that
+    get rephrased and pure invnr lookups are left to the pipeline.
+    """
+    embedder, cache = qa.question_embedder.embedder, qa.question_embedder.cache
+    router, keyword_index = qa.rephrase_router, get_keyword_index()
+    texts = []
+    for question in questions:
+        query = question["query"]
+        if question["history"] and not router.is_self_contained(query):
+            continue
+        if keyword_index.is_identifier_lookup(query) or query in texts:
+            continue
+        texts.append(query)
+    if not texts:
+        return 0
+    kwargs = {"dimensions": embedder.dimensions} if embedder.dimensions else {}
+    response = await qa.client.embeddings.create(
+        model=embedder.model,
+        input=[embedder.prefix + text.replace("\n", " ") + embedder.suffix for text in texts],
+        **kwargs,
+    )
+
+    def fill_cache() -> None:
+        for item in response.data:
+            cache.put(texts[item.index], qa.question_embedder.model_key, item.embedding)
+
+    # Met een EMBEDDING_CACHE_PATH schrijft put naar SQLite; niet op de event loop
+    await asyncio.to_thread(fill_cache)
+    return len(texts)
+
+async def answer_question(qa: AsyncQAPipeline, question: Dict[str, Any]) -> Dict[str, Any]:
+    record: Dict[str, Any] = {
+        "id": question["id"],
+        "query": question["query"],
+        "history_messages": len(question["history"]),
+        "expected_invnr": question["expected_invnr"],
+        "search_query": None,
+        "answer": None,
+        "sources": [],
+        "cache_hit": None,
+        "prompt_tokens": None,
+        "completion_tokens": None,
+        "error": None,
+    }
+    start = time.perf_counter()
+    with collect_stage_timings() as stages:
+        try:
+            result = await qa.run(question["query"], question["history"])
+            meta = result["answer_llm"]["meta"][0]
+            usage = meta.get("usage") or {}
+            record.update({
+                "search_query": result["query_joiner"]["value"],
+                "answer": result["answer_llm"]["replies"][0],
+                "sources": [source_record(doc) for doc in result["document_reranker"]["documents"]],
+                "cache_hit": bool(meta.get("cache_hit")),
+                "prompt_tokens": usage.get("prompt_tokens"),
+                "completion_tokens": usage.get("completion_tokens"),
+            })
+        except Exception as e:
+            logger.warning("Question %s failed: %r", question["id"], e)
+            record["error"] = repr(e)
+    record["seconds"] = time.perf_counter() - start
+    record["stages"] = dict(stages)
+    record.update(retrieval_scores(record["sources"], question["expected_invnr"]))
+    return record
+
+async def run_questions(
+    qa: AsyncQAPipeline,
+    questions: List[Dict[str, Any]],
+    concurrency: int = DEFAULT_CONCURRENCY,
+    embedding_batch_size: int = EMBEDDING_BATCH_SIZE,
+) -> List[Dict[str, Any]]:
+    """Answers `questions` in order of submission, at most `concurrency` at a time; results keep the input order."""
+    slots = asyncio.Semaphore(concurrency)
+    tasks: List[asyncio.Task] = []
+    # Niet meer vooruit embedden dan de cache vasthoudt, anders zijn ze weg voordat de vraag aan de beurt is
+    batch_size = min(embedding_batch_size, max(qa.question_embedder.cache.max_entries - concurrency, 0))
+
+    async def one(question: Dict[str, Any]) -> Dict[str, Any]:
+        try:
+            return await answer_question(qa, question)
+        finally:
+            slots.release()
+
+    for i, question in enumerate(questions):
+        if batch_size and i % batch_size == 0:
+            try:
+                await prime_embeddings(qa, questions[i:i + batch_size])
+            except Exception as e:
+                # Dan embedt de pipeline ze zelf, één voor één
+                logger.warning("Batch embedding failed, falling back to per-question calls: %r", e)
+        await slots.acquire()
+        tasks.append(asyncio.create_task(one(question)))
+    return list(await asyncio.gather(*tasks))
+
+
+def percentiles(values: List[float]) -> Dict[str, float]:
+    if not values:
+        return {}
+    samples = np.asarray(values)
+    return {
+        "mean": float(samples.mean()),
+        "p50": float(np.percentile(samples, 50)),
+        "p95": float(np.percentile(samples, 95)),
+        "max": float(samples.max()),
+    }
+
+def summarize(records: List[Dict[str, Any]], seconds: float) -> Dict[str, Any]:
+    answered = [r for r in records if r["error"] is None]
+    scored = [r for r in answered if r["hit"] is not None]
+    stage_names = sorted({name for r in answered for name in r["stages"]})
+    return {
+        "questions": len(records),
+        "errors": len(records) - len(answered),
+        "seconds": seconds,
+        "questions_per_second": len(records) / seconds if seconds else 0.0,
+        "retrieval": {
+            "scored": len(scored),
+            "hit_rate": sum(r["hit"] for r in scored) / len(scored) if scored else None,
+            "mrr": sum(r["reciprocal_rank"] for r in scored) / len(scored) if scored else None,
+            "recall": sum(r["recall"] for r in scored) / len(scored) if scored else None,
+        },
+        "latency": percentiles([r["seconds"] for r in answered]),
+        "stages": {name: percentiles([r["stages"][name] for r in answered if name in r["stages"]]) for name in stage_names},
+        "tokens": {
+            "prompt": sum(r["prompt_tokens"] or 0 for r in answered),
+            "completion": sum(r["completion_tokens"] or 0 for r in answered),
+        },
+        "answer_cache_hits": sum(bool(r["cache_hit"]) for r in answered),
+    }
+
+def write_records(records: List[Dict[str, Any]], path: str) -> None:
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    if path.endswith(".parquet"):
+        import pandas as pd
+
+        # stages als losse kolommen ("stages.answer_llm"), sources blijft een lijst van structs
+        pd.json_normalize(records, max_level=1).to_parquet(path, index=False)
+        return
+    with open(path, "w", encoding="utf-8") as f:
+        for record in records:
+            f.write(json.dumps(record, ensure_ascii=False, default=str) + "\n")
+
+def summary_path(output: str) -> str:
+    return os.path.splitext(output)[0] + ".summary.json"
+
+def print_summary(summary: Dict[str, Any], baseline: Optional[Dict[str, Any]] = None) -> None:
+    def walk(result, *keys):
+        for key in keys:
+            result = (result or {}).get(key)
+        return result
+
+    rows = [
+        ("hit rate", ("retrieval", "hit_rate"), True),
+        ("mrr", ("retrieval", "mrr"), True),
+        ("recall", ("retrieval", "recall"), True),
+        ("questions/s", ("questions_per_second",), True),
+        ("latency p50 (s)", ("latency", "p50"), False),
+        ("latency p95 (s)", ("latency", "p95"), False),
+    ]
+    rows += [(f"{name} p95 (s)", ("stages", name, "p95"), False) for name in summary["stages"]]
+
+    print(f"{summary['questions']} questions, {summary['errors']} errors, {summary['retrieval']['scored']} scored, "
+          f"{summary['seconds']:.1f}s, tokens {summary['tokens']}"
+          + (f" (vs {baseline.get('output')})" if baseline else ""))
+    for label, keys, higher_is_better in rows:
+        new = walk(summary, *keys)
+        if new is None:
+            continue
+        line = f"  {label:<36} {new:10.4f}"
+        old = walk(baseline, *keys) if baseline else None
+        if old is not None:
+            delta = (new - old) / old * 100 if old else 0.0
+            worse = delta < -5 if higher_is_better else delta > 5
+            line += f"  was {old:10.4f}  {delta:+6.1f}%{'  <-- regression' if worse else ''}"
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("questions", help="JSONL with query, optional id, history and expected_invnr")
+    parser.add_argument("--output", required=True, help="Answers as .jsonl or .parquet")
+    parser.add_argument("--model", default="gpt-4o-mini")
+    parser.add_argument("--concurrency", type=int, default=DEFAULT_CONCURRENCY, help="Questions in flight at once")
+    parser.add_argument(
+        "--embedding-batch-size", type=int, default=EMBEDDING_BATCH_SIZE, help="Queries per embedding request (0 = off)"
+    )
+    parser.add_argument("--answer-cache", action="store_true", help="Allow cached answers for near-identical questions")
+    parser.add_argument("--compare", help="Summary JSON of an earlier run to compare against")
+    parser.add_argument("--min-hit-rate", type=float, help="Exit with 1 when the retrieval hit rate is lower")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    # Tijden per stage komen uit de metrics-tracer
+    enable_instrumentation()
+    questions = read_questions(args.questions)
+    if args.output.endswith(".parquet"):
+        # Liever nu falen dan na honderden betaalde antwoorden
+        import pyarrow  # noqa: F401
+    warm_up(args.model)
+    qa = get_async_qa_pipeline(args.model)
+    if not args.answer_cache:
+        qa.answer_llm.cache.threshold = float("inf")
+
+    logger.info("Answering %d questions, %d at a time", len(questions), args.concurrency)
+    start = time.perf_counter()
+    records = asyncio.run(run_questions(qa, questions, args.concurrency, args.embedding_batch_size))
+    seconds = time.perf_counter() - start
+    write_records(records, args.output)
+    summary = {"output": args.output, "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"), **summarize(records, seconds)}
+    with open(summary_path(args.output), "w", encoding="utf-8") as f:
+        json.dump(summary, f, indent=2)
+    logger.info("Answers written to %s, summary to %s", args.output, summary_path(args.output))
+
+    baseline = None
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+    print_summary(summary, baseline)
+
+    hit_rate = summary["retrieval"]["hit_rate"]
+    if args.min_hit_rate is not None and hit_rate is not None and hit_rate < args.min_hit_rate:
+        logger.error("Hit rate %.3f is below %.3f", hit_rate, args.min_hit_rate)
+        return 1
+    return 1 if summary["errors"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
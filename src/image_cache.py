@@ -0,0 +1,198 @@
+import hashlib
+import io
+import logging
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Dict, Iterable, Optional, Tuple
+
+import httpx
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # pillow komt mee met streamlit; zonder slaan we het origineel op
+    Image = None
+
+logger = logging.getLogger(__name__)
+
+
+class ImageCache:
+    """
+    Local thumbnail cache for the representative archive images.
+
+    Each URL is downloaded once through a pooled HTTP client, shrunk to a thumbnail and
+    stored as JPEG under `path`. A SQLite table tracks size and last access per file so
+    the least recently used thumbnails are evicted once `max_bytes` is exceeded. `get`
+    returns a local file path that st.image can serve; `prefetch` starts downloads in the
+    background. Concurrent requests for the same URL share one download.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        max_bytes: int = 512 * 1024 * 1024,
+        thumbnail_size: int = 480,
+        quality: int = 85,
+        max_connections: int = 16,
+        timeout: float = 20.0,
+        failure_ttl: float = 300.0,
+        client: Optional[httpx.Client] = None,
+    ):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.thumbnail_size = thumbnail_size
+        self.quality = quality
+        self.failure_ttl = failure_ttl
+        os.makedirs(path, exist_ok=True)
+        self._client = client or httpx.Client(
+            timeout=timeout,
+            follow_redirects=True,
+            limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections),
+        )
+        self._executor = ThreadPoolExecutor(max_workers=max_connections, thread_name_prefix="image-cache")
+        self._lock = threading.Lock()
+        self._in_flight: Dict[str, Future] = {}
+        self._failures: Dict[str, float] = {}
+        self._db = sqlite3.connect(os.path.join(path, "index.sqlite"), check_same_thread=False)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS images ("
+            "key TEXT PRIMARY KEY, url TEXT NOT NULL, invnr TEXT, bytes INTEGER NOT NULL, accessed REAL NOT NULL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS images_accessed ON images (accessed)")
+        self._db.execute("CREATE INDEX IF NOT EXISTS images_invnr ON images (invnr)")
+        self._db.commit()
+        self.hits = 0
+        self.downloads = 0
+        self.failures = 0
+
+    def key(self, url: str) -> str:
+        # De thumbnailgrootte hoort in de key: een andere instelling mag geen oude bestanden teruggeven
+        return hashlib.sha256(f"{self.thumbnail_size}\x00{url}".encode("utf-8")).hexdigest()
+
+    def get(self, url: str, invnr: Optional[str] = None) -> Optional[str]:
+        """Local thumbnail path for `url`, downloading it if needed; None if it cannot be fetched."""
+        cached = self.cached_path(url)
+        if cached is not None:
+            return cached
+        return self.prefetch([(url, invnr)])[url].result()
+
+    def cached_path(self, url: str) -> Optional[str]:
+        key = self.key(url)
+        file_path = self._file_path(key)
+        with self._lock:
+            row = self._db.execute("SELECT 1 FROM images WHERE key = ?", (key,)).fetchone()
+            if row is None or not os.path.exists(file_path):
+                return None
+            self._db.execute("UPDATE images SET accessed = ? WHERE key = ?", (time.time(), key))
+            self._db.commit()
+            self.hits += 1
+        return file_path
+
+    def path_for_invnr(self, invnr: str) -> Optional[str]:
+        with self._lock:
+            row = self._db.execute(
+                "SELECT url FROM images WHERE invnr = ? ORDER BY accessed DESC LIMIT 1", (str(invnr),)
+            ).fetchone()
+        return self.cached_path(row[0]) if row else None
+
+    def prefetch(self, items: Iterable[Tuple[str, Optional[str]]]) -> Dict[str, Future]:
+        """Start downloading (url, invnr) pairs concurrently; returns a future per URL."""
+        futures: Dict[str, Future] = {}
+        for url, invnr in items:
+            if not url or url in futures:
+                continue
+            cached = self.cached_path(url)
+            if cached is not None:
+                futures[url] = _done(cached)
+                continue
+            with self._lock:
+                failed_at = self._failures.get(url)
+                if failed_at is not None and time.time() - failed_at < self.failure_ttl:
+                    futures[url] = _done(None)
+                    continue
+                future = self._in_flight.get(url)
+                if future is None:
+                    future = self._executor.submit(self._fetch, url, invnr)
+                    self._in_flight[url] = future
+            futures[url] = future
+        return futures
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            count, total = self._db.execute("SELECT COUNT(*), COALESCE(SUM(bytes), 0) FROM images").fetchone()
+        return {"hits": self.hits, "downloads": self.downloads, "failures": self.failures, "entries": count, "bytes": total}
+
+    def close(self) -> None:
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        self._client.close()
+        self._db.close()
+
+    def _fetch(self, url: str, invnr: Optional[str]) -> Optional[str]:
+        key = self.key(url)
+        try:
+            response = self._client.get(url)
+            response.raise_for_status()
+            data = self._thumbnail(response.content)
+            file_path = self._file_path(key)
+            os.makedirs(os.path.dirname(file_path), exist_ok=True)
+            with open(file_path + ".tmp", "wb") as f:
+                f.write(data)
+            os.replace(file_path + ".tmp", file_path)
+            with self._lock:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO images (key, url, invnr, bytes, accessed) VALUES (?, ?, ?, ?, ?)",
+                    (key, url, None if invnr is None else str(invnr), len(data), time.time()),
+                )
+                self._db.commit()
+                self._failures.pop(url, None)
+                self.downloads += 1
+                self._evict()
+            return file_path
+        except Exception as e:
+            logger.warning("Could not cache image %s: %s", url, e)
+            with self._lock:
+                self._failures[url] = time.time()
+                self.failures += 1
+            return None
+        finally:
+            with self._lock:
+                self._in_flight.pop(url, None)
+
+    def _thumbnail(self, data: bytes) -> bytes:
+        if Image is None:
+            return data
+        with Image.open(io.BytesIO(data)) as image:
+            image = ImageOps.exif_transpose(image)
+            image.thumbnail((self.thumbnail_size, self.thumbnail_size), Image.Resampling.LANCZOS)
+            if image.mode not in ("RGB", "L"):
+                image = image.convert("RGB")
+            out = io.BytesIO()
+            image.save(out, format="JPEG", quality=self.quality, optimize=True)
+            return out.getvalue()
+
+    def _evict(self) -> None:
+        # Aanroepen met self._lock; oudste thumbnails eerst weg tot we onder max_bytes zitten
+        total = self._db.execute("SELECT COALESCE(SUM(bytes), 0) FROM images").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        for key, size in self._db.execute("SELECT key, bytes FROM images ORDER BY accessed ASC").fetchall():
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(self._file_path(key))
+            except FileNotFoundError:
+                pass
+            self._db.execute("DELETE FROM images WHERE key = ?", (key,))
+            total -= size
+        self._db.commit()
+
+    def _file_path(self, key: str) -> str:
+        return os.path.join(self.path, key[:2], key + ".jpg")
+
+
+def _done(value) -> Future:
+    future: Future = Future()
+    future.set_result(value)
+    return future
@@ -0,0 +1,457 @@
+"""
+Incremental ingestion of the PDF archive into the vector store and keyword index.
+
+    python src/ingest.py                      # data/prototyping
+    python src/ingest.py --source /pad/naar/pdfs --dry-run
+    python src/ingest.py --workers 0             # conversie over alle cores
+
+A manifest records the SHA-256 of every ingested file and the content hash of each of
+its chunks. A re-run only converts files whose hash changed and only embeds chunks
+whose content is new. Chunks and files that disappeared are deleted from the stores.
+
+Files stream through conversion, embedding and writing in bounded micro-batches, so
+memory does not grow with the size of the archive. New chunks are embedded in concurrent,
+rate-limited batches and upserted in bulk. Finished embeddings are checkpointed to disk
+first, so an interrupted run resumes without paying for the same vectors again.
+"""
+import argparse
+import hashlib
+import json
+import logging
+import os
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, wait
+from dataclasses import dataclass, field
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+from haystack import Document
+
+from answer_cache import bump_index_version
+from batch_embedding import EmbeddingCheckpoint
+from metadata_index import content_hash
+from pipelines import (
+    DATA_DIR,
+    EMBEDDING_CHECKPOINT_PATH,
+    create_docstore,
+    create_document_embedder,
+    create_document_writer,
+    create_preprocessing_pipeline,
+    get_keyword_index,
+    get_metadata_index,
+    share_openai_client,
+)
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SOURCE_DIR = os.path.join(DATA_DIR, "prototyping")
+DEFAULT_MANIFEST_PATH = os.path.join(DATA_DIR, "ingest_manifest.json")
+DEFAULT_WRITE_BATCH_SIZE = 500
+
+
+def file_sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def chunk_id(file_key: str, chunk_hash: str) -> str:
+    # Stabiel zolang de tekst gelijk blijft, ook als de chunk binnen het bestand verschuift
+    return hashlib.sha256(f"{file_key}\x00{chunk_hash}".encode("utf-8")).hexdigest()
+
+def get_doc_paths(source_dir: str) -> List[str]:
+    paths = []
+    for root, dirs, files in os.walk(source_dir):
+        for file in files:
+            if file.lower().endswith(".pdf"):
+                paths.append(os.path.join(root, file))
+    return sorted(paths)
+
+
+class Manifest:
+    """JSON record of ingested files: hash, size/mtime and chunk id -> content hash."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.files: Dict[str, Dict[str, Any]] = {}
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                self.files = json.load(f)["files"]
+
+    def save(self) -> None:
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        with open(self.path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump({"version": 1, "files": self.files}, f, indent=1)
+        os.replace(self.path + ".tmp", self.path)
+
+
+@dataclass
+class IngestReport:
+    new_files: int = 0
+    changed_files: int = 0
+    unchanged_files: int = 0
+    removed_files: int = 0
+    embedded_chunks: int = 0
+    kept_chunks: int = 0
+    deleted_chunks: int = 0
+    failed_chunks: int = 0
+    failed_files: List[str] = field(default_factory=list)
+
+    @property
+    def changed(self) -> bool:
+        return bool(self.embedded_chunks or self.deleted_chunks)
+
+
+@dataclass
+class PendingFile:
+    """A split file whose new chunks are still being embedded; it enters the manifest once they are written."""
+    path: str
+    key: str
+    sha256: str
+    stat: os.stat_result
+    chunk_hashes: Dict[str, str]
+    stale_ids: List[str]
+    outstanding: int
+    failed: Set[str] = field(default_factory=set)
+    checkpoint_keys: List[str] = field(default_factory=list)
+
+
+class Progress:
+    """Logs files/s, chunks/s and an ETA at most every `interval` seconds."""
+
+    def __init__(self, total: int, interval: float = 5.0):
+        self.total = total
+        self.interval = interval
+        self.files = 0
+        self.chunks = 0
+        self.started = time.perf_counter()
+        self._last_log = self.started
+
+    def update(self, chunks: int = 0) -> None:
+        self.files += 1
+        self.chunks += chunks
+        now = time.perf_counter()
+        if now - self._last_log >= self.interval or self.files == self.total:
+            self._last_log = now
+            elapsed = now - self.started
+            rate = self.files / elapsed if elapsed else 0.0
+            eta = (self.total - self.files) / rate if rate else 0.0
+            logger.info(
+                "Progress: %d/%d files (%.1f files/s, %.1f chunks/s), ETA %.0fs",
+                self.files, self.total, rate, self.chunks / elapsed if elapsed else 0.0, eta,
+            )
+
+
+# --- Conversie + splitsen, ook bruikbaar in worker processen ---
+_preprocessing = None
+
+def _get_preprocessing():
+    global _preprocessing
+    if _preprocessing is None:
+        _preprocessing = create_preprocessing_pipeline()
+    return _preprocessing
+
+def split_file(path: str, key: str) -> Dict[str, Document]:
+    result = _get_preprocessing().run({"converter": {"sources": [path]}})
+    chunks: Dict[str, Document] = {}
+    for doc in result["splitter"]["documents"]:
+        if not (doc.content or "").strip():
+            continue
+        chunk_hash = content_hash(doc.content)
+        doc_id = chunk_id(key, chunk_hash)
+        chunks[doc_id] = Document(id=doc_id, content=doc.content, meta={**doc.meta, "content_hash": chunk_hash})
+    return chunks
+
+def hash_and_split(path: str, key: str, known_sha256: Optional[str]) -> Tuple[str, Optional[Dict[str, Document]]]:
+    """Returns the file hash and its chunks; chunks is None when the hash equals `known_sha256`."""
+    sha256 = file_sha256(path)
+    if sha256 == known_sha256:
+        return sha256, None
+    return sha256, split_file(path, key)
+
+
+class Ingestor:
+    """
+    Streams changed files through split -> diff -> embed -> write. Every stage is a
+    generator, so a stage only does work when the next one asks for it: conversion runs
+    at most `queue_size` files ahead, the embedder keeps a bounded number of batches in
+    flight and writes go out per `write_batch_size`. Peak memory depends on those sizes
+    (and the largest single file), not on the size of the corpus.
+    """
+
+    def __init__(
+        self,
+        manifest: Manifest,
+        source_dir: str,
+        docstore=None,
+        dry_run: bool = False,
+        checkpoint: Optional[EmbeddingCheckpoint] = None,
+        write_batch_size: int = DEFAULT_WRITE_BATCH_SIZE,
+    ):
+        self.manifest = manifest
+        self.source_dir = source_dir
+        self.dry_run = dry_run
+        self.write_batch_size = write_batch_size
+        self.docstore = docstore or create_docstore()
+        self.embedder = create_document_embedder(checkpoint)
+        share_openai_client(self.embedder)
+        self.writer = create_document_writer(self.docstore)
+        self.keyword_index = get_keyword_index()
+        self.metadata_index = get_metadata_index()
+        self.report = IngestReport()
+        # Chunk id -> bestand, alleen voor chunks die nog onderweg zijn naar de store
+        self._pending: Dict[str, PendingFile] = {}
+        self._completed: List[PendingFile] = []
+
+    def run(self, force: bool = False, workers: int = 1, queue_size: Optional[int] = None) -> IngestReport:
+        paths = get_doc_paths(self.source_dir)
+        keys = {path: self.file_key(path) for path in paths}
+        progress = Progress(len(paths))
+
+        # Ongewijzigde size/mtime: geen hash, geen conversie
+        todo = []
+        for path in paths:
+            entry = self.manifest.files.get(keys[path])
+            stat = os.stat(path)
+            if entry and not force and entry["size"] == stat.st_size and entry["mtime"] == stat.st_mtime:
+                self.report.unchanged_files += 1
+                self.report.kept_chunks += len(entry["chunks"])
+                progress.update()
+            else:
+                todo.append((path, stat))
+
+        files = self.split_files(todo, keys, force, workers, queue_size or 2 * workers)
+        try:
+            self.write_stream(self.diff_files(files, progress))
+        except Exception as e:
+            # Store of OpenAI onbereikbaar: stoppen; wat niet in het manifest staat probeert de volgende run opnieuw
+            logger.exception("Ingestion stopped")
+            uncommitted = {file.key: file for file in [*self._pending.values(), *self._completed]}
+            self.report.failed_files.extend(f"{file.path}: {e}" for file in uncommitted.values())
+        else:
+            self.remove_vanished(set(keys.values()))
+
+        if self.report.changed and not self.dry_run:
+            bump_index_version()
+        return self.report
+
+    def split_files(
+        self, todo: List[Tuple[str, os.stat_result]], keys: Dict[str, str], force: bool, workers: int, queue_size: int
+    ) -> Iterator[Tuple[str, os.stat_result, str, Optional[Dict[str, Document]]]]:
+        """
+        Yields (path, stat, sha256, chunks) per file. With `workers` > 1 files are converted in a
+        process pool, at most `queue_size` ahead of the consumer. Files that fail are reported and skipped.
+        """
+        if workers <= 1:
+            for path, stat in todo:
+                try:
+                    sha256, chunks = hash_and_split(path, keys[path], self._known_sha256(keys[path], force))
+                except Exception as e:
+                    self._failed(path, e)
+                    continue
+                yield path, stat, sha256, chunks
+            return
+
+        pending: Dict[Future, Tuple[str, os.stat_result]] = {}
+        remaining = iter(todo)
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            while True:
+                for path, stat in remaining:
+                    known = self._known_sha256(keys[path], force)
+                    pending[pool.submit(hash_and_split, path, keys[path], known)] = (path, stat)
+                    if len(pending) >= queue_size:
+                        break
+                if not pending:
+                    break
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    path, stat = pending.pop(future)
+                    try:
+                        sha256, chunks = future.result()
+                    except Exception as e:
+                        self._failed(path, e)
+                        continue
+                    yield path, stat, sha256, chunks
+
+    def diff_files(
+        self, files: Iterable[Tuple[str, os.stat_result, str, Optional[Dict[str, Document]]]], progress: Progress
+    ) -> Iterator[Document]:
+        """Compares each split file with the manifest and yields the chunks that need embedding."""
+        for path, stat, sha256, chunks in files:
+            key = self.file_key(path)
+            entry = self.manifest.files.get(key)
+            if chunks is None:
+                # Alleen aangeraakt (bijv. gekopieerd); inhoud gelijk
+                self.report.unchanged_files += 1
+                self.report.kept_chunks += len(entry["chunks"])
+                if not self.dry_run:
+                    entry.update(size=stat.st_size, mtime=stat.st_mtime)
+                    self.manifest.save()
+                progress.update()
+                continue
+
+            old_chunks: Dict[str, str] = entry["chunks"] if entry else {}
+            new_docs = [doc for doc in chunks.values() if doc.id not in old_chunks]
+            stale_ids = [doc_id for doc_id in old_chunks if doc_id not in chunks]
+            logger.info(
+                "%s: %s, %d new chunks, %d kept, %d stale",
+                "Changed" if entry else "New", key, len(new_docs), len(chunks) - len(new_docs), len(stale_ids),
+            )
+            if entry:
+                self.report.changed_files += 1
+            else:
+                self.report.new_files += 1
+            self.report.kept_chunks += len(chunks) - len(new_docs)
+            progress.update(len(chunks))
+            if self.dry_run:
+                self.report.embedded_chunks += len(new_docs)
+                self.report.deleted_chunks += len(stale_ids)
+                continue
+
+            # Van ongewijzigde chunks is alleen de hash nog nodig
+            file = PendingFile(
+                path, key, sha256, stat, {doc.id: doc.meta["content_hash"] for doc in chunks.values()}, stale_ids,
+                outstanding=len(new_docs),
+            )
+            del chunks
+            if not new_docs:
+                self._completed.append(file)
+            for doc in new_docs:
+                self._pending[doc.id] = file
+            yield from new_docs
+
+    def write_stream(self, documents: Iterable[Document]) -> None:
+        """
+        Embeds the streamed chunks in micro-batches and upserts them per `write_batch_size`
+        while later batches are still in flight. Files are committed as soon as all their chunks are written.
+        """
+        buffer: List[Document] = []
+        for batch, _ in self.embedder.iter_batches(documents):
+            for doc in batch:
+                if doc.embedding is None:
+                    self._settle(doc, failed=True)
+                else:
+                    buffer.append(doc)
+            if len(buffer) >= self.write_batch_size:
+                self._write(buffer)
+                buffer = []
+        self._write(buffer)
+
+    def remove_vanished(self, keys: Set[str]) -> None:
+        for key in sorted(set(self.manifest.files) - keys):
+            entry = self.manifest.files[key]
+            logger.info("Removed: %s (%d chunks)", key, len(entry["chunks"]))
+            self.delete_chunks(list(entry["chunks"]))
+            self.report.removed_files += 1
+            if not self.dry_run:
+                self.keyword_index.save()
+                del self.manifest.files[key]
+                self.manifest.save()
+
+    def file_key(self, path: str) -> str:
+        # Relatief pad, zodat het manifest meeverhuist met de data map
+        return os.path.relpath(path, self.source_dir).replace(os.sep, "/")
+
+    def _known_sha256(self, key: str, force: bool) -> Optional[str]:
+        entry = self.manifest.files.get(key)
+        return entry["sha256"] if entry and not force else None
+
+    def _failed(self, path: str, error: Exception) -> None:
+        # Eén kapotte PDF mag de rest niet tegenhouden; volgende run probeert hem opnieuw
+        logger.error("Ingesting %s failed", path, exc_info=error)
+        self.report.failed_files.append(f"{path}: {error}")
+
+    def _write(self, documents: List[Document]) -> None:
+        if documents:
+            self.writer.run(documents=documents)
+            self.keyword_index.add(documents)
+            self.metadata_index.add(documents)
+            self.report.embedded_chunks += len(documents)
+            for doc in documents:
+                self._settle(doc)
+        self._commit()
+
+    def _settle(self, doc: Document, failed: bool = False) -> None:
+        file = self._pending.pop(doc.id)
+        if failed:
+            file.failed.add(doc.id)
+            self.report.failed_chunks += 1
+        elif self.embedder.checkpoint is not None:
+            file.checkpoint_keys.extend(self.embedder.checkpoint_keys([doc]))
+        file.outstanding -= 1
+        if file.outstanding == 0:
+            self._completed.append(file)
+
+    def _commit(self) -> None:
+        """Deletes the stale chunks of completed files and records them in the manifest."""
+        if not self._completed:
+            return
+        completed, self._completed = self._completed, []
+        for file in completed:
+            self.delete_chunks(file.stale_ids)
+        self.keyword_index.save()
+        for file in completed:
+            # Chunks zonder embedding niet vastleggen, dan worden ze de volgende run opnieuw geprobeerd
+            self.manifest.files[file.key] = {
+                "sha256": file.sha256 if not file.failed else None,
+                "size": file.stat.st_size,
+                "mtime": file.stat.st_mtime if not file.failed else None,
+                "chunks": {doc_id: h for doc_id, h in file.chunk_hashes.items() if doc_id not in file.failed},
+            }
+        self.manifest.save()
+        if self.embedder.checkpoint is not None:
+            self.embedder.checkpoint.discard([key for file in completed for key in file.checkpoint_keys])
+
+    def delete_chunks(self, document_ids: List[str]) -> None:
+        if not document_ids:
+            return
+        if not self.dry_run:
+            self.docstore.delete_documents(document_ids)
+            self.keyword_index.delete(document_ids)
+            self.metadata_index.delete(document_ids)
+        self.report.deleted_chunks += len(document_ids)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--source", default=DEFAULT_SOURCE_DIR, help="Folder with PDFs (searched recursively)")
+    parser.add_argument("--manifest", default=DEFAULT_MANIFEST_PATH)
+    parser.add_argument("--dry-run", action="store_true", help="Only report what would change")
+    parser.add_argument("--force", action="store_true", help="Re-split every file; unchanged chunks are still not re-embedded")
+    parser.add_argument("--workers", type=int, default=1, help="Processes for PDF conversion/splitting (0 = all cores)")
+    parser.add_argument("--queue-size", type=int, help="Max files converted ahead of embedding (default 2 x workers)")
+    parser.add_argument("--write-batch-size", type=int, default=DEFAULT_WRITE_BATCH_SIZE, help="Documents per upsert")
+    parser.add_argument(
+        "--checkpoint", default=EMBEDDING_CHECKPOINT_PATH, help="SQLite file with embeddings not yet written"
+    )
+    parser.add_argument("--no-checkpoint", action="store_true")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    workers = args.workers or os.cpu_count() or 1
+    checkpoint = None
+    if not (args.no_checkpoint or args.dry_run):
+        os.makedirs(os.path.dirname(os.path.abspath(args.checkpoint)), exist_ok=True)
+        checkpoint = EmbeddingCheckpoint(args.checkpoint)
+    ingestor = Ingestor(
+        Manifest(args.manifest),
+        args.source,
+        dry_run=args.dry_run,
+        checkpoint=checkpoint,
+        write_batch_size=args.write_batch_size,
+    )
+    report = ingestor.run(force=args.force, workers=workers, queue_size=args.queue_size)
+    logger.info(
+        "Files: %d new, %d changed, %d unchanged, %d removed, %d failed. "
+        "Chunks: %d embedded, %d kept, %d deleted, %d failed",
+        report.new_files, report.changed_files, report.unchanged_files, report.removed_files,
+        len(report.failed_files), report.embedded_chunks, report.kept_chunks, report.deleted_chunks,
+        report.failed_chunks,
+    )
+    logger.info("Embedding: %s", ingestor.embedder.stats())
+    return 1 if report.failed_files or report.failed_chunks else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
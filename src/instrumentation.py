@@ -0,0 +1,297 @@
+import bisect
+import contextlib
+import contextvars
+import json
+import logging
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Deque, Dict, Iterator, List, Optional, Tuple
+
+from haystack import tracing
+from haystack.dataclasses import StreamingChunk
+from haystack.tracing import Span, Tracer
+
+logger = logging.getLogger(__name__)
+trace_logger = logging.getLogger("qa.trace")
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+QUANTILES = (0.5, 0.95, 0.99)
+
+Labels = Tuple[Tuple[str, str], ...]
+
+# Wall time per component van de lopende vraag, zie collect_stage_timings
+_stage_timings: contextvars.ContextVar[Optional[Dict[str, float]]] = contextvars.ContextVar(
+    "qa_stage_timings", default=None
+)
+
+
+class Histogram:
+    """Prometheus-style cumulative buckets plus a sliding window for p50/p95/p99."""
+
+    def __init__(self, buckets: Tuple[float, ...], window: int = 2048):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self.window: Deque[float] = deque(maxlen=window)
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+        self.window.append(value)
+
+    def quantile(self, q: float) -> float:
+        if not self.window:
+            return 0.0
+        ordered = sorted(self.window)
+        return ordered[min(int(q * len(ordered)), len(ordered) - 1)]
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._histograms: Dict[str, Dict[Labels, Histogram]] = {}
+        self._buckets: Dict[str, Tuple[float, ...]] = {}
+        self._counters: Dict[str, Dict[Labels, float]] = {}
+        self._help: Dict[str, str] = {}
+
+    def observe(self, name: str, value: float, labels: Dict[str, str], buckets=LATENCY_BUCKETS, help: str = "") -> None:
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._buckets.setdefault(name, buckets)
+            self._help.setdefault(name, help)
+            series = self._histograms.setdefault(name, {})
+            if key not in series:
+                series[key] = Histogram(self._buckets[name])
+            series[key].observe(value)
+
+    def inc(self, name: str, labels: Dict[str, str], value: float = 1.0, help: str = "") -> None:
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._help.setdefault(name, help)
+            series = self._counters.setdefault(name, {})
+            series[key] = series.get(key, 0.0) + value
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Percentiles per series, handy for logs and benchmarks."""
+        with self._lock:
+            return {
+                name: {
+                    _format_labels(key): {
+                        "count": hist.count,
+                        **{f"p{int(q * 100)}": hist.quantile(q) for q in QUANTILES},
+                    }
+                    for key, hist in series.items()
+                }
+                for name, series in self._histograms.items()
+            }
+
+    def render_prometheus(self) -> str:
+        lines: List[str] = []
+        with self._lock:
+            for name, series in self._counters.items():
+                lines += [f"# HELP {name} {self._help.get(name, '')}", f"# TYPE {name} counter"]
+                for key, value in series.items():
+                    lines.append(f"{name}{_format_labels(key)} {value}")
+            for name, series in self._histograms.items():
+                lines += [f"# HELP {name} {self._help.get(name, '')}", f"# TYPE {name} histogram"]
+                for key, hist in series.items():
+                    cumulative = 0
+                    for bound, count in zip(list(hist.buckets) + ["+Inf"], hist.counts):
+                        cumulative += count
+                        lines.append(f"{name}_bucket{_format_labels(key + (('le', str(bound)),))} {cumulative}")
+                    lines.append(f"{name}_sum{_format_labels(key)} {hist.sum}")
+                    lines.append(f"{name}_count{_format_labels(key)} {hist.count}")
+                # Percentielen over het recente venster als aparte gauge, zodat dashboards ze direct kunnen tonen
+                lines.append(f"# TYPE {name}_window gauge")
+                for key, hist in series.items():
+                    for q in QUANTILES:
+                        lines.append(f"{name}_window{_format_labels(key + (('quantile', str(q)),))} {hist.quantile(q)}")
+        return "\n".join(lines) + "\n"
+
+
+def _format_labels(key: Labels) -> str:
+    if not key:
+        return ""
+    return "{" + ",".join(f'{k}="{v}"' for k, v in key) + "}"
+
+
+class MetricsSpan(Span):
+    def __init__(self, operation_name: str, tags: Dict[str, Any]):
+        self.operation_name = operation_name
+        self.tags = dict(tags)
+        self.output: Optional[Dict[str, Any]] = None
+
+    def set_tag(self, key: str, value: Any) -> None:
+        self.tags[key] = value
+
+    def set_content_tag(self, key: str, value: Any) -> None:
+        # Alleen de output is nodig (tokens, aantallen, cache hits); content zelf wordt niet bewaard
+        if key == "haystack.component.output":
+            self.output = value
+
+    def raw_span(self) -> Any:
+        return self
+
+
+class MetricsTracer(Tracer):
+    """
+    Haystack tracer that turns component spans into latency/token/cache metrics and
+    one structured log line per component run. Haystack uses a no-op tracer until
+    this one is enabled, so disabled instrumentation costs nothing.
+    """
+
+    def __init__(self, registry: MetricsRegistry):
+        self.registry = registry
+        self._current: contextvars.ContextVar[Optional[MetricsSpan]] = contextvars.ContextVar("qa_span", default=None)
+
+    @contextlib.contextmanager
+    def trace(
+        self, operation_name: str, tags: Optional[Dict[str, Any]] = None, parent_span: Optional[Span] = None
+    ) -> Iterator[Span]:
+        span = MetricsSpan(operation_name, tags or {})
+        token = self._current.set(span)
+        start = time.perf_counter()
+        error = None
+        try:
+            yield span
+        except BaseException as e:
+            error = type(e).__name__
+            raise
+        finally:
+            self._current.reset(token)
+            self._record(span, time.perf_counter() - start, error)
+
+    def current_span(self) -> Optional[Span]:
+        return self._current.get()
+
+    def _record(self, span: MetricsSpan, elapsed: float, error: Optional[str]) -> None:
+        if span.operation_name == "haystack.pipeline.run":
+            self.registry.observe("qa_request_seconds", elapsed, {}, help="End-to-end QA pipeline latency")
+            trace_logger.info(json.dumps({"event": "pipeline", "seconds": round(elapsed, 4), "error": error}))
+            return
+        if span.operation_name != "haystack.component.run":
+            return
+
+        component = span.tags.get("haystack.component.name", "unknown")
+        labels = {"component": component}
+        timings = _stage_timings.get()
+        if timings is not None:
+            timings[component] = timings.get(component, 0.0) + elapsed
+        self.registry.observe("qa_stage_seconds", elapsed, labels, help="Wall time per pipeline component")
+        record: Dict[str, Any] = {"event": "component", "component": component, "seconds": round(elapsed, 4)}
+        if error == "CancelledError":
+            # Bewust afgebroken (invnr-lookup of nieuwe vraag van de gebruiker), geen fout
+            record["cancelled"] = True
+        elif error:
+            record["error"] = error
+            self.registry.inc("qa_stage_errors_total", labels, help="Component runs that raised")
+
+        output = span.output or {}
+        if isinstance(output.get("documents"), list):
+            record["documents"] = len(output["documents"])
+            self.registry.observe(
+                "qa_retrieved_documents", len(output["documents"]), labels, COUNT_BUCKETS, "Documents per component run"
+            )
+        metas = output.get("meta")
+        for meta in metas if isinstance(metas, list) else [metas] if isinstance(metas, dict) else []:
+            usage = meta.get("usage") or {}
+            for kind in ("prompt_tokens", "completion_tokens"):
+                if usage.get(kind):
+                    record[kind] = record.get(kind, 0) + usage[kind]
+                    self.registry.inc("qa_llm_tokens_total", {**labels, "kind": kind}, usage[kind], "LLM tokens used")
+            if "cache_hit" in meta:
+                record["cache_hit"] = meta["cache_hit"]
+                result = "hit" if meta["cache_hit"] else "miss"
+                self.registry.inc("qa_cache_lookups_total", {**labels, "result": result}, help="Cache lookups")
+        if isinstance(output.get("token_counts"), dict):
+            record["token_counts"] = output["token_counts"]
+            self.registry.observe(
+                "qa_prompt_context_tokens",
+                output["token_counts"].get("total", 0),
+                labels,
+                (250, 500, 1000, 2000, 4000, 8000, 16000),
+                "Tokens of history + documents in the answer prompt",
+            )
+        trace_logger.info(json.dumps(record, default=str))
+
+
+_registry: Optional[MetricsRegistry] = None
+_enable_lock = threading.Lock()
+
+def get_registry() -> Optional[MetricsRegistry]:
+    return _registry
+
+def enable_instrumentation(port: Optional[int] = None) -> MetricsRegistry:
+    """Install the metrics tracer (once per process) and optionally serve /metrics on `port`."""
+    global _registry
+    with _enable_lock:
+        if _registry is None:
+            _registry = MetricsRegistry()
+            tracing.enable_tracing(MetricsTracer(_registry))
+            if port:
+                start_metrics_server(_registry, port)
+        return _registry
+
+@contextlib.contextmanager
+def collect_stage_timings() -> Iterator[Dict[str, float]]:
+    """
+    Seconds per component for the pipeline runs inside the block, filled in as they finish.
+    Follows the current thread or asyncio task (and tasks/threads started from it); needs
+    enable_instrumentation.
+    """
+    timings: Dict[str, float] = {}
+    token = _stage_timings.set(timings)
+    try:
+        yield timings
+    finally:
+        _stage_timings.reset(token)
+
+def instrument_streaming_callback(
+    callback: Optional[Callable[[StreamingChunk], None]], component: str = "answer_llm"
+) -> Optional[Callable[[StreamingChunk], None]]:
+    """Record time-to-first-token (from now) for a streaming callback; returns it untouched when disabled."""
+    registry = _registry
+    if registry is None or callback is None:
+        return callback
+    start = time.perf_counter()
+    seen_first = False
+
+    def instrumented(chunk: StreamingChunk) -> None:
+        nonlocal seen_first
+        if not seen_first:
+            seen_first = True
+            registry.observe(
+                "qa_time_to_first_token_seconds",
+                time.perf_counter() - start,
+                {"component": component},
+                help="Time from request start to the first streamed token",
+            )
+        callback(chunk)
+
+    return instrumented
+
+def start_metrics_server(registry: MetricsRegistry, port: int) -> ThreadingHTTPServer:
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = registry.render_prometheus().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer(("0.0.0.0", port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True).start()
+    logger.info("Serving Prometheus metrics on :%d/metrics", port)
+    return server
@@ -0,0 +1,419 @@
+import heapq
+import json
+import logging
+import math
+import os
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import Counter
+from contextlib import closing
+from typing import Any, Dict, List, Optional, Set
+
+from haystack import Document, component
+
+logger = logging.getLogger(__name__)
+
+TOKEN_RE = re.compile(r"[a-z0-9]+(?:[./-][a-z0-9]+)*")
+
+DUTCH_STOPWORDS = {
+    "aan", "al", "alle", "als", "bij", "dan", "dat", "de", "der", "des", "deze", "die", "dit", "door",
+    "een", "en", "er", "had", "heb", "hebben", "heeft", "het", "hier", "hoe", "hun", "ik", "in", "is",
+    "je", "kan", "kunnen", "maar", "me", "met", "mij", "na", "naar", "niet", "nog", "nu", "of", "om",
+    "onder", "ons", "ook", "op", "over", "te", "tot", "u", "uit", "van", "veel", "voor", "was", "waren",
+    "wat", "we", "welke", "werd", "wie", "wij", "wordt", "worden", "zal", "ze", "zich", "zij", "zijn",
+    "zo", "zou", "waar", "wanneer", "waarom",
+}
+# Woorden die naast een inventarisnummer staan zonder iets aan de vraag toe te voegen
+IDENTIFIER_WORDS = {
+    "invnr", "inv", "nr", "inv.nr", "nummer", "inventarisnummer", "inventaris", "archiefstuk", "stuk",
+}
+
+VOWELS = set("aeiouyè")
+
+# Zoveel wijzigingen bewaart de changelog; een lezer die verder achterloopt laadt alles opnieuw
+CHANGELOG_KEEP = 100_000
+
+
+def _undouble(word: str) -> str:
+    if word.endswith(("kk", "dd", "tt")):
+        return word[:-1]
+    return word
+
+def _r1(word: str) -> int:
+    # Snowball R1: na de eerste medeklinker die op een klinker volgt, minstens positie 3
+    for i in range(1, len(word)):
+        if word[i] not in VOWELS and word[i - 1] in VOWELS:
+            return max(i + 1, 3)
+    return len(word)
+
+def dutch_stem(word: str) -> str:
+    """Light Dutch stemmer following the main steps of the Snowball algorithm."""
+    if len(word) <= 3 or any(c.isdigit() for c in word):
+        return word
+    r1 = _r1(word)
+
+    def in_r1(suffix: str) -> bool:
+        return len(word) - len(suffix) >= r1
+
+    if word.endswith("heden") and in_r1("heden"):
+        word = word[:-5] + "heid"
+    elif word.endswith(("ene", "en")):
+        suffix = "ene" if word.endswith("ene") else "en"
+        stem = word[: -len(suffix)]
+        if in_r1(suffix) and stem and stem[-1] not in VOWELS and not stem.endswith("gem"):
+            word = _undouble(stem)
+    elif word.endswith(("se", "s")):
+        suffix = "se" if word.endswith("se") else "s"
+        stem = word[: -len(suffix)]
+        if in_r1(suffix) and stem and stem[-1] not in VOWELS and stem[-1] != "j":
+            word = stem
+
+    if word.endswith("e") and in_r1("e") and len(word) > 1 and word[-2] not in VOWELS:
+        word = _undouble(word[:-1])
+
+    if word.endswith("heid") and in_r1("heid") and not word.endswith("cheid"):
+        word = word[:-4]
+        if word.endswith("en") and word[:-2] and word[-3] not in VOWELS:
+            word = _undouble(word[:-2])
+
+    for suffix in ("lijk", "baar", "bar", "end", "ing", "ig"):
+        if word.endswith(suffix) and in_r1(suffix):
+            if suffix == "ig" and word.endswith("eig"):
+                break
+            word = word[: -len(suffix)]
+            if suffix in ("end", "ing") and word.endswith("ig") and not word.endswith("eig"):
+                word = word[:-2]
+            elif suffix in ("end", "ing"):
+                word = _undouble(word)
+            break
+    return word
+
+def tokenize(text: str) -> List[str]:
+    text = unicodedata.normalize("NFKD", text.lower())
+    text = "".join(c for c in text if not unicodedata.combining(c))
+    return TOKEN_RE.findall(text)
+
+def analyze(text: str) -> List[str]:
+    return [dutch_stem(token) for token in tokenize(text) if token not in DUTCH_STOPWORDS]
+
+
+class KeywordIndex:
+    """
+    BM25 inverted index for archive descriptions, with an exact invnr lookup table.
+
+    Searched in memory and updated incrementally by KeywordDocumentWriter. With a `path` the
+    documents and their term frequencies are persisted in SQLite; `save` only writes the
+    documents added or deleted since the previous save, so a save costs O(batch), not O(index).
+    Every save also logs the changed ids in a `changes` table; other processes pick those up
+    with `refresh`, at most every `reload_interval` seconds and on a background thread.
+    """
+
+    def __init__(
+        self,
+        path: Optional[str] = None,
+        meta_fields: Optional[List[str]] = None,
+        k1: float = 1.2,
+        b: float = 0.75,
+        reload_interval: float = 5.0,
+    ):
+        self.path = path
+        self.meta_fields = meta_fields if meta_fields is not None else ["invnr"]
+        self.k1 = k1
+        self.b = b
+        self.reload_interval = reload_interval
+        self._lock = threading.RLock()
+        self._documents: Dict[str, Dict[str, Any]] = {}
+        self._postings: Dict[str, Dict[str, int]] = {}
+        self._lengths: Dict[str, int] = {}
+        self._invnr: Dict[str, Set[str]] = {}
+        self._total_length = 0
+        # Sinds de laatste save toegevoegde of verwijderde ids, met de termfrequenties van de nieuwe
+        self._dirty: Set[str] = set()
+        self._new_terms: Dict[str, Dict[str, int]] = {}
+        self._db: Optional[sqlite3.Connection] = None
+        # Laatste verwerkte volgnummer uit de changelog
+        self._seen = 0
+        self._last_check = 0.0
+        self._reloading = False
+        self._reload_lock = threading.Lock()
+        if path:
+            self._open()
+            self.reload()
+
+    def add(self, documents: List[Document]) -> int:
+        with self._lock:
+            for doc in documents:
+                self._remove(doc.id)
+                terms = dict(Counter(analyze(self._document_text(doc.content, doc.meta))))
+                self._insert(doc.id, doc.content, doc.meta, terms)
+                self._dirty.add(doc.id)
+                self._new_terms[doc.id] = terms
+            return len(documents)
+
+    def delete(self, document_ids: List[str]) -> None:
+        with self._lock:
+            for doc_id in document_ids:
+                self._remove(doc_id)
+
+    def search(self, query: str, top_k: int = 10) -> List[Document]:
+        with self._lock:
+            n_docs = len(self._documents)
+            if n_docs == 0:
+                return []
+            avg_length = self._total_length / n_docs
+            scores: Dict[str, float] = {}
+            for term in set(analyze(query)):
+                postings = self._postings.get(term)
+                if not postings:
+                    continue
+                idf = math.log(1 + (n_docs - len(postings) + 0.5) / (len(postings) + 0.5))
+                for doc_id, tf in postings.items():
+                    norm = self.k1 * (1 - self.b + self.b * self._lengths[doc_id] / avg_length)
+                    scores[doc_id] = scores.get(doc_id, 0.0) + idf * tf * (self.k1 + 1) / (tf + norm)
+            # Exacte inventarisnummers bovenaan, maar alleen als de vraag er echt om vraagt: een jaartal
+            # als "1672" in een gewone vraag is geen inventarisnummer
+            for doc_id in self._invnr_matches(query):
+                scores[doc_id] = scores.get(doc_id, 0.0) + 1000.0
+            best = heapq.nlargest(top_k, scores.items(), key=lambda item: item[1])
+            return [self._to_document(doc_id, score) for doc_id, score in best]
+
+    def get_documents(self, document_ids: Optional[List[str]] = None) -> List[Document]:
+        """The stored documents (without embedding) for `document_ids`, or all of them; unknown ids are skipped."""
+        with self._lock:
+            ids = list(self._documents) if document_ids is None else document_ids
+            return [self._to_document(doc_id) for doc_id in ids if doc_id in self._documents]
+
+    def is_identifier_lookup(self, query: str) -> bool:
+        """True when the query is just a known inventory number, optionally with words like "invnr"."""
+        with self._lock:
+            tokens = [t for t in tokenize(query) if t not in DUTCH_STOPWORDS and t not in IDENTIFIER_WORDS]
+            return bool(tokens) and all(token in self._invnr for token in tokens)
+
+    def refresh(self) -> None:
+        """Reload in the background when `reload_interval` has passed since the last check; never blocks."""
+        if self._db is None:
+            return
+        with self._reload_lock:
+            now = time.monotonic()
+            if self._reloading or now - self._last_check < self.reload_interval:
+                return
+            self._reloading = True
+            self._last_check = now
+        threading.Thread(target=self._background_reload, name="keyword-index-reload", daemon=True).start()
+
+    def reload(self) -> None:
+        """
+        Pick up changes written by another process (e.g. an ingestion run): only the changed
+        documents, or everything when this index has fallen behind the pruned changelog.
+        """
+        if self._db is None:
+            return
+        # Een eigen verbinding, zodat het lezen buiten de lock (en naast zoekvragen) kan lopen
+        with closing(sqlite3.connect(self.path)) as db:
+            db.execute("BEGIN")
+            first, last = db.execute("SELECT MIN(seq), MAX(seq) FROM changes").fetchone()
+            if last is None or last <= self._seen:
+                if self._seen == 0 and not self._documents:
+                    self._load_all(db, 0)
+                return
+            if self._seen == 0 or first > self._seen + 1:
+                self._load_all(db, last)
+                return
+            changed = list(dict.fromkeys(
+                doc_id for (doc_id,) in db.execute("SELECT id FROM changes WHERE seq > ? ORDER BY seq", (self._seen,))
+            ))
+            rows = {}
+            for start in range(0, len(changed), 500):
+                batch = changed[start : start + 500]
+                query = f"SELECT id, content, meta, terms FROM documents WHERE id IN ({','.join('?' * len(batch))})"
+                for doc_id, content, meta, terms in db.execute(query, batch):
+                    rows[doc_id] = (content, json.loads(meta), json.loads(terms))
+        with self._lock:
+            for doc_id in changed:
+                # Eigen, nog niet opgeslagen wijzigingen gaan voor
+                if doc_id in self._dirty:
+                    continue
+                self._unindex(doc_id)
+                if doc_id in rows:
+                    self._insert(doc_id, *rows[doc_id])
+            self._seen = max(self._seen, last)
+        logger.info("Applied %d keyword index changes from %s", len(changed), self.path)
+
+    def save(self) -> None:
+        if self._db is None:
+            return
+        with self._lock:
+            rows, deleted = [], []
+            for doc_id in self._dirty:
+                stored = self._documents.get(doc_id)
+                if stored is None:
+                    deleted.append((doc_id,))
+                else:
+                    rows.append((
+                        doc_id,
+                        stored["content"],
+                        json.dumps(stored["meta"], ensure_ascii=False),
+                        json.dumps(self._new_terms[doc_id], ensure_ascii=False),
+                    ))
+            if not rows and not deleted:
+                return
+            before = self._db.execute("SELECT COALESCE(MAX(seq), 0) FROM changes").fetchone()[0]
+            self._db.executemany("DELETE FROM documents WHERE id = ?", deleted)
+            self._db.executemany("INSERT OR REPLACE INTO documents (id, content, meta, terms) VALUES (?, ?, ?, ?)", rows)
+            self._db.executemany("INSERT INTO changes (id) VALUES (?)", [(doc_id,) for doc_id in self._dirty])
+            last = self._db.execute("SELECT MAX(seq) FROM changes").fetchone()[0]
+            self._db.execute("DELETE FROM changes WHERE seq <= ?", (last - CHANGELOG_KEEP,))
+            self._db.commit()
+            # Onze eigen wijzigingen hoeft reload niet terug te lezen, tenzij er tussendoor iemand anders schreef
+            if before == self._seen:
+                self._seen = last
+            self._dirty.clear()
+            self._new_terms.clear()
+
+    def _background_reload(self) -> None:
+        try:
+            self.reload()
+        except Exception as e:
+            logger.warning("Reloading keyword index %s failed: %s", self.path, e)
+        finally:
+            with self._reload_lock:
+                self._reloading = False
+
+    def _load_all(self, db: sqlite3.Connection, seen: int) -> None:
+        # Nieuwe structuren opbouwen en pas daarna onder de lock omwisselen
+        documents, postings, lengths, invnr = {}, {}, {}, {}
+        for doc_id, content, meta, terms in db.execute("SELECT id, content, meta, terms FROM documents"):
+            meta, terms = json.loads(meta), json.loads(terms)
+            documents[doc_id] = {"content": content, "meta": meta}
+            for term, tf in terms.items():
+                postings.setdefault(term, {})[doc_id] = tf
+            lengths[doc_id] = sum(terms.values())
+            if meta.get("invnr") is not None:
+                invnr.setdefault(str(meta["invnr"]).lower(), set()).add(doc_id)
+        with self._lock:
+            self._documents, self._postings, self._lengths, self._invnr = documents, postings, lengths, invnr
+            self._total_length = sum(lengths.values())
+            self._dirty.clear()
+            self._new_terms.clear()
+            self._seen = seen
+        logger.info("Loaded keyword index from %s (%d documents)", self.path, len(documents))
+
+    def _open(self) -> None:
+        legacy_path = None
+        if self.path.endswith(".json"):
+            # Oud formaat: één JSON-bestand dat bij elke save volledig werd herschreven
+            legacy_path, self.path = self.path, os.path.splitext(self.path)[0] + ".sqlite"
+        elif os.path.exists(os.path.splitext(self.path)[0] + ".json"):
+            legacy_path = os.path.splitext(self.path)[0] + ".json"
+        self._db = sqlite3.connect(self.path, check_same_thread=False)
+        # De app leest terwijl een ingestie schrijft
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS documents (id TEXT PRIMARY KEY, content TEXT, meta TEXT NOT NULL, terms TEXT NOT NULL)"
+        )
+        self._db.execute("CREATE TABLE IF NOT EXISTS changes (seq INTEGER PRIMARY KEY AUTOINCREMENT, id TEXT NOT NULL)")
+        self._db.commit()
+        if legacy_path and os.path.exists(legacy_path):
+            self._migrate(legacy_path)
+
+    def _migrate(self, legacy_path: str) -> None:
+        with open(legacy_path, encoding="utf-8") as f:
+            data = json.load(f)
+        terms: Dict[str, Dict[str, int]] = {doc_id: {} for doc_id in data["documents"]}
+        for term, postings in data["postings"].items():
+            for doc_id, tf in postings.items():
+                terms[doc_id][term] = tf
+        self._db.executemany(
+            "INSERT OR REPLACE INTO documents (id, content, meta, terms) VALUES (?, ?, ?, ?)",
+            [
+                (doc_id, stored["content"], json.dumps(stored["meta"], ensure_ascii=False), json.dumps(terms[doc_id], ensure_ascii=False))
+                for doc_id, stored in data["documents"].items()
+            ],
+        )
+        self._db.commit()
+        os.remove(legacy_path)
+        logger.info("Migrated %s to %s (%d documents)", legacy_path, self.path, len(data["documents"]))
+
+    def _invnr_matches(self, query: str) -> Set[str]:
+        """Documents with an invnr the query asks for: the whole query, or a number after "invnr"/"inv.nr."."""
+        tokens = tokenize(query)
+        if not self.is_identifier_lookup(query):
+            tokens = [token for previous, token in zip(tokens, tokens[1:]) if previous in IDENTIFIER_WORDS]
+        matches: Set[str] = set()
+        for token in tokens:
+            matches |= self._invnr.get(token, set())
+        return matches
+
+    def _insert(self, doc_id: str, content: Optional[str], meta: Dict[str, Any], terms: Dict[str, int]) -> None:
+        for term, tf in terms.items():
+            self._postings.setdefault(term, {})[doc_id] = tf
+        self._lengths[doc_id] = sum(terms.values())
+        self._total_length += self._lengths[doc_id]
+        self._documents[doc_id] = {"content": content, "meta": meta}
+        if meta.get("invnr") is not None:
+            self._invnr.setdefault(str(meta["invnr"]).lower(), set()).add(doc_id)
+
+    def _remove(self, doc_id: str) -> None:
+        if doc_id in self._documents:
+            self._dirty.add(doc_id)
+            self._new_terms.pop(doc_id, None)
+            self._unindex(doc_id)
+
+    def _unindex(self, doc_id: str) -> None:
+        stored = self._documents.pop(doc_id, None)
+        if stored is None:
+            return
+        for term in set(analyze(self._document_text(stored["content"], stored["meta"]))):
+            postings = self._postings.get(term, {})
+            if postings.pop(doc_id, None) is not None and not postings:
+                del self._postings[term]
+        self._total_length -= self._lengths.pop(doc_id, 0)
+        invnr = stored["meta"].get("invnr")
+        if invnr is not None:
+            self._invnr.get(str(invnr).lower(), set()).discard(doc_id)
+
+    def _document_text(self, content: Optional[str], meta: Dict[str, Any]) -> str:
+        return " ".join([content or ""] + [str(meta[f]) for f in self.meta_fields if meta.get(f) is not None])
+
+    def _to_document(self, doc_id: str, score: Optional[float] = None) -> Document:
+        stored = self._documents[doc_id]
+        return Document(id=doc_id, content=stored["content"], meta=stored["meta"], score=score)
+
+
+@component
+class KeywordDocumentWriter:
+    """Indexes documents in a KeywordIndex; runs next to DocumentWriter during ingestion."""
+
+    def __init__(self, index: KeywordIndex):
+        self.index = index
+
+    @component.output_types(documents_written=int)
+    def run(self, documents: List[Document]):
+        written = self.index.add(documents)
+        self.index.save()
+        return {"documents_written": written}
+
+
+@component
+class KeywordRetriever:
+    """
+    BM25 retrieval without an embedding call. The query is forwarded on `dense_query`
+    for dense retrieval, except for exact inventory-number lookups, which the keyword
+    index answers on its own.
+    """
+
+    def __init__(self, index: KeywordIndex, top_k: int = 10):
+        self.index = index
+        self.top_k = top_k
+
+    @component.output_types(documents=List[Document], dense_query=str)
+    def run(self, query: str, top_k: Optional[int] = None):
+        # Wijzigingen van een ingestie op de achtergrond ophalen; deze vraag gebruikt de huidige stand
+        self.index.refresh()
+        documents = self.index.search(query, top_k=top_k or self.top_k)
+        if documents and self.index.is_identifier_lookup(query):
+            return {"documents": documents}
+        return {"documents": documents, "dense_query": query}
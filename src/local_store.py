@@ -0,0 +1,543 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+from typing import Any, Dict, Iterable, List, Optional, Union
+
+import numpy as np
+from haystack import Document, component, default_from_dict, default_to_dict
+from haystack.document_stores.errors import DuplicateDocumentError
+from haystack.document_stores.types import DuplicatePolicy
+from haystack.utils.filters import document_matches_filter
+
+from ann_index import ASSIGN_BATCH_ROWS, TRAIN_SAMPLE_PER_LIST, IVFIndex
+from metadata_index import MetadataIndex
+
+logger = logging.getLogger(__name__)
+
+VECTORS_FILE = "vectors.npy"
+QUANTIZED_FILE = "vectors.{}.npy"
+SCALES_FILE = "scales.npy"
+DOCUMENTS_DB = "documents.sqlite"
+# Oud formaat: één JSON-bestand dat bij elke schrijfactie volledig werd herschreven
+DOCUMENTS_FILE = "documents.json"
+QUANTIZATIONS = ("int8", "float16")
+# Zoveel rijen per matrixvermenigvuldiging, zodat een memmap nooit in zijn geheel in het geheugen komt
+SCORE_BATCH_ROWS = 65_536
+# Gecomprimeerde rijen worden per blok naar float32 omgezet; klein houden zodat dat blok in de cache past
+QUANTIZED_BATCH_ROWS = 2048
+
+
+class LocalDocumentStore:
+    """
+    In-process document store with the same interface as PineconeDocumentStore.
+
+    Embeddings live in a memory-mapped (capacity x dimension) matrix in `vectors.npy`;
+    ids, content and metadata live in the `documents.sqlite` sidecar, which is updated
+    per written or deleted document (not rewritten as a whole). Vectors are stored
+    L2-normalised, so the dot product equals the cosine similarity Pinecone uses.
+
+    With `index="ivf"` retrieval goes through an IVFIndex once the store holds at
+    least `min_train_size` documents; below that (or untrained) search is exact.
+
+    With `quantization="int8"` or `"float16"` a compact copy of the vectors (int8 with a
+    scale per row) is scanned instead. The `rescore` x top_k best candidates are then
+    re-ranked with the full-precision vectors, which are only read for those rows.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        dimension: int = 1536,
+        dtype: str = "float32",
+        initial_capacity: int = 1024,
+        index: str = "exact",
+        n_lists: int = 256,
+        n_probe: int = 8,
+        min_train_size: Optional[int] = None,
+        quantization: Optional[str] = None,
+        rescore: int = 4,
+    ):
+        if quantization and quantization not in QUANTIZATIONS:
+            raise ValueError(f"Unknown quantization {quantization!r}, expected one of {QUANTIZATIONS}")
+        self.path = path
+        self.dimension = dimension
+        self.dtype = np.dtype(dtype)
+        self.initial_capacity = initial_capacity
+        self.index = index
+        self.n_lists = n_lists
+        self.n_probe = n_probe
+        # Vuistregel: k-means heeft ~40 punten per lijst nodig voor bruikbare centroids
+        self.min_train_size = min_train_size or n_lists * 40
+        self.quantization = quantization or None
+        self.rescore = rescore
+        self._ann: Optional[IVFIndex] = None
+        self._lock = threading.RLock()
+        # Vragen die buiten de lock op een momentopname van de memmaps scoren; _grow wacht tot
+        # die klaar zijn, want Windows kan een bestand met een open mapping niet vervangen
+        self._readers = 0
+        self._growing = False
+        self._readers_done = threading.Condition(self._lock)
+        self._row_ids: List[Optional[str]] = []
+        self._rows: Dict[str, int] = {}
+        self._documents: Dict[str, Dict[str, Any]] = {}
+        self._vectors: Optional[np.memmap] = None
+        # True voor rijen met een document; zo kost het wegfilteren van lege rijen geen Python-lus
+        self._live = np.zeros(0, dtype=bool)
+        self._quantized: Optional[np.memmap] = None
+        self._scales: Optional[np.memmap] = None
+        self._db: Optional[sqlite3.Connection] = None
+        self._load()
+
+    # --- DocumentStore protocol ---
+
+    def to_dict(self) -> Dict[str, Any]:
+        return default_to_dict(
+            self,
+            path=self.path,
+            dimension=self.dimension,
+            dtype=self.dtype.name,
+            index=self.index,
+            n_lists=self.n_lists,
+            n_probe=self.n_probe,
+            min_train_size=self.min_train_size,
+            quantization=self.quantization,
+            rescore=self.rescore,
+        )
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "LocalDocumentStore":
+        return default_from_dict(cls, data)
+
+    def count_documents(self) -> int:
+        return len(self._rows)
+
+    def filter_documents(self, filters: Optional[Dict[str, Any]] = None) -> List[Document]:
+        with self._lock:
+            ids = [doc_id for doc_id in self._rows if self._matches(doc_id, filters)]
+            return [self._to_document(doc_id) for doc_id in ids]
+
+    def write_documents(self, documents: List[Document], policy: DuplicatePolicy = DuplicatePolicy.NONE) -> int:
+        with self._lock:
+            written = 0
+            written_rows = []
+            for doc in documents:
+                if doc.embedding is None:
+                    raise ValueError(f"Document {doc.id} has no embedding; run it through a document embedder first")
+                if doc.id in self._rows:
+                    if policy == DuplicatePolicy.SKIP:
+                        continue
+                    if policy in (DuplicatePolicy.NONE, DuplicatePolicy.FAIL):
+                        raise DuplicateDocumentError(f"ID '{doc.id}' already exists in the document store")
+                    row = self._rows[doc.id]
+                else:
+                    row = self._allocate_row(doc.id)
+                vector = self._normalize(doc.embedding)
+                self._vectors[row] = vector
+                self._quantize(row, vector)
+                self._live[row] = True
+                self._documents[doc.id] = {"content": doc.content, "meta": doc.meta}
+                written_rows.append(row)
+                written += 1
+            self._index_rows(np.asarray(written_rows, dtype=np.int64))
+            self._save(written=[self._row_ids[row] for row in written_rows])
+            return written
+
+    def delete_documents(self, document_ids: List[str]) -> None:
+        with self._lock:
+            deleted_rows = []
+            deleted_ids = []
+            for doc_id in document_ids:
+                row = self._rows.pop(doc_id, None)
+                if row is None:
+                    continue
+                self._row_ids[row] = None
+                self._live[row] = False
+                self._vectors[row] = 0
+                self._quantize(row, np.zeros(self.dimension, dtype=np.float32))
+                self._documents.pop(doc_id, None)
+                deleted_rows.append(row)
+                deleted_ids.append(doc_id)
+            if self._ann is not None:
+                self._ann.remove(np.asarray(deleted_rows, dtype=np.int64))
+            self._save(deleted=deleted_ids)
+
+    # --- Retrieval ---
+
+    def embedding_retrieval(
+        self,
+        query_embedding: List[float],
+        filters: Optional[Dict[str, Any]] = None,
+        top_k: int = 10,
+        n_probe: Optional[int] = None,
+        document_ids: Optional[Iterable[str]] = None,
+    ) -> List[Document]:
+        """`document_ids` restricts the search to those documents (e.g. MetadataIndex.candidate_ids)."""
+        query = self._normalize(query_embedding)
+        # Onder de lock alleen een momentopname; het scoren zelf loopt buiten de lock, zodat
+        # gelijktijdige vragen niet op elkaar wachten
+        with self._lock:
+            while self._growing:
+                self._readers_done.wait()
+            n_rows = len(self._row_ids)
+            if not self._rows or n_rows == 0:
+                return []
+            matrices = (self._vectors, self._quantized, self._scales)
+            live = self._live[:n_rows].copy()
+            if document_ids is not None:
+                # Voorgefilterd: alleen deze rijen exact scoren, de ANN index is dan niet nodig
+                rows = np.sort(np.fromiter((self._rows[i] for i in document_ids if i in self._rows), dtype=np.int64))
+            elif self._ann is not None and self._ann.trained:
+                rows = self._ann.candidates(query, n_probe)
+            else:
+                rows = None
+            self._readers += 1
+        try:
+            if rows is None:
+                scores = self._score_rows(query, n_rows, matrices)
+                rows = np.arange(n_rows)
+            else:
+                scores = self._score_rows(query, rows, matrices)
+        finally:
+            del matrices
+            with self._lock:
+                self._readers -= 1
+                if self._readers == 0:
+                    self._readers_done.notify_all()
+        # Lege (verwijderde) rijen tellen niet mee; filters alleen op de beste kandidaten toepassen
+        scores[~live[rows]] = -np.inf
+        with self._lock:
+            if self._quantized is None:
+                top = self._select(scores, rows, top_k, filters)
+            else:
+                # Ruime voorselectie op de gecomprimeerde vectoren, daarna exact herscoren
+                candidates = self._select(scores, rows, top_k * self.rescore, filters)
+                rows = np.sort(rows[candidates])
+                scores = np.asarray(self._vectors[rows], dtype=np.float32) @ query
+                top = np.argsort(-scores)[:top_k]
+            return [self._to_document(self._row_ids[rows[i]], score=float(scores[i])) for i in top]
+
+    def _select(self, scores: np.ndarray, rows: np.ndarray, k: int, filters: Optional[Dict[str, Any]]) -> np.ndarray:
+        """
+        Positions of the `k` best finite scores whose documents still exist and pass `filters`,
+        best first. Candidates are checked in score order, widening the window as needed.
+        """
+        n_valid = int(np.isfinite(scores).sum())
+        selected: List[int] = []
+        checked = 0
+        window = min(n_valid, max(k * 4, 64))
+        while checked < n_valid and len(selected) < k:
+            top = np.argpartition(-scores, window - 1)[:window]
+            top = top[np.argsort(-scores[top])]
+            for i in top[checked:]:
+                doc_id = self._row_ids[rows[i]]
+                # Tussen momentopname en selectie verwijderd: overslaan
+                if doc_id is not None and self._matches(doc_id, filters):
+                    selected.append(int(i))
+                    if len(selected) == k:
+                        break
+            checked = window
+            window = min(n_valid, window * 4)
+        return np.asarray(selected, dtype=np.int64)
+
+    def _score_rows(self, query: np.ndarray, rows: Union[int, np.ndarray], matrices) -> np.ndarray:
+        """Scores the first `rows` rows (an int) or the given row numbers, block by block."""
+        n = rows if isinstance(rows, int) else len(rows)
+        batch = SCORE_BATCH_ROWS if matrices[1] is None else QUANTIZED_BATCH_ROWS
+        scores = np.empty(n, dtype=np.float32)
+        for start in range(0, n, batch):
+            end = min(start + batch, n)
+            block = slice(start, end) if isinstance(rows, int) else rows[start:end]
+            scores[start:end] = self._score(block, query, matrices)
+        return scores
+
+    @staticmethod
+    def _score(rows, query: np.ndarray, matrices) -> np.ndarray:
+        """Dot products of `rows` (indices or a slice) with the query, on the quantized copy if there is one."""
+        vectors, quantized, scales = matrices
+        if quantized is None:
+            return np.asarray(vectors[rows], dtype=np.float32) @ query
+        scores = np.asarray(quantized[rows], dtype=np.float32) @ query
+        if scales is not None:
+            scores *= scales[rows]
+        return scores
+
+    # --- ANN index ---
+
+    def train_index(self) -> None:
+        """(Re)train the IVF lists on the current vectors and assign every live row."""
+        with self._lock:
+            live = np.flatnonzero(self._live[: len(self._row_ids)])
+            if len(live) == 0:
+                return
+            if self._ann is None:
+                self._ann = IVFIndex(self.dimension, n_lists=self.n_lists, n_probe=self.n_probe)
+            # Bij hertrainen opnieuw met het volle aantal lijsten (de eerste keer kunnen het er minder zijn)
+            self._ann.n_lists = self.n_lists
+            # Alleen een steekproef en daarna blokken uit de memmap lezen: bij miljoenen rijen
+            # past een kopie van alle vectoren niet in het geheugen
+            sample_size = min(len(live), self._ann.n_lists * TRAIN_SAMPLE_PER_LIST)
+            sample = np.sort(np.random.default_rng(0).choice(live, sample_size, replace=False))
+            self._ann.train(self._vectors[sample])
+            for start in range(0, len(live), ASSIGN_BATCH_ROWS):
+                rows = live[start : start + ASSIGN_BATCH_ROWS]
+                self._ann.add(rows, self._vectors[rows])
+            self._ann.settle()
+            self._save()
+
+    def _index_rows(self, rows: np.ndarray) -> None:
+        if self.index != "ivf":
+            return
+        if self._ann is not None and self._ann.trained:
+            rows = np.sort(rows)
+            self._ann.add(rows, self._vectors[rows])
+            if self._ann.needs_retrain():
+                # Gegroeid of scheefgetrokken sinds het trainen: de centroids passen niet meer
+                logger.info("Retraining IVF index at %d documents", len(self._rows))
+                self.train_index()
+        elif len(self._rows) >= self.min_train_size:
+            self.train_index()
+
+    # --- Storage ---
+
+    def _allocate_row(self, doc_id: str) -> int:
+        row = len(self._row_ids)
+        if row >= self._vectors.shape[0]:
+            self._grow(max(self._vectors.shape[0] * 2, self.initial_capacity))
+        self._row_ids.append(doc_id)
+        self._rows[doc_id] = row
+        return row
+
+    def _grow(self, capacity: int) -> None:
+        self._growing = True
+        try:
+            while self._readers:
+                self._readers_done.wait()
+            self._grow_files(capacity)
+        finally:
+            self._growing = False
+            self._readers_done.notify_all()
+
+    def _grow_files(self, capacity: int) -> None:
+        live = np.zeros(capacity, dtype=bool)
+        live[: len(self._live)] = self._live
+        self._live = live
+        self._grow_file("_vectors", os.path.join(self.path, VECTORS_FILE), capacity)
+        if self._quantized is not None:
+            self._grow_file("_quantized", self._quantized_path(), capacity)
+        if self._scales is not None:
+            self._grow_file("_scales", os.path.join(self.path, SCALES_FILE), capacity)
+
+    def _grow_file(self, attribute: str, path: str, capacity: int) -> None:
+        matrix = getattr(self, attribute)
+        tmp_path = path + ".tmp"
+        grown = np.lib.format.open_memmap(tmp_path, mode="w+", dtype=matrix.dtype, shape=(capacity, *matrix.shape[1:]))
+        grown[: matrix.shape[0]] = matrix
+        grown.flush()
+        # Alle verwijzingen naar de oude mapping loslaten (er scoort geen vraag meer op), anders
+        # weigert Windows het vervangen met een PermissionError
+        del grown, matrix
+        setattr(self, attribute, None)
+        os.replace(tmp_path, path)
+        setattr(self, attribute, np.lib.format.open_memmap(path, mode="r+"))
+
+    def _quantize(self, rows, vectors: np.ndarray) -> None:
+        """Update the quantized copy of `rows` (a row or an array of rows) from normalised float32 vectors."""
+        if self._quantized is None:
+            return
+        if self._scales is None:
+            self._quantized[rows] = vectors
+            return
+        # Symmetrisch per rij: de grootste component wordt ±127
+        scales = np.abs(vectors).max(axis=-1) / 127
+        scales = np.where(scales > 0, scales, 1.0).astype(np.float32)
+        self._quantized[rows] = np.round(vectors / scales[..., None]).astype(np.int8)
+        self._scales[rows] = scales
+
+    def _quantized_path(self) -> str:
+        return os.path.join(self.path, QUANTIZED_FILE.format(self.quantization))
+
+    def _load_quantized(self) -> None:
+        capacity = self._vectors.shape[0]
+        quantized_path = self._quantized_path()
+        scales_path = os.path.join(self.path, SCALES_FILE)
+        rebuild = not os.path.exists(quantized_path) or (self.quantization == "int8" and not os.path.exists(scales_path))
+        if not rebuild and np.load(quantized_path, mmap_mode="r").shape != self._vectors.shape:
+            rebuild = True
+        if rebuild:
+            np.lib.format.open_memmap(
+                quantized_path, mode="w+", dtype=self.quantization, shape=(capacity, self.dimension)
+            ).flush()
+            if self.quantization == "int8":
+                np.lib.format.open_memmap(scales_path, mode="w+", dtype=np.float32, shape=(capacity,)).flush()
+        self._quantized = np.lib.format.open_memmap(quantized_path, mode="r+")
+        if self.quantization == "int8":
+            self._scales = np.lib.format.open_memmap(scales_path, mode="r+")
+        if rebuild and self._rows:
+            # Bestaande store: gecomprimeerde kopie eenmalig opbouwen uit de volledige vectoren
+            logger.info("Building %s copy of %d vectors", self.quantization, len(self._rows))
+            live = np.asarray(sorted(self._rows.values()), dtype=np.int64)
+            for start in range(0, len(live), SCORE_BATCH_ROWS):
+                rows = live[start : start + SCORE_BATCH_ROWS]
+                self._quantize(rows, np.asarray(self._vectors[rows], dtype=np.float32))
+            self._quantized.flush()
+            if self._scales is not None:
+                self._scales.flush()
+
+    def _load(self) -> None:
+        os.makedirs(self.path, exist_ok=True)
+        vectors_path = os.path.join(self.path, VECTORS_FILE)
+        if not os.path.exists(vectors_path):
+            np.lib.format.open_memmap(
+                vectors_path, mode="w+", dtype=self.dtype, shape=(self.initial_capacity, self.dimension)
+            ).flush()
+        self._vectors = np.lib.format.open_memmap(vectors_path, mode="r+")
+        if self._vectors.shape[1] != self.dimension:
+            raise ValueError(
+                f"{vectors_path} holds {self._vectors.shape[1]}-d vectors, expected {self.dimension}"
+            )
+        self.dtype = self._vectors.dtype
+        self._load_documents()
+        self._live = np.zeros(self._vectors.shape[0], dtype=bool)
+        self._live[list(self._rows.values())] = True
+        # Een kopie die niet in gebruik is wordt ook niet bijgewerkt; weg ermee, dan komt hij later vers terug
+        unused = [QUANTIZED_FILE.format(q) for q in QUANTIZATIONS if q != self.quantization]
+        if self.quantization != "int8":
+            unused.append(SCALES_FILE)
+        for name in unused:
+            if os.path.exists(os.path.join(self.path, name)):
+                os.remove(os.path.join(self.path, name))
+        if self.quantization:
+            self._load_quantized()
+        if self.index == "ivf":
+            self._ann = IVFIndex.load(self.path, self.dimension, n_lists=self.n_lists, n_probe=self.n_probe)
+        logger.info("Loaded local document store from %s (%d documents)", self.path, len(self._rows))
+
+    def _save(self, written: Iterable[str] = (), deleted: Iterable[str] = ()) -> None:
+        self._vectors.flush()
+        if self._quantized is not None:
+            self._quantized.flush()
+        if self._scales is not None:
+            self._scales.flush()
+        if self._ann is not None:
+            self._ann.save(self.path)
+        # Alleen de gewijzigde documenten; de vectoren staan dan al op schijf
+        rows = []
+        for doc_id in written:
+            stored = self._documents[doc_id]
+            rows.append((self._rows[doc_id], doc_id, stored["content"], json.dumps(stored["meta"], ensure_ascii=False)))
+        self._db.executemany("DELETE FROM documents WHERE id = ?", [(doc_id,) for doc_id in deleted])
+        self._db.executemany("INSERT OR REPLACE INTO documents (row, id, content, meta) VALUES (?, ?, ?, ?)", rows)
+        self._db.commit()
+
+    def _load_documents(self) -> None:
+        self._db = sqlite3.connect(os.path.join(self.path, DOCUMENTS_DB), check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS documents (row INTEGER PRIMARY KEY, id TEXT NOT NULL UNIQUE, content TEXT, meta TEXT NOT NULL)"
+        )
+        self._db.commit()
+        json_path = os.path.join(self.path, DOCUMENTS_FILE)
+        if os.path.exists(json_path):
+            # Eenmalige migratie van het oude JSON-bestand
+            with open(json_path, encoding="utf-8") as f:
+                data = json.load(f)
+            self._db.executemany(
+                "INSERT OR REPLACE INTO documents (row, id, content, meta) VALUES (?, ?, ?, ?)",
+                [
+                    (row, doc_id, data["documents"][doc_id]["content"], json.dumps(data["documents"][doc_id]["meta"], ensure_ascii=False))
+                    for row, doc_id in enumerate(data["row_ids"])
+                    if doc_id is not None
+                ],
+            )
+            self._db.commit()
+            os.remove(json_path)
+        self._row_ids = []
+        self._documents = {}
+        for row, doc_id, content, meta in self._db.execute("SELECT row, id, content, meta FROM documents ORDER BY row"):
+            # Verwijderde rijen blijven leeg (None) tot ze opnieuw worden toegewezen
+            self._row_ids.extend([None] * (row - len(self._row_ids)))
+            self._row_ids.append(doc_id)
+            self._documents[doc_id] = {"content": content, "meta": json.loads(meta)}
+        self._rows = {doc_id: row for row, doc_id in enumerate(self._row_ids) if doc_id is not None}
+
+    # --- Helpers ---
+
+    def _matches(self, doc_id: str, filters: Optional[Dict[str, Any]]) -> bool:
+        if not filters:
+            return True
+        return document_matches_filter(filters, self._to_document(doc_id, with_embedding=False))
+
+    def _to_document(self, doc_id: str, score: Optional[float] = None, with_embedding: bool = True) -> Document:
+        stored = self._documents[doc_id]
+        embedding = None
+        if with_embedding:
+            embedding = np.asarray(self._vectors[self._rows[doc_id]], dtype=np.float32).tolist()
+        return Document(id=doc_id, content=stored["content"], meta=stored["meta"], embedding=embedding, score=score)
+
+    def _normalize(self, embedding: List[float]) -> np.ndarray:
+        vector = np.asarray(embedding, dtype=np.float32)
+        if vector.shape != (self.dimension,):
+            raise ValueError(f"Expected a {self.dimension}-d embedding, got shape {vector.shape}")
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+
+@component
+class LocalEmbeddingRetriever:
+    """
+    Counterpart of PineconeEmbeddingRetriever for LocalDocumentStore. With a `metadata_index`,
+    filters on invnr, file_path or content_hash are resolved there first and only the
+    matching rows are scored.
+    """
+
+    def __init__(
+        self,
+        document_store: LocalDocumentStore,
+        filters: Optional[Dict[str, Any]] = None,
+        top_k: int = 10,
+        n_probe: Optional[int] = None,
+        metadata_index: Optional[MetadataIndex] = None,
+    ):
+        self.document_store = document_store
+        self.filters = filters or {}
+        self.top_k = top_k
+        self.n_probe = n_probe
+        self.metadata_index = metadata_index
+
+    def to_dict(self) -> Dict[str, Any]:
+        return default_to_dict(
+            self,
+            document_store=self.document_store.to_dict(),
+            filters=self.filters,
+            top_k=self.top_k,
+            n_probe=self.n_probe,
+            metadata_index=self.metadata_index.path if self.metadata_index is not None else None,
+        )
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "LocalEmbeddingRetriever":
+        init_parameters = data["init_parameters"]
+        init_parameters["document_store"] = LocalDocumentStore.from_dict(init_parameters["document_store"])
+        if init_parameters.get("metadata_index"):
+            init_parameters["metadata_index"] = MetadataIndex(init_parameters["metadata_index"])
+        return default_from_dict(cls, data)
+
+    @component.output_types(documents=List[Document])
+    def run(
+        self,
+        query_embedding: List[float],
+        filters: Optional[Dict[str, Any]] = None,
+        top_k: Optional[int] = None,
+    ):
+        filters = filters or self.filters
+        document_ids = self.metadata_index.candidate_ids(filters) if self.metadata_index is not None else None
+        documents = self.document_store.embedding_retrieval(
+            query_embedding=query_embedding,
+            filters=filters,
+            top_k=top_k or self.top_k,
+            n_probe=self.n_probe,
+            document_ids=document_ids,
+        )
+        return {"documents": documents}
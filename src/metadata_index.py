@@ -0,0 +1,130 @@
+import hashlib
+import logging
+import sqlite3
+import threading
+from typing import Any, Dict, List, Optional, Set
+
+from haystack import Document, component
+
+logger = logging.getLogger(__name__)
+
+# Meta velden met een eigen kolom en index; "content_hash" wordt berekend als het ontbreekt
+INDEXED_FIELDS = ("invnr", "file_path", "content_hash")
+
+
+def content_hash(content: Optional[str]) -> str:
+    return hashlib.sha256((content or "").encode("utf-8")).hexdigest()
+
+
+class MetadataIndex:
+    """
+    SQLite side index from invnr, file_path and content hash to document ids.
+
+    Kept up to date next to the document store, so lookups and bulk deletes by
+    these fields are index seeks instead of filter scans over the whole store.
+    `candidate_ids` narrows a Haystack filter down to the ids it can match, which
+    LocalDocumentStore uses to score only those rows.
+    """
+
+    def __init__(self, path: str = ":memory:"):
+        self.path = path
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        if path != ":memory:":
+            # Lezers (de app) blijven werken terwijl een ingestie schrijft
+            self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS documents (id TEXT PRIMARY KEY, invnr TEXT, file_path TEXT, content_hash TEXT)"
+        )
+        for field in INDEXED_FIELDS:
+            self._db.execute(f"CREATE INDEX IF NOT EXISTS documents_{field} ON documents ({field})")
+        self._db.commit()
+
+    def add(self, documents: List[Document]) -> int:
+        rows = []
+        for doc in documents:
+            invnr, file_path = doc.meta.get("invnr"), doc.meta.get("file_path")
+            rows.append((
+                doc.id,
+                None if invnr is None else str(invnr),
+                None if file_path is None else str(file_path),
+                doc.meta.get("content_hash") or content_hash(doc.content),
+            ))
+        with self._lock:
+            self._db.executemany(
+                "INSERT OR REPLACE INTO documents (id, invnr, file_path, content_hash) VALUES (?, ?, ?, ?)", rows
+            )
+            self._db.commit()
+        return len(rows)
+
+    def delete(self, document_ids: List[str]) -> None:
+        with self._lock:
+            self._db.executemany("DELETE FROM documents WHERE id = ?", [(doc_id,) for doc_id in document_ids])
+            self._db.commit()
+
+    def ids(
+        self, invnr: Optional[Any] = None, file_path: Optional[str] = None, content_hash: Optional[str] = None
+    ) -> List[str]:
+        """Ids of the documents matching all given fields."""
+        conditions = {"invnr": invnr, "file_path": file_path, "content_hash": content_hash}
+        conditions = {field: str(value) for field, value in conditions.items() if value is not None}
+        if not conditions:
+            raise ValueError("Pass at least one of invnr, file_path or content_hash")
+        where = " AND ".join(f"{field} = ?" for field in conditions)
+        with self._lock:
+            rows = self._db.execute(f"SELECT id FROM documents WHERE {where}", list(conditions.values())).fetchall()
+        return [row[0] for row in rows]
+
+    def candidate_ids(self, filters: Optional[Dict[str, Any]]) -> Optional[Set[str]]:
+        """
+        Ids that can match `filters`, using only its ==/in conditions on indexed fields.
+        The result may still contain non-matches, so the filter has to be applied to it;
+        None means the filter cannot be narrowed down this way.
+        """
+        if not filters:
+            return None
+        operator = filters.get("operator")
+        if operator in ("AND", "OR"):
+            parts = [self.candidate_ids(condition) for condition in filters.get("conditions", [])]
+            if operator == "AND":
+                known = [part for part in parts if part is not None]
+                return set.intersection(*known) if known else None
+            if not parts or any(part is None for part in parts):
+                return None
+            return set().union(*parts)
+        field = str(filters.get("field", "")).removeprefix("meta.")
+        if field not in INDEXED_FIELDS or operator not in ("==", "in"):
+            return None
+        values = filters["value"] if operator == "in" else [filters["value"]]
+        if any(value is None for value in values):
+            # "== None" matcht documenten zonder het veld; dat zoeken we niet op
+            return None
+        values = [str(value) for value in values]
+        found: Set[str] = set()
+        with self._lock:
+            for start in range(0, len(values), 900):
+                part = values[start:start + 900]
+                rows = self._db.execute(
+                    f"SELECT id FROM documents WHERE {field} IN ({','.join('?' * len(part))})", part
+                ).fetchall()
+                found.update(row[0] for row in rows)
+        return found
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM documents").fetchone()[0]
+
+    def close(self) -> None:
+        self._db.close()
+
+
+@component
+class MetadataDocumentWriter:
+    """Records documents in a MetadataIndex; runs next to DocumentWriter during ingestion."""
+
+    def __init__(self, index: MetadataIndex):
+        self.index = index
+
+    @component.output_types(documents_written=int)
+    def run(self, documents: List[Document]):
+        return {"documents_written": self.index.add(documents)}
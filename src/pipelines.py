@@ -0,0 +1,571 @@
+import logging
+import os
+import threading
+from typing import TYPE_CHECKING, Any, Dict, List, Optional, Union
+
+from dotenv import load_dotenv
+
+if TYPE_CHECKING:
+    # Alleen voor de annotaties: haystack, openai en de componenten worden pas in de factories
+    # geïmporteerd (Pinecone alleen bij de backend "pinecone"), zodat wie alleen de configuratie
+    # of één singleton nodig heeft niet alles laadt
+    from haystack import Document, Pipeline
+    from haystack.components.converters import OutputAdapter
+    from haystack.components.embedders import OpenAITextEmbedder
+    from haystack.components.joiners import DocumentJoiner
+    from haystack.components.preprocessors import DocumentSplitter
+    from haystack.components.writers import DocumentWriter
+    from haystack_integrations.components.retrievers.pinecone import PineconeEmbeddingRetriever
+    from haystack_integrations.document_stores.pinecone import PineconeDocumentStore
+    from openai import AsyncOpenAI, OpenAI
+
+    from batch_embedding import ConcurrentDocumentEmbedder, EmbeddingCheckpoint
+    from conversation_memory import ConversationStore, ConversationSummarizer
+    from embedding_cache import CachedTextEmbedder, EmbeddingCache
+    from image_cache import ImageCache
+    from keyword_index import KeywordDocumentWriter, KeywordIndex, KeywordRetriever
+    from local_store import LocalDocumentStore, LocalEmbeddingRetriever
+    from metadata_index import MetadataDocumentWriter, MetadataIndex
+    from reranking import DocumentReranker
+
+logger = logging.getLogger(__name__)
+
+# De configuratie hieronder wordt bij import gelezen, dus .env moet er al zijn
+load_dotenv()
+
+# Component whose "documents" output the apps show as sources
+SOURCES_COMPONENT = "document_reranker"
+
+# text-embedding-3-small kan kortere embeddings teruggeven; een andere dimensie vraagt om een nieuwe (Pinecone) index
+EMBEDDING_MODEL = "text-embedding-3-small"
+EMBEDDING_MODEL_DIMENSIONS = 1536
+EMBEDDING_DIMENSIONS = int(os.getenv("EMBEDDING_DIMENSIONS") or EMBEDDING_MODEL_DIMENSIONS)
+
+# "pinecone" (gehoste index) of "local" (memory-mapped index op schijf, zie local_store.py)
+DOCSTORE_BACKEND = os.getenv("DOCSTORE_BACKEND", "pinecone")
+PINECONE_INDEX = os.getenv("PINECONE_INDEX", "archiefutrecht")
+DATA_DIR = os.path.join(os.path.dirname(__file__), "..", "data")
+LOCAL_DOCSTORE_PATH = os.getenv("LOCAL_DOCSTORE_PATH") or os.path.join(DATA_DIR, "local_index")
+# "exact" of "ivf"; n_lists/n_probe zijn de recall/latency knoppen van de IVF index
+LOCAL_DOCSTORE_INDEX = os.getenv("LOCAL_DOCSTORE_INDEX", "exact")
+LOCAL_DOCSTORE_N_LISTS = int(os.getenv("LOCAL_DOCSTORE_N_LISTS", "256"))
+LOCAL_DOCSTORE_N_PROBE = int(os.getenv("LOCAL_DOCSTORE_N_PROBE", "8"))
+# "int8" of "float16": compacte kopie voor het zoeken, de beste RESCORE x top_k worden exact herscoord
+LOCAL_DOCSTORE_QUANTIZATION = os.getenv("LOCAL_DOCSTORE_QUANTIZATION") or None
+LOCAL_DOCSTORE_RESCORE = int(os.getenv("LOCAL_DOCSTORE_RESCORE", "4"))
+
+# BM25 index naast de vector store; wordt bij ingestie bijgewerkt door KeywordDocumentWriter
+KEYWORD_INDEX_PATH = os.getenv("KEYWORD_INDEX_PATH") or os.path.join(DATA_DIR, "keyword_index.sqlite")
+# Hoe vaak (seconden) de app op de achtergrond wijzigingen van een lopende ingestie ophaalt
+KEYWORD_RELOAD_SECONDS = float(os.getenv("KEYWORD_RELOAD_SECONDS", "5"))
+# Kandidaten per retriever; de reranker houdt er RERANK_TOP_N over voor de prompt
+RETRIEVAL_TOP_K = int(os.getenv("RETRIEVAL_TOP_K", "20"))
+RERANK_TOP_N = int(os.getenv("RERANK_TOP_N", "5"))
+RERANK_MAX_PER_SOURCE = int(os.getenv("RERANK_MAX_PER_SOURCE", "2"))
+# Cross-encoder voor het herordenen, bijv. cross-encoder/mmarco-mMiniLMv2-L12-H384-v1 (meertalig, Nederlands).
+# Standaard uit: torch en accelerate staan niet in requirements.txt. Leeg = herordenen op cosine-gelijkenis
+# met de vraag-embedding, zonder extra afhankelijkheden
+RERANKER_MODEL = os.getenv("RERANKER_MODEL", "")
+RERANKER_BATCH_SIZE = int(os.getenv("RERANKER_BATCH_SIZE", "16"))
+# invnr/file_path/content hash -> document ids; bij ingestie bijgewerkt door MetadataDocumentWriter
+METADATA_INDEX_PATH = os.getenv("METADATA_INDEX_PATH") or os.path.join(DATA_DIR, "metadata_index.sqlite")
+
+# Tokenbudget voor history + documenten in de answer prompt
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "6000"))
+CONTEXT_MAX_DOCUMENT_TOKENS = int(os.getenv("CONTEXT_MAX_DOCUMENT_TOKENS", "400"))
+
+# Defaults voor de connection pool die alle OpenAI componenten delen
+OPENAI_MAX_CONNECTIONS = int(os.getenv("OPENAI_MAX_CONNECTIONS", "50"))
+OPENAI_MAX_KEEPALIVE = int(os.getenv("OPENAI_MAX_KEEPALIVE", "20"))
+
+# Document embedding bij ingestie: parallelle batches binnen het rate limit van de OpenAI organisatie
+EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", "128"))
+EMBEDDING_CONCURRENCY = int(os.getenv("EMBEDDING_CONCURRENCY", "4"))
+EMBEDDING_REQUESTS_PER_MINUTE = int(os.getenv("EMBEDDING_REQUESTS_PER_MINUTE", "3000"))
+EMBEDDING_TOKENS_PER_MINUTE = int(os.getenv("EMBEDDING_TOKENS_PER_MINUTE", "1000000"))
+EMBEDDING_MAX_RETRIES = int(os.getenv("EMBEDDING_MAX_RETRIES", "6"))
+EMBEDDING_CHECKPOINT_PATH = os.getenv("EMBEDDING_CHECKPOINT_PATH") or os.path.join(DATA_DIR, "embedding_checkpoint.sqlite")
+
+# Query embedding cache; zonder EMBEDDING_CACHE_PATH blijft de cache alleen in het geheugen
+EMBEDDING_CACHE_SIZE = int(os.getenv("EMBEDDING_CACHE_SIZE", "1024"))
+EMBEDDING_CACHE_PATH = os.getenv("EMBEDDING_CACHE_PATH")
+EMBEDDING_CACHE_TTL = float(os.getenv("EMBEDDING_CACHE_TTL", str(30 * 24 * 3600)))
+
+# Semantic answer cache; cosine similarity tussen (herschreven) vragen
+ANSWER_CACHE_SIZE = int(os.getenv("ANSWER_CACHE_SIZE", "512"))
+ANSWER_CACHE_THRESHOLD = float(os.getenv("ANSWER_CACHE_THRESHOLD", "0.95"))
+
+# Thumbnails van de representatieve afbeeldingen, lokaal geserveerd i.p.v. de volledige scans
+IMAGE_CACHE_PATH = os.getenv("IMAGE_CACHE_PATH") or os.path.join(DATA_DIR, "image_cache")
+IMAGE_CACHE_MAX_MB = int(os.getenv("IMAGE_CACHE_MAX_MB", "512"))
+IMAGE_THUMBNAIL_SIZE = int(os.getenv("IMAGE_THUMBNAIL_SIZE", "480"))
+
+# HTTP API (server.py): gelijktijdige pipeline runs, wachtrij daarachter en server-side sessies
+SERVER_MAX_CONCURRENCY = int(os.getenv("SERVER_MAX_CONCURRENCY", "16"))
+SERVER_MAX_QUEUE = int(os.getenv("SERVER_MAX_QUEUE", "64"))
+SERVER_QUEUE_TIMEOUT = float(os.getenv("SERVER_QUEUE_TIMEOUT", "30"))
+SERVER_CORS_ORIGIN = os.getenv("SERVER_CORS_ORIGIN", "")
+SESSION_TTL = float(os.getenv("SESSION_TTL", str(2 * 3600)))
+SESSION_MAX_SESSIONS = int(os.getenv("SESSION_MAX_SESSIONS", "10000"))
+SESSION_MAX_MESSAGES = int(os.getenv("SESSION_MAX_MESSAGES", "6"))
+
+# Gespreksgeheugen (server en app-stream): de laatste SESSION_MAX_MESSAGES berichten letterlijk,
+# oudere berichten in een lopende samenvatting van een goedkoop model; per sessie bewaard in SQLite
+CONVERSATION_STORE_PATH = os.getenv("CONVERSATION_STORE_PATH") or os.path.join(DATA_DIR, "conversations.sqlite")
+CONVERSATION_SUMMARY_MODEL = os.getenv("CONVERSATION_SUMMARY_MODEL", "gpt-4o-mini")
+CONVERSATION_SUMMARY_WORDS = int(os.getenv("CONVERSATION_SUMMARY_WORDS", "150"))
+
+# Per-stage tracing; uit = haystack's no-op tracer, dus geen overhead
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "false").lower() in ("1", "true", "yes")
+METRICS_PORT = int(os.getenv("METRICS_PORT") or "0")
+
+
+def create_docstore() -> Union["PineconeDocumentStore", "LocalDocumentStore"]:
+    from haystack.utils import Secret
+
+    from local_store import LocalDocumentStore
+
+    if DOCSTORE_BACKEND == "local":
+        return LocalDocumentStore(
+            path=LOCAL_DOCSTORE_PATH,
+            dimension=EMBEDDING_DIMENSIONS,
+            index=LOCAL_DOCSTORE_INDEX,
+            n_lists=LOCAL_DOCSTORE_N_LISTS,
+            n_probe=LOCAL_DOCSTORE_N_PROBE,
+            quantization=LOCAL_DOCSTORE_QUANTIZATION,
+            rescore=LOCAL_DOCSTORE_RESCORE,
+        )
+    from haystack_integrations.document_stores.pinecone import PineconeDocumentStore
+
+    return PineconeDocumentStore(
+        api_key=Secret.from_env_var("PINECONE_API_KEY"),
+        index=PINECONE_INDEX,
+        dimension=EMBEDDING_DIMENSIONS,
+    )
+
+def requested_dimensions() -> Optional[int]:
+    # Bij de volle dimensie niets meesturen, dan blijven bestaande cache keys en checkpoints geldig
+    return EMBEDDING_DIMENSIONS if EMBEDDING_DIMENSIONS != EMBEDDING_MODEL_DIMENSIONS else None
+
+def create_document_embedder(checkpoint: Optional["EmbeddingCheckpoint"] = None) -> "ConcurrentDocumentEmbedder":
+    from batch_embedding import ConcurrentDocumentEmbedder
+
+    return ConcurrentDocumentEmbedder(
+        model=EMBEDDING_MODEL,
+        dimensions=requested_dimensions(),
+        batch_size=EMBEDDING_BATCH_SIZE,
+        max_concurrency=EMBEDDING_CONCURRENCY,
+        requests_per_minute=EMBEDDING_REQUESTS_PER_MINUTE,
+        tokens_per_minute=EMBEDDING_TOKENS_PER_MINUTE,
+        max_retries=EMBEDDING_MAX_RETRIES,
+        checkpoint=checkpoint,
+    )
+
+def create_text_embedder() -> "OpenAITextEmbedder":
+    from haystack.components.embedders import OpenAITextEmbedder
+    from haystack.utils import Secret
+
+    return OpenAITextEmbedder(
+        model=EMBEDDING_MODEL,
+        dimensions=requested_dimensions(),
+        api_key=Secret.from_env_var("OPENAI_API_KEY"),
+    )
+
+_embedding_cache: Optional["EmbeddingCache"] = None
+
+def get_embedding_cache() -> "EmbeddingCache":
+    global _embedding_cache
+    if _embedding_cache is None:
+        from embedding_cache import EmbeddingCache
+
+        _embedding_cache = EmbeddingCache(
+            max_entries=EMBEDDING_CACHE_SIZE,
+            path=EMBEDDING_CACHE_PATH,
+            ttl_seconds=EMBEDDING_CACHE_TTL,
+        )
+    return _embedding_cache
+
+def create_cached_text_embedder() -> "CachedTextEmbedder":
+    from embedding_cache import CachedTextEmbedder
+
+    return CachedTextEmbedder(create_text_embedder(), get_embedding_cache())
+
+_keyword_index: Optional["KeywordIndex"] = None
+
+def get_keyword_index() -> "KeywordIndex":
+    global _keyword_index
+    if _keyword_index is None:
+        from keyword_index import KeywordIndex
+
+        _keyword_index = KeywordIndex(path=KEYWORD_INDEX_PATH, reload_interval=KEYWORD_RELOAD_SECONDS)
+    return _keyword_index
+
+def create_keyword_writer() -> "KeywordDocumentWriter":
+    from keyword_index import KeywordDocumentWriter
+
+    return KeywordDocumentWriter(get_keyword_index())
+
+def create_keyword_retriever() -> "KeywordRetriever":
+    from keyword_index import KeywordRetriever
+
+    return KeywordRetriever(get_keyword_index(), top_k=RETRIEVAL_TOP_K)
+
+_metadata_index: Optional["MetadataIndex"] = None
+_metadata_index_lock = threading.Lock()
+
+def get_metadata_index() -> "MetadataIndex":
+    global _metadata_index
+    with _metadata_index_lock:
+        if _metadata_index is None:
+            from metadata_index import MetadataIndex
+
+            os.makedirs(os.path.dirname(os.path.abspath(METADATA_INDEX_PATH)), exist_ok=True)
+            _metadata_index = MetadataIndex(METADATA_INDEX_PATH)
+            if len(_metadata_index) == 0:
+                # Bestaande installatie: eenmalig vullen vanuit de keyword index, die alle chunks met meta bevat
+                documents = get_keyword_index().get_documents()
+                if documents:
+                    logger.info("Building metadata index from %d keyword index documents", len(documents))
+                    _metadata_index.add(documents)
+        return _metadata_index
+
+def create_metadata_writer() -> "MetadataDocumentWriter":
+    from metadata_index import MetadataDocumentWriter
+
+    return MetadataDocumentWriter(get_metadata_index())
+
+def get_documents_by_invnr(invnr: Any) -> List["Document"]:
+    """All chunks of one inventory number, straight from the side indexes (no embedding or search)."""
+    get_keyword_index().reload()
+    return get_keyword_index().get_documents(get_metadata_index().ids(invnr=invnr))
+
+def delete_documents(document_ids: List[str], docstore=None) -> None:
+    """Removes chunks from the document store, the keyword index and the metadata index."""
+    if not document_ids:
+        return
+    (docstore or create_docstore()).delete_documents(document_ids)
+    get_keyword_index().delete(document_ids)
+    get_keyword_index().save()
+    get_metadata_index().delete(document_ids)
+
+def delete_file(file_path: str, docstore=None) -> List[str]:
+    """Removes every chunk whose meta.file_path equals `file_path`; returns their ids."""
+    document_ids = get_metadata_index().ids(file_path=file_path)
+    delete_documents(document_ids, docstore)
+    return document_ids
+
+def create_document_joiner() -> "DocumentJoiner":
+    from haystack.components.joiners import DocumentJoiner
+
+    # Reciprocal rank fusion gebruikt alleen de rangorde, dus BM25- en cosine-scores hoeven niet vergelijkbaar te zijn
+    return DocumentJoiner(join_mode="reciprocal_rank_fusion", top_k=RETRIEVAL_TOP_K)
+
+_image_cache: Optional["ImageCache"] = None
+
+def get_image_cache() -> "ImageCache":
+    global _image_cache
+    if _image_cache is None:
+        from image_cache import ImageCache
+
+        _image_cache = ImageCache(
+            path=IMAGE_CACHE_PATH,
+            max_bytes=IMAGE_CACHE_MAX_MB * 1024 * 1024,
+            thumbnail_size=IMAGE_THUMBNAIL_SIZE,
+        )
+    return _image_cache
+
+_conversation_store: Optional["ConversationStore"] = None
+_conversation_summarizer: Optional["ConversationSummarizer"] = None
+_conversation_lock = threading.Lock()
+
+def get_conversation_store() -> "ConversationStore":
+    global _conversation_store
+    with _conversation_lock:
+        if _conversation_store is None:
+            from conversation_memory import ConversationStore
+
+            os.makedirs(os.path.dirname(os.path.abspath(CONVERSATION_STORE_PATH)), exist_ok=True)
+            _conversation_store = ConversationStore(
+                CONVERSATION_STORE_PATH, window=SESSION_MAX_MESSAGES, ttl_seconds=SESSION_TTL
+            )
+        return _conversation_store
+
+def get_conversation_summarizer() -> "ConversationSummarizer":
+    global _conversation_summarizer
+    store = get_conversation_store()
+    with _conversation_lock:
+        if _conversation_summarizer is None:
+            from haystack.components.generators import OpenAIGenerator
+
+            from conversation_memory import ConversationSummarizer
+
+            generator = OpenAIGenerator(
+                model=CONVERSATION_SUMMARY_MODEL,
+                generation_kwargs={"temperature": 0, "max_tokens": CONVERSATION_SUMMARY_WORDS * 3},
+            )
+            share_openai_client(generator)
+            _conversation_summarizer = ConversationSummarizer(
+                generator, store=store, max_words=CONVERSATION_SUMMARY_WORDS
+            )
+        return _conversation_summarizer
+
+def create_document_writer(docstore) -> "DocumentWriter":
+    from haystack.components.writers import DocumentWriter
+    from haystack.document_stores.types.policy import DuplicatePolicy
+
+    return DocumentWriter(document_store=docstore, policy=DuplicatePolicy.OVERWRITE)
+
+def create_reranker() -> "DocumentReranker":
+    from reranking import DocumentReranker
+
+    ranker = None
+    if RERANKER_MODEL:
+        try:
+            from haystack.components.rankers import TransformersSimilarityRanker
+
+            ranker = TransformersSimilarityRanker(model=RERANKER_MODEL, batch_size=RERANKER_BATCH_SIZE)
+        except ImportError as e:
+            logger.warning(
+                "Reranker %s unavailable, reranking by embedding similarity (pip install torch accelerate): %s",
+                RERANKER_MODEL, e,
+            )
+    return DocumentReranker(ranker=ranker, top_k=RERANK_TOP_N, max_per_source=RERANK_MAX_PER_SOURCE)
+
+def create_retriever(docstore=None) -> Union["PineconeEmbeddingRetriever", "LocalEmbeddingRetriever"]:
+    from local_store import LocalDocumentStore, LocalEmbeddingRetriever
+
+    docstore = docstore or create_docstore()
+    if isinstance(docstore, LocalDocumentStore):
+        return LocalEmbeddingRetriever(
+            document_store=docstore, top_k=RETRIEVAL_TOP_K, metadata_index=get_metadata_index()
+        )
+    from haystack_integrations.components.retrievers.pinecone import PineconeEmbeddingRetriever
+
+    return PineconeEmbeddingRetriever(document_store=docstore, top_k=RETRIEVAL_TOP_K)
+
+def create_llm_output_adapter() -> "OutputAdapter":
+    from haystack.components.converters import OutputAdapter
+
+    return OutputAdapter(
+        template="{{ replies [0] }}",
+        output_type=str
+    )
+
+
+_openai_client: Optional["OpenAI"] = None
+_openai_client_lock = threading.Lock()
+
+def get_openai_client() -> "OpenAI":
+    """Process-wide OpenAI client so every component reuses the same pooled connections."""
+    global _openai_client
+    with _openai_client_lock:
+        if _openai_client is None:
+            import httpx
+            from haystack.utils import Secret
+            from openai import OpenAI
+
+            _openai_client = OpenAI(
+                api_key=Secret.from_env_var("OPENAI_API_KEY").resolve_value(),
+                http_client=httpx.Client(
+                    limits=httpx.Limits(
+                        max_connections=OPENAI_MAX_CONNECTIONS,
+                        max_keepalive_connections=OPENAI_MAX_KEEPALIVE,
+                    ),
+                ),
+            )
+        return _openai_client
+
+_async_openai_client: Optional["AsyncOpenAI"] = None
+
+def get_async_openai_client() -> "AsyncOpenAI":
+    """Async counterpart of get_openai_client; only use it from the async_pipeline event loop."""
+    global _async_openai_client
+    with _openai_client_lock:
+        if _async_openai_client is None:
+            import httpx
+            from haystack.utils import Secret
+            from openai import AsyncOpenAI
+
+            _async_openai_client = AsyncOpenAI(
+                api_key=Secret.from_env_var("OPENAI_API_KEY").resolve_value(),
+                http_client=httpx.AsyncClient(
+                    limits=httpx.Limits(
+                        max_connections=OPENAI_MAX_CONNECTIONS,
+                        max_keepalive_connections=OPENAI_MAX_KEEPALIVE,
+                    ),
+                ),
+            )
+        return _async_openai_client
+
+def share_openai_client(*components) -> None:
+    # Haystack maakt per component een eigen client (en dus eigen connection pool) aan
+    client = get_openai_client()
+    for component in components:
+        component.client = client
+
+
+def create_qa_pipeline(answer_model: str = "gpt-4o-mini", streaming_callback=None) -> "Pipeline":
+    from haystack import Pipeline
+    from haystack.components.builders import PromptBuilder
+    from haystack.components.generators import OpenAIGenerator
+    from haystack.components.joiners import BranchJoiner
+
+    from answer_cache import CachedAnswerGenerator, SemanticAnswerCache
+    from context_assembly import ContextAssembler
+    from prompts import QUERY_ANSWER_TEMPLATE, QUERY_REPHRASE_TEMPLATE, SYSTEM_PROMPT_2
+    from query_routing import RephraseRouter
+
+    pipeline = Pipeline()
+
+    rephrase_router = RephraseRouter()
+    query_rephrase_builder = PromptBuilder(template=QUERY_REPHRASE_TEMPLATE, required_variables=["query"])
+    answer_builder = PromptBuilder(template=QUERY_ANSWER_TEMPLATE)
+
+    rephrase_llm = OpenAIGenerator()
+    answer_llm = CachedAnswerGenerator(
+        OpenAIGenerator(system_prompt=SYSTEM_PROMPT_2, model=answer_model, streaming_callback=streaming_callback),
+        SemanticAnswerCache(max_entries=ANSWER_CACHE_SIZE, threshold=ANSWER_CACHE_THRESHOLD),
+    )
+
+    rephrase_output_adapter = create_llm_output_adapter()
+    query_joiner = BranchJoiner(str)
+
+    question_embedder = create_cached_text_embedder()
+    pinecone_retriever = create_retriever()
+    keyword_retriever = create_keyword_retriever()
+    document_joiner = create_document_joiner()
+    document_reranker = create_reranker()
+    context_assembler = ContextAssembler(
+        max_tokens=CONTEXT_TOKEN_BUDGET, max_document_tokens=CONTEXT_MAX_DOCUMENT_TOKENS, model=answer_model
+    )
+
+    share_openai_client(rephrase_llm, answer_llm.generator, question_embedder.embedder)
+
+    pipeline.add_component("rephrase_router", rephrase_router)
+    pipeline.add_component("query_rephrase_builder", query_rephrase_builder)
+    pipeline.add_component("rephrase_output_adapter", rephrase_output_adapter)
+    pipeline.add_component("query_joiner", query_joiner)
+    pipeline.add_component("answer_builder", answer_builder)
+    pipeline.add_component("rephrase_llm", rephrase_llm)
+    pipeline.add_component("answer_llm", answer_llm)
+    pipeline.add_component("question_embedder", question_embedder)
+    pipeline.add_component("pinecone_retriever", pinecone_retriever)
+    pipeline.add_component("keyword_retriever", keyword_retriever)
+    pipeline.add_component("document_joiner", document_joiner)
+    pipeline.add_component("document_reranker", document_reranker)
+    pipeline.add_component("context_assembler", context_assembler)
+
+    # Eerste beurt en zelfstandige vervolgvragen slaan de rephrase LLM over
+    pipeline.connect("rephrase_router.rephrase_query", "query_rephrase_builder.query")
+    pipeline.connect("rephrase_router.history", "query_rephrase_builder.history")
+    pipeline.connect("rephrase_router.query", "query_joiner")
+    pipeline.connect("query_rephrase_builder", "rephrase_llm")
+    pipeline.connect("rephrase_llm", "rephrase_output_adapter")
+    pipeline.connect("rephrase_output_adapter", "query_joiner")
+    # Hybrid retrieval: BM25 eerst (geen API call); alleen voor exacte invnr-vragen blijft de embedding achterwege
+    pipeline.connect("query_joiner", "keyword_retriever.query")
+    pipeline.connect("keyword_retriever.dense_query", "question_embedder.text")
+    pipeline.connect("question_embedder.embedding", "pinecone_retriever.query_embedding")
+    pipeline.connect("keyword_retriever.documents", "document_joiner.documents")
+    pipeline.connect("pinecone_retriever.documents", "document_joiner.documents")
+    # Ontdubbelen, aangrenzende chunks samenvoegen en herordenen; alleen de beste paar gaan de prompt in
+    pipeline.connect("document_joiner.documents", "document_reranker.documents")
+    pipeline.connect("query_joiner", "document_reranker.query")
+    pipeline.connect("question_embedder.embedding", "document_reranker.query_embedding")
+    # History en documenten worden binnen het tokenbudget gehouden; history komt via run data binnen
+    pipeline.connect("document_reranker.documents", "context_assembler.documents")
+    pipeline.connect("query_joiner", "context_assembler.query")
+    pipeline.connect("context_assembler.documents", "answer_builder.documents")
+    pipeline.connect("context_assembler.history", "answer_builder.history")
+    pipeline.connect("context_assembler.query", "answer_builder.query")
+    pipeline.connect("answer_builder", "answer_llm.prompt")
+    pipeline.connect("question_embedder.embedding", "answer_llm.query_embedding")
+    pipeline.connect("context_assembler.documents", "answer_llm.documents")
+    pipeline.connect("context_assembler.history", "answer_llm.history")
+
+    return pipeline
+
+
+def create_document_splitter() -> "DocumentSplitter":
+    from haystack.components.preprocessors import DocumentSplitter
+
+    return DocumentSplitter(split_by="sentence", split_length=3)
+
+def create_preprocessing_pipeline() -> "Pipeline":
+    """PDF -> cleaned, split documents, without embedding or writing (see ingest.py)."""
+    from haystack import Pipeline
+    from haystack.components.converters import PyPDFToDocument
+    from haystack.components.preprocessors import DocumentCleaner
+
+    pipeline = Pipeline()
+    pipeline.add_component("converter", PyPDFToDocument())
+    pipeline.add_component("cleaner", DocumentCleaner())
+    pipeline.add_component("splitter", create_document_splitter())
+    pipeline.connect("converter", "cleaner")
+    pipeline.connect("cleaner", "splitter")
+    return pipeline
+
+def create_indexing_pipeline(docstore=None, convert_pdfs: bool = True) -> "Pipeline":
+    """
+    PDF -> cleaned, split, embedded documents in the vector store and the keyword index.
+    Without `convert_pdfs` the pipeline starts at "cleaner" and takes Documents.
+    """
+    from haystack import Pipeline
+    from haystack.components.converters import PyPDFToDocument
+    from haystack.components.preprocessors import DocumentCleaner
+
+    pipeline = Pipeline()
+
+    embedder = create_document_embedder()
+    share_openai_client(embedder)
+
+    if convert_pdfs:
+        pipeline.add_component("converter", PyPDFToDocument())
+    pipeline.add_component("cleaner", DocumentCleaner())
+    pipeline.add_component("splitter", create_document_splitter())
+    pipeline.add_component("embedder", embedder)
+    pipeline.add_component("writer", create_document_writer(docstore or create_docstore()))
+    pipeline.add_component("keyword_writer", create_keyword_writer())
+    pipeline.add_component("metadata_writer", create_metadata_writer())
+
+    if convert_pdfs:
+        pipeline.connect("converter", "cleaner")
+    pipeline.connect("cleaner", "splitter")
+    pipeline.connect("splitter", "embedder")
+    pipeline.connect("embedder", "writer")
+    pipeline.connect("splitter", "keyword_writer")
+    pipeline.connect("splitter", "metadata_writer")
+
+    return pipeline
+
+
+# --- Process-wide registry ---
+# Streamlit voert het script bij elke interactie opnieuw uit, maar geïmporteerde modules blijven
+# in het geheugen. Pipelines worden daarom één keer per proces gebouwd en daarna hergebruikt.
+# Per-request state (zoals de streaming callback) gaat via pipeline.run(data=...) naar binnen.
+_pipelines: Dict[str, "Pipeline"] = {}
+_pipelines_lock = threading.Lock()
+
+def get_qa_pipeline(answer_model: str = "gpt-4o-mini") -> "Pipeline":
+    with _pipelines_lock:
+        pipeline = _pipelines.get(answer_model)
+        if pipeline is None:
+            logger.info("Building QA pipeline for %s", answer_model)
+            pipeline = create_qa_pipeline(answer_model=answer_model)
+            pipeline.warm_up()
+            _pipelines[answer_model] = pipeline
+        return pipeline
+
+def warm_up(answer_model: str = "gpt-4o-mini") -> "Pipeline":
+    """Build the pipeline and open the document store connection before the first question arrives."""
+    if METRICS_ENABLED:
+        from instrumentation import enable_instrumentation
+
+        enable_instrumentation(METRICS_PORT or None)
+    pipeline = get_qa_pipeline(answer_model)
+    retriever = pipeline.get_component("pinecone_retriever")
+    try:
+        retriever.document_store.count_documents()
+    except Exception as e:
+        logger.warning("Document store warm-up failed: %s", e)
+    return pipeline
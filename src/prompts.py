@@ -23,13 +23,29 @@ Gesprek tot nu toe:
 
 Documenten:
 {% for doc in documents %}
-- {{doc}}
+- {% if doc.meta.invnr %}(invnr {{doc.meta.invnr}}) {% endif %}{{doc.content}}
 {% endfor %}
 
 Vraag: {{query}}
 Antwoord:
 """
 
+CONVERSATION_SUMMARY_TEMPLATE = """
+Vat het gesprek tussen een bezoeker en de archiefassistent samen, zodat vervolgvragen ook zonder de oudere berichten begrepen worden.
+Werk de bestaande samenvatting bij met de nieuwe berichten. Behoud namen, inventarisnummers, jaartallen, plaatsen en
+onderwerpen waar de bezoeker naar vroeg; laat begroetingen en herhalingen weg. Gebruik hooguit {{max_words}} woorden.
+
+Samenvatting tot nu toe:
+{{summary or "(nog geen)"}}
+
+Nieuwe berichten:
+{% for chat in messages %}
+- {{chat["role"]}}: {{chat["content"]}}
+{% endfor %}
+
+Bijgewerkte samenvatting:
+"""
+
 SYSTEM_PROMPT = """
 Je bent een deskundige virtuele gids voor een digitaal kasteelarchief. Je helpt bezoekers bij het verkennen van historische informatie over het kasteel, zijn bewoners, architectuur en de bredere context van de tijd waarin het kasteel floreerde. Je hebt toegang tot verschillende soorten digitale assets, zoals teksten, afbeeldingen, audio, video en 3D-modellen.
 
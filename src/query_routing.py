@@ -0,0 +1,96 @@
+import re
+from typing import Any, Dict, List, Optional
+
+from haystack import component
+
+from context_assembly import TokenCounter, fit_history
+
+# Woorden die naar eerdere beurten verwijzen; zonder deze is een vervolgvraag meestal al zelfstandig
+REFERRING_WORDS = {
+    "hij", "zij", "ze", "hem", "haar", "hun", "hen", "daar", "daarvan", "daarover", "daarna",
+    "ervan", "erover", "erna", "hiervan", "hierover", "dezelfde", "diezelfde", "voornoemde",
+    "toen", "destijds", "hetzelfde", "daarin", "hierin", "erin", "daarmee", "hiermee", "ermee",
+    "daarvoor", "hiervoor", "ervoor",
+    "he", "she", "him", "her", "his", "they", "them", "their", "it", "its", "there", "that", "this", "these", "those",
+}
+# "het", "dit kasteel", "deze familie", "die man", "dat gebouw": verwijzen terug, tenzij er direct
+# een naam volgt ("het Kasteel Amerongen", "die Godard schreef")
+DETERMINER_WORDS = {"het", "dit", "dat", "deze", "die"}
+# "zijn" is een werkwoord in "welke kaarten zijn er?", "zijn bewaard gebleven", "wat zijn de ..."
+# maar verwijst terug in "zijn vader", "met zijn vrouw", "wie was zijn zoon"
+ZIJN_VERB_FOLLOWERS = {
+    "er", "de", "het", "een", "nog", "ook", "al", "niet", "daar", "hier", "in", "uit", "van", "op", "bij",
+    "aan", "voor", "door", "na", "naar", "over", "met", "tot", "om", "dan", "nu", "vaak", "altijd", "wel",
+}
+ZIJN_POSSESSIVE_AFTER = {
+    "van", "met", "over", "bij", "aan", "voor", "door", "na", "naar", "op", "uit", "in", "om", "tot", "en",
+    "was", "is", "had", "heeft", "werd", "wordt", "waren", "hadden",
+}
+PARTICIPLE_PREFIXES = ("ge", "be", "ver", "ont", "her")
+FOLLOW_UP_OPENERS = ("en ", "maar ", "ook ", "of ", "and ", "also ", "what about ", "en wat ")
+
+WORD_RE = re.compile(r"\w+", re.UNICODE)
+
+
+@component
+class RephraseRouter:
+    """
+    Sends a query straight to the embedder when rephrasing cannot change it:
+    on the first turn, or when a follow-up does not refer back to the conversation.
+    """
+
+    def __init__(self, min_words: int = 4, history_tokens: int = 1500):
+        self.min_words = min_words
+        self.history_tokens = history_tokens
+        self.counter = TokenCounter()
+        self.bypassed = 0
+        self.rephrased = 0
+
+    @component.output_types(query=str, rephrase_query=str, history=List[Any])
+    def run(self, query: str, history: Optional[List[Any]] = None):
+        # Alleen de recentste beurten zijn nodig om verwijzingen op te lossen
+        turns, _, _ = fit_history(history, self.history_tokens, self.counter, query=query)
+        if not turns or self.is_self_contained(query):
+            self.bypassed += 1
+            return {"query": query}
+        self.rephrased += 1
+        return {"rephrase_query": query, "history": turns}
+
+    def is_self_contained(self, query: str) -> bool:
+        text = query.strip().lower()
+        words = WORD_RE.findall(text)
+        if len(words) < self.min_words or text.startswith(FOLLOW_UP_OPENERS):
+            return False
+        if REFERRING_WORDS.intersection(words):
+            return False
+        # Een naam of jaartal elders in de vraag lost "zijn vader" of "die man" niet op
+        original = WORD_RE.findall(query.strip())
+        for i, word in enumerate(words):
+            following = original[i + 1] if i + 1 < len(original) else ""
+            if word in DETERMINER_WORDS and not following[:1].isupper():
+                return False
+            if word == "zijn" and self.is_possessive(words, i):
+                return False
+        return True
+
+    @staticmethod
+    def is_possessive(words: List[str], i: int) -> bool:
+        """Whether "zijn" at position `i` means "his" rather than "are"."""
+        if i > 0 and words[i - 1] in ZIJN_POSSESSIVE_AFTER:
+            return True
+        if i + 1 >= len(words):
+            return False
+        following = words[i + 1]
+        if following in ZIJN_VERB_FOLLOWERS or following.isdigit():
+            return False
+        # Voltooid deelwoord: "zijn bewaard", "zijn gebouwd", "zijn ontworpen"
+        participle = following.startswith(PARTICIPLE_PREFIXES) and following.endswith(("d", "t", "en"))
+        return not participle
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.bypassed + self.rephrased
+        return {
+            "bypassed": self.bypassed,
+            "rephrased": self.rephrased,
+            "bypass_rate": self.bypassed / total if total else 0.0,
+        }
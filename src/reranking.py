@@ -0,0 +1,175 @@
+import logging
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+import numpy as np
+from haystack import Document, component
+
+from keyword_index import tokenize
+
+logger = logging.getLogger(__name__)
+
+
+def shingles(text: str, size: int = 3) -> Set[Tuple[str, ...]]:
+    tokens = tokenize(text)
+    if len(tokens) < size:
+        return {tuple(tokens)} if tokens else set()
+    return set(zip(*(tokens[i:] for i in range(size))))
+
+def jaccard(a: Set[Any], b: Set[Any]) -> float:
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+def source_key(doc: Document) -> Optional[str]:
+    # source_id is per geconverteerd bestand; twee kopieën van dezelfde PDF zijn twee bronnen
+    return doc.meta.get("source_id") or doc.meta.get("file_path")
+
+
+def deduplicate(documents: List[Document], threshold: float = 0.8) -> List[Document]:
+    """Drops documents whose word shingles overlap an earlier (better ranked) one by at least `threshold`."""
+    kept: List[Document] = []
+    kept_shingles: List[Set[Tuple[str, ...]]] = []
+    for doc in documents:
+        doc_shingles = shingles(doc.content or "")
+        if any(jaccard(doc_shingles, other) >= threshold for other in kept_shingles):
+            continue
+        kept.append(doc)
+        kept_shingles.append(doc_shingles)
+    return kept
+
+def merge_adjacent(documents: List[Document], max_chunks: int = 3) -> List[Document]:
+    """
+    Joins chunks with consecutive split_ids from the same source into one passage, at
+    most `max_chunks` long. A passage takes the rank, id and score of its best member.
+    """
+    runs: Dict[int, List[Tuple[int, Document]]] = {}
+    by_source: Dict[str, List[Tuple[int, int, Document]]] = {}
+    for rank, doc in enumerate(documents):
+        key, split_id = source_key(doc), doc.meta.get("split_id")
+        if key is None or split_id is None:
+            runs[rank] = [(rank, doc)]
+        else:
+            by_source.setdefault(key, []).append((split_id, rank, doc))
+
+    for chunks in by_source.values():
+        chunks.sort(key=lambda chunk: chunk[0])
+        run = [chunks[0]]
+        for chunk in chunks[1:]:
+            if chunk[0] == run[-1][0] + 1 and len(run) < max_chunks:
+                run.append(chunk)
+                continue
+            runs[min(rank for _, rank, _ in run)] = [(rank, doc) for _, rank, doc in run]
+            run = [chunk]
+        runs[min(rank for _, rank, _ in run)] = [(rank, doc) for _, rank, doc in run]
+
+    merged = []
+    for best_rank in sorted(runs):
+        run = runs[best_rank]
+        if len(run) == 1:
+            merged.append(run[0][1])
+            continue
+        best = documents[best_rank]
+        embeddings = [doc.embedding for _, doc in run]
+        merged.append(Document(
+            id=best.id,
+            content="".join(doc.content or "" for _, doc in run),
+            meta={**run[0][1].meta, "merged_ids": [doc.id for _, doc in run]},
+            score=best.score,
+            # Een passage lijkt op het gemiddelde van zijn chunks
+            embedding=None if any(e is None for e in embeddings) else np.mean(embeddings, axis=0).tolist(),
+        ))
+    return merged
+
+def rerank_by_embedding(documents: List[Document], query_embedding: List[float]) -> List[Document]:
+    """
+    Reorders the documents that have an embedding by cosine similarity to the query, within
+    the positions they already hold. Documents without one (keyword-only hits) keep their place.
+    """
+    slots = [i for i, doc in enumerate(documents) if doc.embedding is not None]
+    if len(slots) < 2:
+        return documents
+    query = np.asarray(query_embedding, dtype=np.float32)
+    vectors = np.asarray([documents[i].embedding for i in slots], dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=1) * np.linalg.norm(query)
+    similarities = vectors @ query / np.maximum(norms, 1e-12)
+    reranked = list(documents)
+    for slot, best in zip(slots, np.argsort(-similarities, kind="stable")):
+        reranked[slot] = documents[slots[best]]
+    return reranked
+
+def limit_per_source(documents: List[Document], top_k: int, max_per_source: Optional[int]) -> List[Document]:
+    """
+    The best `top_k` documents with at most `max_per_source` per inventory number (or file).
+    Skipped documents fill the remaining places when there are not enough other sources.
+    """
+    if not max_per_source:
+        return documents[:top_k]
+    counts: Dict[str, int] = {}
+    selected, skipped = [], []
+    for doc in documents:
+        invnr = doc.meta.get("invnr")
+        key = f"invnr:{invnr}" if invnr is not None else source_key(doc) or doc.id
+        counts[key] = counts.get(key, 0) + 1
+        (selected if counts[key] <= max_per_source else skipped).append(doc)
+    if len(selected) < top_k:
+        # Terug in rangorde, anders verschuiven de aangevulde documenten naar achteren
+        chosen = {id(doc) for doc in selected + skipped[: top_k - len(selected)]}
+        selected = [doc for doc in documents if id(doc) in chosen]
+    return selected[:top_k]
+
+
+@component
+class DocumentReranker:
+    """
+    Post-retrieval stage between document_joiner and context_assembler.
+
+    The over-fetched candidates are de-duplicated on word shingles, consecutive chunks
+    of the same file are merged back into passages, and the passages are reranked
+    with a cross-encoder `ranker` (e.g. TransformersSimilarityRanker) if there is one,
+    otherwise by cosine similarity to `query_embedding` (see `rerank_by_embedding`).
+    Only the best `top_k`, at most `max_per_source` per inventory number or file,
+    go on to the prompt.
+    """
+
+    def __init__(
+        self,
+        ranker=None,
+        top_k: int = 5,
+        max_per_source: Optional[int] = 2,
+        duplicate_threshold: float = 0.8,
+        max_merged_chunks: int = 3,
+    ):
+        self.ranker = ranker
+        self.top_k = top_k
+        self.max_per_source = max_per_source
+        self.duplicate_threshold = duplicate_threshold
+        self.max_merged_chunks = max_merged_chunks
+
+    def warm_up(self):
+        if self.ranker is None or not hasattr(self.ranker, "warm_up"):
+            return
+        try:
+            self.ranker.warm_up()
+        except Exception as e:
+            # Model niet te laden (offline, geen torch): dan herordenen op de vraag-embedding
+            logger.warning("Reranker unavailable, reranking by embedding similarity: %s", e)
+            self.ranker = None
+
+    @component.output_types(documents=List[Document])
+    def run(
+        self,
+        documents: List[Document],
+        query: Optional[str] = None,
+        query_embedding: Optional[List[float]] = None,
+        top_k: Optional[int] = None,
+    ):
+        top_k = top_k or self.top_k
+        passages = merge_adjacent(deduplicate(documents, self.duplicate_threshold), self.max_merged_chunks)
+        if self.ranker is not None and query and len(passages) > 1:
+            passages = self.ranker.run(query=query, documents=passages, top_k=len(passages))["documents"]
+        elif query_embedding is not None:
+            # Zonder cross-encoder: de vraag-embedding is er al, herordenen kost dan niets extra
+            passages = rerank_by_embedding(passages, query_embedding)
+        selected = limit_per_source(passages, top_k, self.max_per_source)
+        logger.debug("Reranker: %d candidates, %d passages, %d selected", len(documents), len(passages), len(selected))
+        return {"documents": selected}
@@ -0,0 +1,546 @@
+"""
+Headless HTTP API around the QA pipeline, for kiosks and the website.
+
+    python src/server.py --port 8080
+    curl -N localhost:8080/v1/chat/stream -d '{"query": "Wie bouwde het kasteel?"}'
+
+Endpoints:
+    POST /v1/chat/stream    Server-sent events: "session", "sources", "token"..., then "done" or "error".
+                            Also as GET with ?query=...&session_id=... for EventSource clients.
+    POST /v1/chat           {"query": ..., "session_id": ...} -> JSON answer
+    POST /v1/batch          {"questions": [{"query": ..., "session_id": ...}, ...]} -> answers in order
+    GET/DELETE /v1/sessions/{session_id}
+    GET /healthz, /v1/stats (and /metrics when METRICS_ENABLED)
+
+Chat history lives on the server per session id; clients only send the new question. The
+prompts get the last SESSION_MAX_MESSAGES messages plus a running summary of older ones, and
+sessions are kept in CONVERSATION_STORE_PATH so they survive a restart.
+Identical questions (same history) that are in flight at the same time share one pipeline
+run. At most SERVER_MAX_CONCURRENCY runs execute at once and SERVER_MAX_QUEUE more may
+wait; beyond that requests get a 503 with Retry-After instead of piling up.
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import logging
+import re
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+
+from aiohttp import web
+from haystack import Document
+
+from async_pipeline import AsyncQAPipeline, get_async_qa_pipeline
+from conversation_memory import ConversationMemory, ConversationStore, ConversationSummarizer
+from instrumentation import get_registry, instrument_streaming_callback
+from pipelines import (
+    SERVER_CORS_ORIGIN,
+    SERVER_MAX_CONCURRENCY,
+    SERVER_MAX_QUEUE,
+    SERVER_QUEUE_TIMEOUT,
+    SESSION_MAX_MESSAGES,
+    SESSION_MAX_SESSIONS,
+    SESSION_TTL,
+    get_conversation_store,
+    get_conversation_summarizer,
+    warm_up,
+)
+
+logger = logging.getLogger(__name__)
+
+MAX_QUERY_CHARS = 2000
+MAX_BATCH_SIZE = 50
+SESSION_ID_RE = re.compile(r"^[A-Za-z0-9_.-]{1,128}$")
+# Houdt proxies open en merkt verbroken verbindingen op terwijl een vraag in de wachtrij staat
+HEARTBEAT_SECONDS = 15.0
+TERMINAL_EVENTS = ("done", "error")
+
+SERVICE_KEY = web.AppKey("service", "QAService")
+
+
+class Overloaded(Exception):
+    pass
+
+
+class SessionStore:
+    """
+    Conversation memory per session id (see conversation_memory.py). The least recently used
+    session is dropped from memory beyond `max_sessions` and idle sessions expire after
+    `ttl_seconds`. The last `max_messages` messages are kept verbatim; with a `summarizer`
+    older ones are folded into a running summary in the background, without one they are
+    dropped. With a `store` sessions are persisted and reloaded after a restart; those
+    writes go through one background thread, in order, so a SQLite commit never holds up
+    the event loop. Loading a session from the store goes through the same thread, which is
+    why `memory`, `history`, `append` and `delete` are coroutines.
+    """
+
+    def __init__(
+        self,
+        max_sessions: int = 10_000,
+        ttl_seconds: float = 7200.0,
+        max_messages: int = 6,
+        store: Optional[ConversationStore] = None,
+        summarizer: Optional[ConversationSummarizer] = None,
+    ):
+        self.max_sessions = max_sessions
+        self.ttl_seconds = ttl_seconds
+        self.max_messages = max_messages
+        self.store = store
+        self.summarizer = summarizer
+        self._sessions: "OrderedDict[str, ConversationMemory]" = OrderedDict()
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="session-store") if store is not None else None
+
+    def create(self) -> str:
+        session_id = uuid.uuid4().hex
+        self._remember(ConversationMemory(session_id, window=self.max_messages))
+        return session_id
+
+    async def memory(self, session_id: str) -> Optional[ConversationMemory]:
+        memory = self._sessions.get(session_id)
+        if memory is None and self.store is not None:
+            # Via de schrijfthread: niet op de event loop, en pas na saves van deze sessie die nog wachten
+            loaded = await asyncio.wrap_future(self._writer.submit(self.store.load, session_id))
+            # Een andere request kan de sessie intussen al geladen hebben
+            memory = self._sessions.get(session_id) or loaded
+            if memory is not None:
+                self._remember(memory)
+        if memory is None or time.time() - memory.updated > self.ttl_seconds:
+            return None
+        return memory
+
+    async def history(self, session_id: str) -> List[Dict[str, str]]:
+        memory = await self.memory(session_id)
+        return memory.history() if memory is not None else []
+
+    async def append(self, session_id: str, query: str, answer: str) -> None:
+        memory = await self.memory(session_id) or ConversationMemory(session_id, window=self.max_messages)
+        memory.add_exchange(query, answer)
+        if self.summarizer is None:
+            memory.discard_pending()
+        self._remember(memory)
+        if self._writer is not None:
+            self._writer.submit(self._write, self.store.save, memory)
+        if self.summarizer is not None:
+            # Na het antwoord en buiten de event loop; tot die tijd gaan de berichten letterlijk mee
+            self.summarizer.submit(memory)
+
+    async def delete(self, session_id: str) -> bool:
+        deleted = self._sessions.pop(session_id, None) is not None
+        if self._writer is not None:
+            # Na eventuele saves van dezelfde sessie die nog in de wachtrij staan
+            deleted = await asyncio.wrap_future(self._writer.submit(self.store.delete, session_id)) or deleted
+        return deleted
+
+    def close(self) -> None:
+        """Wait for the queued writes; call on shutdown."""
+        if self._writer is not None:
+            self._writer.shutdown(wait=True)
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    @staticmethod
+    def _write(operation, *args) -> None:
+        try:
+            operation(*args)
+        except Exception:
+            logger.exception("Persisting session state failed")
+
+    def _remember(self, memory: ConversationMemory) -> None:
+        self._sessions[memory.session_id] = memory
+        self._sessions.move_to_end(memory.session_id)
+        now = time.time()
+        while self._sessions:
+            oldest = next(iter(self._sessions.values()))
+            if len(self._sessions) <= self.max_sessions and now - oldest.updated <= self.ttl_seconds:
+                break
+            del self._sessions[oldest.session_id]
+
+
+class SharedRun:
+    """One pipeline run; its events are replayed to every request that joins it, also late ones."""
+
+    def __init__(self):
+        self.events: List[Tuple[str, Any]] = []
+        self.subscribers: List[asyncio.Queue] = []
+        self.task: Optional[asyncio.Task] = None
+
+    def publish(self, kind: str, payload: Any) -> None:
+        self.events.append((kind, payload))
+        for queue in self.subscribers:
+            queue.put_nowait((kind, payload))
+
+
+class Subscription:
+    """A request's view on a SharedRun. Iterate for (event, payload) pairs; always `close()` it."""
+
+    def __init__(self, service: "QAService", key: str, run: SharedRun):
+        self.service = service
+        self.key = key
+        self.run = run
+        self.queue: asyncio.Queue = asyncio.Queue()
+        for event in run.events:
+            self.queue.put_nowait(event)
+        run.subscribers.append(self.queue)
+
+    async def events(self, heartbeat: Optional[float] = None) -> AsyncIterator[Tuple[str, Any]]:
+        """Yields events up to and including "done" or "error"; ("ping", None) after `heartbeat` quiet seconds."""
+        while True:
+            try:
+                kind, payload = await asyncio.wait_for(self.queue.get(), heartbeat)
+            except asyncio.TimeoutError:
+                yield "ping", None
+                continue
+            yield kind, payload
+            if kind in TERMINAL_EVENTS:
+                return
+
+    def close(self) -> None:
+        self.service._unsubscribe(self)
+
+
+class QAService:
+    """
+    Runs questions through an AsyncQAPipeline with coalescing and bounded concurrency.
+
+    `subscribe` either joins an in-flight run of the same question and history or starts
+    a new one. New runs are refused with Overloaded once `max_concurrency` are executing
+    and `max_queue` are waiting; a waiting run gives up after `queue_timeout` seconds.
+    A run whose requests have all gone away is cancelled, including its OpenAI calls.
+    """
+
+    def __init__(
+        self,
+        qa: AsyncQAPipeline,
+        sessions: Optional[SessionStore] = None,
+        max_concurrency: int = 16,
+        max_queue: int = 64,
+        queue_timeout: float = 30.0,
+    ):
+        self.qa = qa
+        self.sessions = sessions if sessions is not None else SessionStore()
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self._slots = asyncio.Semaphore(max_concurrency)
+        self._runs: Dict[str, SharedRun] = {}
+        self.active = 0
+        self.requests = 0
+        self.runs = 0
+        self.coalesced = 0
+        self.rejected = 0
+        self.cancelled = 0
+
+    def subscribe(self, query: str, history: List[Dict[str, str]]) -> Subscription:
+        key = self.coalesce_key(query, history)
+        run = self._runs.get(key)
+        if run is None:
+            if len(self._runs) >= self.max_concurrency + self.max_queue:
+                self.rejected += 1
+                raise Overloaded("Too many questions in progress, try again shortly")
+            run = SharedRun()
+            self._runs[key] = run
+            run.task = asyncio.create_task(self._execute(key, run, query, history))
+            self.runs += 1
+        else:
+            self.coalesced += 1
+        self.requests += 1
+        return Subscription(self, key, run)
+
+    async def answer(self, query: str, session_id: str) -> Dict[str, Any]:
+        """Non-streaming answer, recorded in the session history."""
+        subscription = self.subscribe(query, await self.sessions.history(session_id))
+        try:
+            result: Dict[str, Any] = {"session_id": session_id, "sources": []}
+            async for kind, payload in subscription.events():
+                if kind == "sources":
+                    result["sources"] = payload
+                elif kind == "done":
+                    await self.sessions.append(session_id, query, payload["answer"])
+                    result.update(payload)
+                elif kind == "error":
+                    result["error"] = payload
+            return result
+        finally:
+            subscription.close()
+
+    @staticmethod
+    def coalesce_key(query: str, history: List[Dict[str, str]]) -> str:
+        normalized = " ".join(query.split()).casefold()
+        return hashlib.sha256(json.dumps([normalized, history], ensure_ascii=False).encode("utf-8")).hexdigest()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "requests": self.requests,
+            "runs": self.runs,
+            "coalesced": self.coalesced,
+            "rejected": self.rejected,
+            "cancelled": self.cancelled,
+            "active": self.active,
+            "queued": len(self._runs) - self.active,
+            "sessions": len(self.sessions),
+            **({"summarizer": self.sessions.summarizer.stats()} if self.sessions.summarizer is not None else {}),
+        }
+
+    async def _execute(self, key: str, run: SharedRun, query: str, history: List[Dict[str, str]]) -> None:
+        try:
+            try:
+                await asyncio.wait_for(self._slots.acquire(), self.queue_timeout)
+            except asyncio.TimeoutError:
+                self.rejected += 1
+                run.publish("error", {"status": 503, "message": "Server busy, try again shortly"})
+                return
+            self.active += 1
+            try:
+                callback = instrument_streaming_callback(lambda chunk: run.publish("token", chunk.content))
+                result = await self.qa.run(
+                    query,
+                    history,
+                    streaming_callback=callback,
+                    sources_callback=lambda documents: run.publish("sources", [source_to_dict(d) for d in documents]),
+                )
+            finally:
+                self.active -= 1
+                self._slots.release()
+            run.publish("done", {
+                "answer": result["answer_llm"]["replies"][0],
+                "search_query": result["query_joiner"]["value"],
+                "cache_hit": bool(result["answer_llm"]["meta"][0].get("cache_hit")),
+            })
+        except asyncio.CancelledError:
+            self.cancelled += 1
+            raise
+        except Exception as e:
+            logger.exception("Answering %r failed", query)
+            run.publish("error", {"status": 500, "message": str(e)})
+        finally:
+            if self._runs.get(key) is run:
+                del self._runs[key]
+
+    def _unsubscribe(self, subscription: Subscription) -> None:
+        run = subscription.run
+        if subscription.queue in run.subscribers:
+            run.subscribers.remove(subscription.queue)
+        if not run.subscribers and run.task is not None and not run.task.done():
+            # Niemand wacht meer op het antwoord: stoppen en de plek vrijgeven voor een nieuwe run
+            run.task.cancel()
+            if self._runs.get(subscription.key) is run:
+                del self._runs[subscription.key]
+
+
+def source_to_dict(doc: Document) -> Dict[str, Any]:
+    return {
+        "id": doc.id,
+        "invnr": doc.meta.get("invnr"),
+        "file_path": doc.meta.get("file_path"),
+        "page_number": doc.meta.get("page_number"),
+        "image": doc.meta.get("representatieve\nafbeelding"),
+        "score": doc.score,
+        "content": doc.content,
+    }
+
+def sse(event: str, data: Any = None) -> bytes:
+    if event == "ping":
+        return b": ping\n\n"
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False, default=str)}\n\n".encode("utf-8")
+
+def json_error(status: int, message: str, **headers) -> web.Response:
+    return web.json_response({"error": {"status": status, "message": message}}, status=status, headers=headers)
+
+
+async def read_question(request: web.Request, body: Optional[Dict[str, Any]] = None) -> Tuple[str, str]:
+    """Validated (query, session_id) from a JSON body or the query string; a new session id if none is given."""
+    if body is None:
+        if request.method == "GET":
+            body = dict(request.query)
+        else:
+            try:
+                body = await request.json()
+            except json.JSONDecodeError:
+                raise web.HTTPBadRequest(text="Body must be JSON")
+    query = body.get("query") if isinstance(body, dict) else None
+    if not isinstance(query, str) or not query.strip():
+        raise web.HTTPBadRequest(text="'query' is required")
+    if len(query) > MAX_QUERY_CHARS:
+        raise web.HTTPRequestEntityTooLarge(max_size=MAX_QUERY_CHARS, actual_size=len(query))
+    session_id = body.get("session_id")
+    if session_id is None:
+        session_id = request.app[SERVICE_KEY].sessions.create()
+    elif not isinstance(session_id, str) or not SESSION_ID_RE.match(session_id):
+        raise web.HTTPBadRequest(text="'session_id' must be 1-128 letters, digits, '.', '_' or '-'")
+    return query.strip(), session_id
+
+
+async def chat_stream(request: web.Request) -> web.StreamResponse:
+    service = request.app[SERVICE_KEY]
+    query, session_id = await read_question(request)
+    history = await service.sessions.history(session_id)
+    try:
+        subscription = service.subscribe(query, history)
+    except Overloaded as e:
+        return json_error(503, str(e), **{"Retry-After": "1"})
+    response = web.StreamResponse(headers={
+        "Content-Type": "text/event-stream",
+        "Cache-Control": "no-cache",
+        "X-Accel-Buffering": "no",
+    })
+    try:
+        await response.prepare(request)
+        await response.write(sse("session", {"session_id": session_id}))
+        async for kind, payload in subscription.events(heartbeat=HEARTBEAT_SECONDS):
+            if kind == "done":
+                await service.sessions.append(session_id, query, payload["answer"])
+            await response.write(sse(kind, payload))
+        await response.write_eof()
+        return response
+    except ConnectionResetError:
+        # Client is weg (kiosk gesloten, pagina ververst); close() hieronder stopt de run als niemand meer wacht
+        logger.debug("Client disconnected during %r", query)
+        return response
+    finally:
+        subscription.close()
+
+async def chat(request: web.Request) -> web.Response:
+    service = request.app[SERVICE_KEY]
+    query, session_id = await read_question(request)
+    try:
+        result = await service.answer(query, session_id)
+    except Overloaded as e:
+        return json_error(503, str(e), **{"Retry-After": "1"})
+    if "error" in result:
+        return json_error(result["error"]["status"], result["error"]["message"])
+    return web.json_response(result, dumps=lambda data: json.dumps(data, ensure_ascii=False, default=str))
+
+async def batch(request: web.Request) -> web.Response:
+    """Answers the questions concurrently (within the same limits); each question is answered independently."""
+    service = request.app[SERVICE_KEY]
+    try:
+        body = await request.json()
+    except json.JSONDecodeError:
+        raise web.HTTPBadRequest(text="Body must be JSON")
+    questions = body.get("questions") if isinstance(body, dict) else None
+    if not isinstance(questions, list) or not questions:
+        raise web.HTTPBadRequest(text="'questions' must be a non-empty list")
+    if len(questions) > MAX_BATCH_SIZE:
+        raise web.HTTPRequestEntityTooLarge(max_size=MAX_BATCH_SIZE, actual_size=len(questions))
+    parsed = [await read_question(request, question) for question in questions]
+
+    async def one(query: str, session_id: str) -> Dict[str, Any]:
+        try:
+            return await service.answer(query, session_id)
+        except Overloaded as e:
+            return {"session_id": session_id, "error": {"status": 503, "message": str(e)}}
+
+    answers = await asyncio.gather(*(one(query, session_id) for query, session_id in parsed))
+    return web.json_response(
+        {"answers": answers}, dumps=lambda data: json.dumps(data, ensure_ascii=False, default=str)
+    )
+
+async def get_session(request: web.Request) -> web.Response:
+    sessions = request.app[SERVICE_KEY].sessions
+    session_id = request.match_info["session_id"]
+    memory = await sessions.memory(session_id)
+    if memory is None:
+        raise web.HTTPNotFound()
+    return web.json_response({"session_id": session_id, **memory.to_dict()})
+
+async def delete_session(request: web.Request) -> web.Response:
+    if not await request.app[SERVICE_KEY].sessions.delete(request.match_info["session_id"]):
+        raise web.HTTPNotFound()
+    return web.Response(status=204)
+
+async def health(request: web.Request) -> web.Response:
+    return web.json_response({"status": "ok"})
+
+async def stats(request: web.Request) -> web.Response:
+    return web.json_response(request.app[SERVICE_KEY].stats())
+
+async def metrics(request: web.Request) -> web.Response:
+    registry = get_registry()
+    if registry is None:
+        raise web.HTTPNotFound()
+    return web.Response(text=registry.render_prometheus(), content_type="text/plain")
+
+
+@web.middleware
+async def json_errors(request: web.Request, handler):
+    # Fouten in dezelfde vorm als de 503's en de "error" events
+    try:
+        return await handler(request)
+    except web.HTTPException as e:
+        if e.status < 400:
+            raise
+        return json_error(e.status, e.text or e.reason)
+
+@web.middleware
+async def cors(request: web.Request, handler):
+    if request.method == "OPTIONS":
+        response = web.Response(status=204)
+    else:
+        response = await handler(request)
+    if SERVER_CORS_ORIGIN:
+        response.headers["Access-Control-Allow-Origin"] = SERVER_CORS_ORIGIN
+        response.headers["Access-Control-Allow-Methods"] = "GET, POST, DELETE, OPTIONS"
+        response.headers["Access-Control-Allow-Headers"] = "Content-Type"
+    return response
+
+
+def create_app(service: Optional[QAService] = None, answer_model: str = "gpt-4o-mini") -> web.Application:
+    """The aiohttp application; without `service` the real pipeline is built and warmed up on startup."""
+    app = web.Application(middlewares=[cors, json_errors])
+
+    async def start(app: web.Application) -> None:
+        if service is not None:
+            app[SERVICE_KEY] = service
+            return
+        # Bouwen en opwarmen blokkeert; niet op de event loop
+        await asyncio.to_thread(warm_up, answer_model)
+        app[SERVICE_KEY] = QAService(
+            get_async_qa_pipeline(answer_model),
+            SessionStore(
+                max_sessions=SESSION_MAX_SESSIONS,
+                ttl_seconds=SESSION_TTL,
+                max_messages=SESSION_MAX_MESSAGES,
+                store=get_conversation_store(),
+                summarizer=get_conversation_summarizer(),
+            ),
+            max_concurrency=SERVER_MAX_CONCURRENCY,
+            max_queue=SERVER_MAX_QUEUE,
+            queue_timeout=SERVER_QUEUE_TIMEOUT,
+        )
+
+    async def stop(app: web.Application) -> None:
+        if SERVICE_KEY in app:
+            await asyncio.to_thread(app[SERVICE_KEY].sessions.close)
+
+    app.on_startup.append(start)
+    app.on_cleanup.append(stop)
+    app.router.add_post("/v1/chat/stream", chat_stream)
+    app.router.add_get("/v1/chat/stream", chat_stream)
+    app.router.add_post("/v1/chat", chat)
+    app.router.add_post("/v1/batch", batch)
+    app.router.add_get("/v1/sessions/{session_id}", get_session)
+    app.router.add_delete("/v1/sessions/{session_id}", delete_session)
+    app.router.add_get("/v1/stats", stats)
+    app.router.add_get("/healthz", health)
+    app.router.add_get("/metrics", metrics)
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--model", default="gpt-4o-mini")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    web.run_app(create_app(answer_model=args.model), host=args.host, port=args.port, access_log=None)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,46 @@
+"""
+Cold start of the Streamlit apps.
+
+Importing pipelines pulls in haystack, openai, pandas and every component, which takes
+about a second before any pipeline is built. This module imports nothing heavy, so
+an app can render its first page at once. The imports and the pipeline warm-up then run
+on a background thread while the visitor reads the page and types a question.
+"""
+import logging
+import threading
+from concurrent.futures import Future
+from typing import Any, Dict
+
+logger = logging.getLogger(__name__)
+
+_warm_ups: Dict[str, Future] = {}
+_warm_ups_lock = threading.Lock()
+
+
+def warm_up_in_background(answer_model: str = "gpt-4o-mini") -> "Future[Any]":
+    """
+    Starts pipelines.warm_up(answer_model) on a daemon thread, once per process and model.
+    Call it at the top of the script on every rerun. `.result()` blocks until the QA
+    pipeline is ready and returns it. A failed warm-up is retried on the next call.
+    """
+    with _warm_ups_lock:
+        future = _warm_ups.get(answer_model)
+        if future is None:
+            future = Future()
+            _warm_ups[answer_model] = future
+            threading.Thread(
+                target=_warm_up, args=(answer_model, future), name=f"warm-up-{answer_model}", daemon=True
+            ).start()
+        return future
+
+def _warm_up(answer_model: str, future: Future) -> None:
+    try:
+        from pipelines import warm_up
+
+        future.set_result(warm_up(answer_model))
+    except BaseException as e:
+        logger.exception("Warming up the %s pipeline failed", answer_model)
+        with _warm_ups_lock:
+            if _warm_ups.get(answer_model) is future:
+                del _warm_ups[answer_model]
+        future.set_exception(e)
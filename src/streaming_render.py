@@ -0,0 +1,80 @@
+import logging
+import time
+from typing import TYPE_CHECKING, Any, Dict, List, Optional
+
+if TYPE_CHECKING:
+    # De apps importeren dit bij de eerste pagina; haystack laadt dan nog op de achtergrond
+    from haystack.dataclasses import StreamingChunk
+
+logger = logging.getLogger(__name__)
+
+
+class StreamingRenderer:
+    """
+    Buffers streamed chunks and redraws the answer at most every `min_interval` seconds,
+    or sooner once `max_pending_chars` are waiting. Chunks are collected in a list and
+    only joined on a flush, instead of concatenating and re-rendering per token.
+
+    `placeholder` is anything with a `markdown(text)` method, e.g. `st.empty()`.
+    """
+
+    def __init__(self, placeholder: Any, min_interval: float = 0.08, max_pending_chars: int = 400, cursor: str = "▌"):
+        self.placeholder = placeholder
+        self.min_interval = min_interval
+        self.max_pending_chars = max_pending_chars
+        self.cursor = cursor
+        self.started = time.perf_counter()
+        self.first_chunk: Optional[float] = None
+        self.last_chunk: Optional[float] = None
+        self.chunks = 0
+        self.flushes = 0
+        self._parts: List[str] = []
+        self._pending: List[str] = []
+        self._pending_chars = 0
+        self._last_flush = 0.0
+
+    def __call__(self, chunk: "StreamingChunk") -> None:
+        if not chunk.content:
+            return
+        now = time.perf_counter()
+        if self.first_chunk is None:
+            self.first_chunk = now
+        self.last_chunk = now
+        self.chunks += 1
+        self._pending.append(chunk.content)
+        self._pending_chars += len(chunk.content)
+        # Eerste token meteen tonen, daarna op tijd of hoeveelheid
+        if self.flushes == 0 or now - self._last_flush >= self.min_interval or self._pending_chars >= self.max_pending_chars:
+            self._flush(now, self.cursor)
+
+    def finish(self, text: Optional[str] = None) -> str:
+        """Render the final answer without cursor; `text` overrides what was streamed."""
+        if text is not None:
+            self._parts = [text]
+            self._pending = []
+        self._flush(time.perf_counter(), "")
+        return self.text
+
+    @property
+    def text(self) -> str:
+        return "".join(self._parts) + "".join(self._pending)
+
+    def stats(self) -> Dict[str, Any]:
+        ttft = self.first_chunk - self.started if self.first_chunk is not None else None
+        duration = self.last_chunk - self.first_chunk if self.first_chunk is not None else 0.0
+        return {
+            "ttft": ttft,
+            "chunks": self.chunks,
+            # Chunks van OpenAI zijn (vrijwel) altijd één token
+            "tokens_per_second": (self.chunks - 1) / duration if duration > 0 else None,
+            "flushes": self.flushes,
+        }
+
+    def _flush(self, now: float, suffix: str) -> None:
+        if self._pending:
+            self._parts = ["".join(self._parts + self._pending)]
+            self._pending = []
+            self._pending_chars = 0
+        self.placeholder.markdown(self._parts[0] + suffix if self._parts else suffix)
+        self._last_flush = now
+        self.flushes += 1